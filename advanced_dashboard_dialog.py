@@ -42,50 +42,23 @@ class DataLoadWorker(QThread):
 
     def _load_lines_fast(self):
         """بارگذاری سریع خطوط با کوئری بهینه"""
-        lines_data = []
-
-        # ✅ پاک کردن cache
-        if hasattr(self.dm.get_line_progress, 'cache_clear'):
-            self.dm.get_line_progress.cache_clear()
-
-        session = self.dm.get_session()
-        try:
-            from models import MTOItem, MIVRecord
-            from sqlalchemy import func
-
-            # ✅ یک کوئری برای همه (بهینه)
-            results = session.query(
-                MTOItem.line_no,
-                func.max(MIVRecord.last_updated).label('last_activity')
-            ).outerjoin(
-                MIVRecord,
-                (MIVRecord.project_id == self.project_id) &
-                (MIVRecord.line_no == MTOItem.line_no)
-            ).filter(
-                MTOItem.project_id == self.project_id
-            ).group_by(MTOItem.line_no).all()
-
-            for line_no, last_activity in results:
-                progress_info = self.dm.get_line_progress(
-                    self.project_id,
-                    line_no,
-                    readonly=False
-                )
-
-                lines_data.append({
-                    "Line No": line_no,
-                    "Progress (%)": round(progress_info.get("percentage", 0), 2),
-                    "Total (inch-dia)": round(progress_info.get("total_weight", 0), 2),
-                    "Used (inch-dia)": round(progress_info.get("done_weight", 0), 2),
-                    "Status": "Complete" if progress_info.get("percentage", 0) >= 99.9 else "In-Progress",
-                    "Last Activity Date": last_activity.strftime('%Y-%m-%d') if last_activity else "N/A"
-                })
-
-            lines_data.sort(key=lambda x: x["Progress (%)"], reverse=True)
-            return lines_data
+        # ✅ یک کوئری گروهی برای همه خطوط (پیشرفت + آخرین فعالیت MIV)
+        rows = self.dm.get_line_status_rows(self.project_id, initialize_missing=True)
+
+        lines_data = [
+            {
+                "Line No": row["line_no"],
+                "Progress (%)": round(row["percentage"], 2),
+                "Total (inch-dia)": round(row["total_weight"], 2),
+                "Used (inch-dia)": round(row["done_weight"], 2),
+                "Status": "Complete" if row["percentage"] >= 99.9 else "In-Progress",
+                "Last Activity Date": row["last_activity"].strftime('%Y-%m-%d') if row["last_activity"] else "N/A"
+            }
+            for row in rows
+        ]
 
-        finally:
-            session.close()
+        lines_data.sort(key=lambda x: x["Progress (%)"], reverse=True)
+        return lines_data
 
 
 class AdvancedDashboardDialog(QDialog):
@@ -1255,63 +1228,21 @@ class AdvancedDashboardDialog(QDialog):
             QMessageBox.critical(self, "Export Error", f"Failed to export data:\n{e}")
 
     def load_lines_data(self):
-        """بارگذاری داده‌های خطوط با پاک کردن cache"""
+        """بارگذاری داده‌های خطوط (cache پیشرفت بعد از هر ثبت/ویرایش خودش نامعتبر می‌شود)"""
         try:
             self.lines_data = []
 
-            # ✅ پاک کردن cache
-            if hasattr(self.dm.get_line_progress, 'cache_clear'):
-                self.dm.get_line_progress.cache_clear()
-                logging.info("🔄 Cleared get_line_progress cache")
-
-            # ✅ دریافت لیست خطوط
-            session = self.dm.get_session()
-            try:
-                from models import MTOItem
-                lines = session.query(MTOItem.line_no).filter(
-                    MTOItem.project_id == self.project_id
-                ).distinct().all()
-
-                line_numbers = [line[0] for line in lines]
-                logging.info(f"📋 Found {len(line_numbers)} unique lines")
-
-            finally:
-                session.close()
-
-            # ✅ محاسبه پیشرفت برای هر خط
-            for line_no in line_numbers:
-                try:
-                    # readonly=False برای rebuild در صورت نیاز
-                    progress_info = self.dm.get_line_progress(
-                        self.project_id,
-                        line_no,
-                        readonly=False
-                    )
-
-                    # دریافت آخرین فعالیت
-                    session = self.dm.get_session()
-                    try:
-                        from models import MIVRecord
-                        from sqlalchemy import func
-                        last_activity = session.query(func.max(MIVRecord.last_updated)).filter(
-                            MIVRecord.project_id == self.project_id,
-                            MIVRecord.line_no == line_no
-                        ).scalar()
-                    finally:
-                        session.close()
-
-                    self.lines_data.append({
-                        "Line No": line_no,
-                        "Progress (%)": round(progress_info.get("percentage", 0), 2),
-                        "Total (inch-dia)": round(progress_info.get("total_weight", 0), 2),
-                        "Used (inch-dia)": round(progress_info.get("done_weight", 0), 2),
-                        "Status": "Complete" if progress_info.get("percentage", 0) >= 99.9 else "In-Progress",
-                        "Last Activity Date": last_activity.strftime('%Y-%m-%d') if last_activity else "N/A"
-                    })
-
-                except Exception as e:
-                    logging.error(f"⚠️ Error loading progress for line {line_no}: {e}")
-                    continue
+            # ✅ وضعیت همه خطوط از جدول خلاصه پیشرفت (readonly=False: خطوط مقداردهی‌نشده ساخته می‌شوند)
+            rows = self.dm.get_line_status_rows(self.project_id, initialize_missing=True)
+            for row in rows:
+                self.lines_data.append({
+                    "Line No": row["line_no"],
+                    "Progress (%)": round(row["percentage"], 2),
+                    "Total (inch-dia)": round(row["total_weight"], 2),
+                    "Used (inch-dia)": round(row["done_weight"], 2),
+                    "Status": "Complete" if row["percentage"] >= 99.9 else "In-Progress",
+                    "Last Activity Date": row["last_activity"].strftime('%Y-%m-%d') if row["last_activity"] else "N/A"
+                })
 
             # ✅ مرتب‌سازی پیش‌فرض: نزولی بر اساس درصد
             self.lines_data.sort(key=lambda x: x["Progress (%)"], reverse=True)
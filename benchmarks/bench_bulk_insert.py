@@ -0,0 +1,104 @@
+# benchmarks/bench_bulk_insert.py
+"""
+درج گروهی MTO با DataManager._bulk_insert_dataframe (COPY روی PostgreSQL، executemany تکه‌ای روی سایر
+دیتابیس‌ها) در برابر bulk_insert_mappings قبلی. هر اجرا داخل یک تراکنش است که در پایان rollback می‌شود.
+به صورت پیش‌فرض روی یک فایل SQLite موقت اجرا می‌شود؛ برای PostgreSQL آدرس یک دیتابیس تست را در
+MIT_TEST_DATABASE_URL بگذارید.
+اجرا از ریشه‌ی مخزن:  python benchmarks/bench_bulk_insert.py [تعداد ردیف ...]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+import pandas as pd  # noqa: E402
+from sqlalchemy import create_engine, func, select  # noqa: E402
+
+from conftest import TEST_DATABASE_URL_ENV, make_data_manager  # noqa: E402
+from models import MTOItem, Project  # noqa: E402
+
+REPEAT = 3
+
+
+def mto_dataframe(count):
+    """ستون‌های متنی و عددی مثل خروجی _read_mto_dataframe (عددها هنوز به صورت متن)."""
+    rng = random.Random(count)
+    return pd.DataFrame({
+        'unit': 'U1',
+        'line_no': [f'10"-P-{i % 2000:05d}-A1A' for i in range(count)],
+        'item_class': 'A1A',
+        'item_type': [rng.choice(['PIPE', 'ELBOW', 'FLANGE']) for _ in range(count)],
+        'description': [f'ELBOW 90, LR "{i}"' for i in range(count)],
+        'item_code': [f'IC{i:07d}' for i in range(count)],
+        'material_code': 'CS',
+        'p1_bore_in': [str(rng.choice([2, 4, 6, ''])) for _ in range(count)],
+        'length_m': '1.5',
+        'quantity': '2',
+        'inch_dia': '3',
+    })
+
+
+def load_with_bulk_insert_dataframe(dm, session, df):
+    dm._bulk_insert_dataframe(session, MTOItem, df)
+
+
+def load_with_bulk_insert_mappings(dm, session, df):
+    """مسیر قبلی: تبدیل به dict و bulk_insert_mappings."""
+    records = df.copy()
+    for column in ('p1_bore_in', 'length_m', 'quantity', 'inch_dia'):
+        records[column] = pd.to_numeric(records[column], errors='coerce')
+    records = records.astype(object)
+    session.bulk_insert_mappings(MTOItem, records.where(records.notna(), None).to_dict(orient='records'))
+
+
+def timed(dm, project_id, df, load):
+    """میانگین زمان درج (ثانیه) و تعداد ردیف‌های درج‌شده."""
+    elapsed, inserted = 0.0, 0
+    for _ in range(REPEAT):
+        session = dm.get_session()
+        try:
+            start = time.perf_counter()
+            load(dm, session, df)
+            session.flush()
+            elapsed += time.perf_counter() - start
+            inserted = session.scalar(select(func.count()).where(MTOItem.project_id == project_id))
+        finally:
+            session.rollback()
+            session.close()
+    return elapsed / REPEAT, inserted
+
+
+def main(sizes):
+    url = os.getenv(TEST_DATABASE_URL_ENV)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(url) if url else create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        dm = make_data_manager(engine)
+        session = dm.get_session()
+        try:
+            project = Project(name=f"BENCH-{uuid.uuid4().hex[:8]}")
+            session.add(project)
+            session.commit()
+            project_id = project.id
+        finally:
+            session.close()
+
+        method = "COPY" if engine.dialect.name == "postgresql" else "executemany"
+        for size in sizes:
+            df = mto_dataframe(size).assign(project_id=project_id)
+            new_s, new_rows = timed(dm, project_id, df, load_with_bulk_insert_dataframe)
+            old_s, old_rows = timed(dm, project_id, df, load_with_bulk_insert_mappings)
+            print(f"{engine.dialect.name} {size:>8} rows: {method} {new_s:6.2f}s ({size / new_s:9.0f} rows/s) | "
+                  f"bulk_insert_mappings {old_s:6.2f}s ({size / old_s:9.0f} rows/s) | "
+                  f"rows {new_rows}/{old_rows}")
+        dm.shutdown()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000])
@@ -0,0 +1,90 @@
+# benchmarks/bench_fuzzy_line_matcher.py
+"""
+مقایسه‌ی FuzzyLineMatcher با حلقه‌ی difflib قبلی suggest_line_no روی شماره خط‌های تصادفی.
+اجرا از ریشه‌ی مخزن:  python benchmarks/bench_fuzzy_line_matcher.py [تعداد خط‌ها ...]
+"""
+
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ngram_index import FuzzyLineMatcher  # noqa: E402
+
+QUERIES = 30
+
+
+def random_line_nos(rng, count):
+    return [f'{rng.choice([2, 4, 6, 8, 10, 12])}"-{rng.choice(["P", "W", "G", "FG"])}-'
+            f'{rng.randint(1, 99999):05d}-{rng.choice(["A1A", "B2C", "C1"])}' for _ in range(count)]
+
+
+def typo_queries(rng, lines, count):
+    """خط‌های موجود با حداکثر سه حذف/درج/جایگزینی."""
+    queries = []
+    for _ in range(count):
+        chars = list(rng.choice(lines))
+        for _ in range(rng.randint(0, 3)):
+            position = rng.randrange(len(chars))
+            operation = rng.random()
+            if operation < 0.33:
+                del chars[position]
+            elif operation < 0.66:
+                chars.insert(position, rng.choice("0123456789-P"))
+            else:
+                chars[position] = rng.choice("0123456789")
+        queries.append("".join(chars))
+    return queries
+
+
+def difflib_suggest(lines, text):
+    """حلقه‌ی difflib قبلی suggest_line_no."""
+    norm_input = str(text).replace(" ", "").lower()
+    best_match, best_ratio = None, 0
+    for line in lines:
+        ratio = difflib.SequenceMatcher(None, norm_input, str(line).replace(" ", "").lower()).ratio()
+        if ratio > best_ratio:
+            best_ratio, best_match = ratio, line
+    return best_match if best_ratio > 0.6 else None
+
+
+def matcher_suggest(matcher, text):
+    suggestions = matcher.search(text, top_k=1, min_score=0.6)
+    return suggestions[0][0] if suggestions and suggestions[0][1] > 0.6 else None
+
+
+def ratio(query, line):
+    if line is None:
+        return None
+    return difflib.SequenceMatcher(None, FuzzyLineMatcher.normalize(query), FuzzyLineMatcher.normalize(line)).ratio()
+
+
+def timed(function, queries):
+    start = time.perf_counter()
+    results = [function(query) for query in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main(sizes):
+    for size in sizes:
+        rng = random.Random(size)
+        lines = list(dict.fromkeys(random_line_nos(rng, size)))
+        queries = typo_queries(rng, lines, QUERIES)
+
+        start = time.perf_counter()
+        matcher = FuzzyLineMatcher(lines)
+        build_ms = (time.perf_counter() - start) * 1000
+        matched, matcher_ms = timed(lambda query: matcher_suggest(matcher, query), queries)
+        expected, difflib_ms = timed(lambda query: difflib_suggest(lines, query), queries)
+
+        # در امتیاز برابر، difflib اولین خط و matcher کوچک‌ترین نام را برمی‌گرداند؛ پس امتیازها مقایسه می‌شوند
+        same_scores = all(ratio(query, a) == ratio(query, b) for query, a, b in zip(queries, matched, expected))
+        print(f"{len(lines):>7} lines: build {build_ms:7.1f} ms | matcher {matcher_ms:7.2f} ms/query | "
+              f"difflib {difflib_ms:8.1f} ms/query | x{difflib_ms / matcher_ms:5.1f} | same scores: {same_scores}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [2000, 20000, 100000])
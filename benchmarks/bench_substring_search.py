@@ -0,0 +1,111 @@
+# benchmarks/bench_substring_search.py
+"""
+جستجوی زیررشته روی miv_records با ایندکس (pg_trgm روی PostgreSQL، ColumnNGramIndex روی SQLite) در برابر
+ILIKE بدون ایندکس.
+به صورت پیش‌فرض روی SQLite درون‌حافظه‌ای اجرا می‌شود؛ برای PostgreSQL آدرس یک دیتابیس تست را در
+MIT_TEST_DATABASE_URL بگذارید (MIVهای بنچمارک در پایان حذف می‌شوند؛ پروژه‌ی BENCH-* مثل تست‌ها می‌ماند).
+اجرا از ریشه‌ی مخزن:  python benchmarks/bench_substring_search.py [تعداد MIV]
+"""
+
+import os
+import random
+import string
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+from sqlalchemy import create_engine, delete, insert, select, text  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+from conftest import TEST_DATABASE_URL_ENV, make_data_manager, seed_project  # noqa: E402
+from data_manager import SUBSTRING_SEARCH_COLUMNS  # noqa: E402
+from models import MIVRecord  # noqa: E402
+
+TERMS = {
+    'miv_tag': ['0123456', 'KQZ', '-0999', 'NOPE-XYZ'],
+    'miv_registered_for': ['SARA-12', 'HAMID', 'NOPE-XYZ'],
+}
+REPEAT = 3
+CHUNK = 50000
+
+
+def make_engine():
+    url = os.getenv(TEST_DATABASE_URL_ENV)
+    if url:
+        return create_engine(url)
+    return create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+
+
+def seed_mivs(dm, project_id, count):
+    rng = random.Random(0)
+    people = [f"{rng.choice(['ALI', 'REZA', 'SARA', 'MINA', 'HAMID', 'NIMA'])}-{i}" for i in range(3000)]
+    rows = [{
+        'project_id': project_id, 'line_no': f'10"-P-{i % 20000:05d}-A1',
+        'miv_tag': f"MIV-{i:07d}-{''.join(rng.choices(string.ascii_uppercase, k=3))}",
+        'registered_for': rng.choice(people), 'registered_by': rng.choice(people), 'status': 'OK',
+    } for i in range(count)]
+    with dm.engine.begin() as conn:
+        for start in range(0, count, CHUNK):
+            conn.execute(insert(MIVRecord), rows[start:start + CHUNK])
+        if dm.engine.dialect.name == "postgresql":
+            conn.execute(text("ANALYZE miv_records"))
+
+
+def plain_condition(key, term):
+    """همان شرط _substring_condition بدون ایندکس n-gram."""
+    model_class, column_name = SUBSTRING_SEARCH_COLUMNS[key]
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return getattr(model_class, column_name).ilike(f"%{escaped}%", escape='\\')
+
+
+def run(session, project_id, conditions):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        counts = [len(session.execute(
+            select(MIVRecord.id).where(MIVRecord.project_id == project_id, condition())
+        ).all()) for condition in conditions]
+    return counts, (time.perf_counter() - start) / (REPEAT * len(conditions)) * 1000
+
+
+def main(count):
+    dm = make_data_manager(make_engine())
+    dialect = dm.engine.dialect.name
+    project_id = seed_project(dm, project_name=f"BENCH-{uuid.uuid4().hex[:8]}", n_items=1)
+    try:
+        start = time.perf_counter()
+        seed_mivs(dm, project_id, count)
+        print(f"{dialect}: {count} MIV records seeded in {time.perf_counter() - start:.1f}s")
+
+        session = dm.get_session()
+        try:
+            for key, terms in TERMS.items():
+                # ساخت ایندکس درون‌حافظه‌ای (SQLite) جزو زمان جستجو حساب نمی‌شود
+                start = time.perf_counter()
+                dm._substring_condition(session, key, terms[0])
+                build_ms = (time.perf_counter() - start) * 1000
+
+                indexed, indexed_ms = run(session, project_id, [
+                    lambda term=term: dm._substring_condition(session, key, term) for term in terms])
+                if dialect == "postgresql":
+                    # بدون حذف ایندکس GIN: فقط برای این تراکنش استفاده از آن غیرفعال می‌شود
+                    session.execute(text("SET LOCAL enable_bitmapscan = off"))
+                    session.execute(text("SET LOCAL enable_indexscan = off"))
+                plain, plain_ms = run(session, project_id, [lambda term=term: plain_condition(key, term)
+                                                            for term in terms])
+                session.rollback()
+                print(f"{key:>20}: indexed {indexed_ms:8.2f} ms/search (first call {build_ms:7.1f} ms) | "
+                      f"plain ILIKE {plain_ms:8.2f} ms/search | same results: {indexed == plain} {indexed}")
+        finally:
+            session.close()
+    finally:
+        with dm.engine.begin() as conn:
+            conn.execute(delete(MIVRecord).where(MIVRecord.project_id == project_id))
+        dm.shutdown()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -31,6 +31,15 @@ DB_NAME = config.get('PostgreSQL', 'dbname', fallback='miv_db').strip()
 DB_USER = config.get('PostgreSQL', 'user', fallback='').strip()
 DB_PASSWORD = config.get('PostgreSQL', 'password', fallback='').strip()
 
+# --- تنظیمات connection pool ---
+DB_POOL_SIZE = config.getint('Pool', 'pool_size', fallback=10)
+DB_MAX_OVERFLOW = config.getint('Pool', 'max_overflow', fallback=20)
+DB_POOL_TIMEOUT = config.getfloat('Pool', 'pool_timeout', fallback=30)
+DB_POOL_RECYCLE = config.getint('Pool', 'pool_recycle', fallback=1800)
+DB_POOL_PRE_PING = config.getboolean('Pool', 'pool_pre_ping', fallback=True)
+DB_STATEMENT_TIMEOUT_MS = config.getint('Pool', 'statement_timeout_ms', fallback=0)
+DB_LONG_HELD_SECONDS = config.getfloat('Pool', 'long_held_seconds', fallback=60)
+
 # --- استخراج بقیه مقادیر ---
 ISO_PATH = config.get('Paths', 'iso_drawing_path', fallback=r'\\fs\Piping\Piping\ISO').strip()
 DASHBOARD_PASSWORD = config.get('Security', 'dashboard_password', fallback='default_password').strip()
@@ -2,25 +2,40 @@
 
 import os
 import sys
-
-from sqlalchemy import create_engine, func, desc
+import csv
+import json
+import base64
+import atexit
+import threading
+
+from sqlalchemy import create_engine, func, desc, event, insert, update, select, case, cast, literal, exists, \
+    Integer, Float, String, Date, DateTime, union_all, and_, or_, false, text, bindparam
 from sqlalchemy.orm import sessionmaker, joinedload
-from functools import lru_cache
-from datetime import datetime
+from contextlib import contextmanager
+from collections import defaultdict, deque, OrderedDict
+from datetime import datetime, timedelta
 from models import Base, Project, MIVRecord, MTOItem, MTOConsumption, ActivityLog, MTOProgress, Spool, SpoolItem, \
-    SpoolConsumption, SpoolProgress, IsoFileIndex
+    SpoolConsumption, SpoolProgress, IsoFileIndex, IsoDirectorySignature, LineProgressSummary, \
+    ProjectProgressSummary, DailyConsumptionRollup
 import numpy as np
 import pandas as pd
-import difflib
 # data_manager.py (در ابتدای فایل)
 import logging
 import re
 from typing import Tuple, List, Dict, Any
 import glob
 import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
-from config_manager import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME
+from iso_crawler import IsoDirectoryCrawler
+from ngram_index import ColumnNGramIndex, LineSuggestionIndex, FuzzyLineMatcher, IsoNameIndex, normalize_line_key
+from config_manager import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, DB_POOL_SIZE, DB_MAX_OVERFLOW, \
+    DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT_MS, DB_LONG_HELD_SECONDS
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.pool import QueuePool, NullPool
 from urllib.parse import quote_plus
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -35,6 +50,472 @@ SPOOL_TYPE_MAPPING = {
 
     # ... شما می‌توانید آیتم‌های بیشتری به اینجا اضافه کنید
 }
+
+
+def _chunks(items, size=1000):
+    """لیست را به تکه‌های حداکثر size عضوی تقسیم می‌کند (برای فیلترهای IN بزرگ)."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# نگاشت ستون‌های نرمال‌شده فایل MTO به ستون‌های دیتابیس
+MTO_REQUIRED_DB_COLS = {'line_no', 'description'}
+MTO_COLUMN_MAP = {
+    'UNIT': 'unit', 'LINENO': 'line_no', 'CLASS': 'item_class', 'TYPE': 'item_type',
+    'DESCRIPTION': 'description', 'ITEMCODE': 'item_code', 'MAT': 'material_code',
+    'P1BOREIN': 'p1_bore_in', 'P2BOREIN': 'p2_bore_in', 'P3BOREIN': 'p3_bore_in',
+    'LENGTHM': 'length_m', 'QUANTITY': 'quantity', 'JOINT': 'joint', 'INCHDIA': 'inch_dia'
+}
+MTO_NUMERIC_COLS = ('p1_bore_in', 'p2_bore_in', 'p3_bore_in', 'length_m', 'quantity', 'joint', 'inch_dia')
+
+# نگاشت ستون‌های فایل‌های Spools.csv و SpoolItems.csv
+SPOOL_REQUIRED_DB_COLS = {"spool_id"}
+SPOOL_ITEM_REQUIRED_DB_COLS = {"spool_id_str", "component_type"}
+SPOOL_COLUMN_MAP = {
+    "SPOOLID": "spool_id", "ROWNO": "row_no", "LOCATION": "location", "COMMAND": "command"
+}
+SPOOL_ITEM_COLUMN_MAP = {
+    "SPOOLID": "spool_id_str", "COMPONENTTYPE": "component_type", "CLASSANGLE": "class_angle",
+    "P1BORE": "p1_bore", "P2BORE": "p2_bore", "MATERIAL": "material", "SCHEDULE": "schedule",
+    "THICKNESS": "thickness", "LENGTH": "length", "QTYAVAILABLE": "qty_available", "ITEMCODE": "item_code"
+}
+SPOOL_NUMERIC_COLS = ('row_no',)
+SPOOL_ITEM_NUMERIC_COLS = ('class_angle', 'p1_bore', 'p2_bore', 'thickness', 'length', 'qty_available')
+
+# کلید شناسایی آیتم‌های اسپول (داخل هر اسپول) و ستون‌هایی که در merge به‌روزرسانی می‌شوند
+SPOOL_MERGE_VALUE_COLUMNS = ['row_no', 'location', 'command']
+SPOOL_ITEM_MERGE_KEY_COLUMNS = ['component_type', 'class_angle', 'p1_bore', 'p2_bore', 'material', 'schedule',
+                                'thickness', 'item_code']
+SPOOL_ITEM_MERGE_VALUE_COLUMNS = ['length', 'qty_available']
+
+# تنظیمات نوشتن گروهی لاگ‌ها (ActivityLogWriter)
+ACTIVITY_LOG_BATCH_SIZE = 50
+ACTIVITY_LOG_FLUSH_INTERVAL = 2.0  # ثانیه
+ACTIVITY_LOG_MAX_PENDING = 10000
+
+# ستون‌هایی که جستجوی زیررشته (ILIKE '%term%') روی آن‌ها انجام می‌شود:
+# روی PostgreSQL با ایندکس GIN از pg_trgm و روی SQLite با ایندکس n-gram درون‌حافظه‌ای (ngram_index.py)
+SUBSTRING_SEARCH_COLUMNS = {
+    'miv_tag': (MIVRecord, 'miv_tag'),
+    'miv_registered_for': (MIVRecord, 'registered_for'),
+    'miv_registered_by': (MIVRecord, 'registered_by'),
+    'mto_line_no': (MTOItem, 'line_no'),
+    'progress_item_code': (MTOProgress, 'item_code'),
+    'progress_description': (MTOProgress, 'description'),
+}
+# اگر ایندکس n-gram بیش از این تعداد مقدار پیدا کند، فیلتر IN کمکی نمی‌کند و همان LIKE اجرا می‌شود
+NGRAM_MAX_CANDIDATES = 2000
+# فاصله بررسی تغییرات iso_file_index توسط کلاینت‌های دیگر برای ایندکس نام فایل‌های ISO (ثانیه)
+ISO_NAME_INDEX_SYNC_SECONDS = 30.0
+# تعداد threadهای پیمایش پوشه‌ی ISO (I/O-bound روی SMB) و اندازه‌ی دسته‌های نوشتن در دیتابیس
+ISO_CRAWL_WORKERS = 16
+ISO_CRAWL_BATCH_SIZE = 500
+_WRITE_STATEMENT_RE = re.compile(r'\s*(INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+"?(\w+)"?', re.IGNORECASE)
+
+# صفحه‌بندی جستجوی MIV (search_miv) و سقف شمارش دقیق نتایج
+MIV_SEARCH_PAGE_SIZE = 200
+MIV_SEARCH_MAX_PAGE_SIZE = 1000
+SEARCH_COUNT_CAP = 10000
+# ترتیب keyset جستجوی MIV: (ستون, نزولی؟)
+MIV_SEARCH_ORDER = [(MIVRecord.last_updated, True), (MIVRecord.id, True)]
+
+# کلیدهای مرتب‌سازی مجاز گزارش موجودی اسپول؛ SpoolItem.id همیشه به عنوان کلید یکتای آخر اضافه می‌شود.
+# spool_id (unique)، location (ix_spools_location) و component_type/p1_bore (ix_spool_items_component_bore) ایندکس دارند.
+# کلیدهای سطح اسپول با Spool.id ادامه پیدا می‌کنند تا ترتیب از ایندکس + ix_spool_items_spool_fk خوانده شود.
+SPOOL_INVENTORY_SORT_KEYS = {
+    'spool_id': [Spool.spool_id, Spool.id],
+    'location': [Spool.location, Spool.id],
+    'component_type': [SpoolItem.component_type, SpoolItem.p1_bore],
+    'p1_bore': [SpoolItem.p1_bore],
+    'item_code': [SpoolItem.item_code],
+    'material': [SpoolItem.material],
+    'schedule': [SpoolItem.schedule],
+}
+SPOOL_INVENTORY_MAX_PAGE_SIZE = 1000
+
+# حداکثر تعداد ورودی‌های cache پیشرفت پروژه/خط (ProgressCache)
+PROGRESS_CACHE_MAX_ENTRIES = 2048
+# فاصله‌ی بررسی تغییرات mto_items/projects توسط پروسه‌های دیگر برای ایندکس پیشنهاد خط و matcherهای فازی
+LINE_SUGGESTIONS_SYNC_SECONDS = 30.0
+# عمر هر ورودی cache پیشرفت؛ نوشتن‌های پروسه‌های دیگر (report_api، سایر کاربران) حداکثر با این تأخیر دیده می‌شوند
+PROGRESS_CACHE_TTL_SECONDS = 10.0
+
+# فایل‌های MTO بزرگ‌تر از این حجم به صورت تکه‌تکه (streaming) خوانده و درج می‌شوند
+MTO_STREAMING_THRESHOLD_BYTES = 64 * 1024 * 1024
+MTO_STREAMING_CHUNK_ROWS = 50000
+
+# کلید شناسایی یک آیتم MTO بین دو ریویژن و ستون‌هایی که در merge به‌روزرسانی می‌شوند
+MTO_MERGE_KEY_COLUMNS = ['line_no', 'item_code', 'description', 'p1_bore_in', 'p2_bore_in', 'p3_bore_in']
+MTO_MERGE_VALUE_COLUMNS = ['unit', 'item_class', 'item_type', 'material_code', 'length_m', 'quantity', 'joint', 'inch_dia']
+# اندازه‌ی صفحه‌ی پیمایش آیتم‌های پروژه برای پیدا کردن آیتم‌های حذف‌شده در ادغام MTO
+MTO_MERGE_SCAN_PAGE_SIZE = 10000
+
+
+def _parse_mto_file(mto_file_path: str) -> pd.DataFrame:
+    """پارس و نرمال‌سازی یک فایل MTO؛ در سطح ماژول تا در process pool قابل اجرا باشد."""
+    return DataManager._read_mto_dataframe(mto_file_path)
+
+
+class _DataFrameCsvStream:
+    """
+    یک شیء file-like فقط‌خواندنی که DataFrame را تکه‌به‌تکه به CSV تبدیل می‌کند.
+    برای تغذیه‌ی COPY FROM STDIN استفاده می‌شود تا کل فایل CSV یکجا در حافظه ساخته نشود.
+    """
+
+    def __init__(self, df: pd.DataFrame, chunk_size: int = 10000):
+        self._df = df
+        self._chunk_size = chunk_size
+        self._position = 0
+        self._buffer = ""
+
+    def _fill(self, size: int):
+        while (size < 0 or len(self._buffer) < size) and self._position < len(self._df):
+            chunk = self._df.iloc[self._position:self._position + self._chunk_size]
+            self._position += self._chunk_size
+            self._buffer += chunk.to_csv(index=False, header=False, na_rep='', lineterminator='\n')
+
+    def read(self, size: int = -1) -> str:
+        self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size: int = -1) -> str:
+        # copy_expert فقط از read استفاده می‌کند؛ readline برای سازگاری با file-like ها است.
+        while "\n" not in self._buffer and self._position < len(self._df):
+            self._fill(len(self._buffer) + 1)
+        index = self._buffer.find("\n")
+        end = len(self._buffer) if index < 0 else index + 1
+        if 0 <= size < end:
+            end = size
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+
+class ActivityLogWriter:
+    """
+    نوشتن با تأخیر (write-behind) لاگ‌های ActivityLog.
+    لاگ‌ها در صف نگه داشته می‌شوند و با رسیدن به batch_size یا گذشت flush_interval ثانیه
+    توسط یک thread پس‌زمینه با INSERT چندردیفی در یک تراکنش نوشته می‌شوند.
+    """
+
+    def __init__(self, session_factory, batch_size: int = ACTIVITY_LOG_BATCH_SIZE,
+                 flush_interval: float = ACTIVITY_LOG_FLUSH_INTERVAL, max_pending: int = ACTIVITY_LOG_MAX_PENDING):
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, name="ActivityLogWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, user, action, details=""):
+        """یک لاگ را به صف اضافه می‌کند؛ بعد از بسته شدن writer، لاگ بلافاصله نوشته می‌شود."""
+        entry = {'user': user, 'action': action, 'details': details, 'timestamp': datetime.now()}
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self._pending.popleft()
+                logging.warning("ActivityLog queue is full; oldest entry dropped.")
+            self._pending.append(entry)
+            batch_ready = len(self._pending) >= self.batch_size
+
+        if self._stopped.is_set():
+            self.flush()
+        elif batch_ready:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """تمام لاگ‌های صف را در یک تراکنش می‌نویسد و تعداد نوشته‌شده‌ها را برمی‌گرداند."""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+                self._pending.clear()
+            if not batch:
+                return 0
+
+            session = self._session_factory()
+            try:
+                # INSERT چندردیفی؛ تکه‌بندی برای ماندن زیر سقف پارامترهای دیتابیس
+                for chunk in _chunks(batch, 500):
+                    session.execute(insert(ActivityLog).values(chunk))
+                session.commit()
+                return len(batch)
+            except Exception as e:
+                session.rollback()
+                logging.error(f"⚠️ خطا در نوشتن گروهی لاگ‌ها ({len(batch)} مورد): {e}")
+                # برگرداندن به ابتدای صف برای تلاش مجدد در نوبت بعد
+                with self._lock:
+                    self._pending.extendleft(reversed(batch))
+                    while len(self._pending) > self.max_pending:
+                        self._pending.pop()
+                return 0
+            finally:
+                session.close()
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """thread پس‌زمینه را متوقف کرده و باقی‌مانده‌ی صف را می‌نویسد (هنگام خروج برنامه)."""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+
+_activity_writer_lock = threading.Lock()
+
+
+class PoolStats:
+    """
+    آمار سلامت connection pool که از رویدادهای pool جمع‌آوری می‌شود:
+    تعداد checkout، زمان انتظار برای گرفتن اتصال، استفاده از overflow، invalidation و اتصال‌های طولانی.
+    """
+
+    def __init__(self, long_held_seconds: float = DB_LONG_HELD_SECONDS):
+        self.long_held_seconds = long_held_seconds
+        self._engine = None
+        self._lock = threading.Lock()
+        self._held = {}  # id(connection_record) -> زمان checkout
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.overflow_peak = 0
+        self.long_held_total = 0
+        self.held_max = 0.0
+
+    def attach(self, engine):
+        """ثبت listenerها روی pool یک engine."""
+        self._engine = engine
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "invalidate", self._on_invalidate)
+        event.listen(engine, "soft_invalidate", self._on_invalidate)
+        if isinstance(engine.pool, _InstrumentedQueuePool):
+            engine.pool.stats = self
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        pool = self._engine.pool if self._engine is not None else None
+        overflow = pool.overflow() if isinstance(pool, QueuePool) else 0
+        with self._lock:
+            self.checkouts += 1
+            self.overflow_peak = max(self.overflow_peak, overflow)
+            self._held[id(connection_record)] = time.perf_counter()
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checkins += 1
+            started = self._held.pop(id(connection_record), None)
+            if started is None:
+                return
+            held = time.perf_counter() - started
+            self.held_max = max(self.held_max, held)
+            if held > self.long_held_seconds:
+                self.long_held_total += 1
+        if held > self.long_held_seconds:
+            logging.warning(f"DB connection was held for {held:.1f}s (threshold {self.long_held_seconds:.0f}s)")
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self, pool=None) -> Dict[str, Any]:
+        """وضعیت فعلی آمار به صورت dict (برای نمایش در کنسول یا API)."""
+        now = time.perf_counter()
+        with self._lock:
+            held_now = [now - started for started in self._held.values()]
+            stats = {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'wait_count': self.wait_count,
+                'wait_avg_ms': round(self.wait_total / self.wait_count * 1000, 2) if self.wait_count else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 2),
+                'overflow_peak': self.overflow_peak,
+                'long_held_total': self.long_held_total,
+                'long_held_now': sum(1 for held in held_now if held > self.long_held_seconds),
+                'held_max_s': round(max([self.held_max] + held_now), 2),
+            }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+            })
+        return stats
+
+
+class _InstrumentedQueuePool(QueuePool):
+    """QueuePool که مدت انتظار برای گرفتن اتصال را در PoolStats ثبت می‌کند."""
+    stats = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.stats is not None:
+                self.stats.record_wait(time.perf_counter() - started)
+
+    def recreate(self):
+        new_pool = super().recreate()
+        new_pool.stats = self.stats
+        return new_pool
+
+
+class ProgressCache:
+    """
+    cache پیشرفت پروژه و خط با کلید (project_id, line_no)؛ line_no=None یعنی کل پروژه.
+    هر خط یک نسخه دارد که با هر نوشتن روی آن خط (در همین پروسه) عوض می‌شود (نسخه پروژه هم همراه آن بالا می‌رود).
+    مقدار فقط وقتی برگردانده می‌شود که نسخه‌ی ذخیره‌شده با نسخه فعلی برابر باشد و عمرش از ttl نگذشته باشد؛
+    ttl تأخیر دیدن نوشتن‌های پروسه‌های دیگر را محدود می‌کند. ظرفیت محدود است و قدیمی‌ترین ورودی‌ها (LRU) حذف می‌شوند.
+    """
+
+    def __init__(self, max_entries: int = PROGRESS_CACHE_MAX_ENTRIES, ttl: float = PROGRESS_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (project_id, line_no) -> (version, value, stored_at)
+        self._clock = 0  # شمارنده‌ی سراسری نسخه‌ها
+        self._line_versions = {}  # (project_id, line_no) -> آخرین نسخه (مقدار _clock هنگام invalidate)
+        self._line_version_floor = 0  # نسخه‌ی خطوطی که در _line_versions نیستند
+        self._project_versions = {}  # project_id -> int (با هر تغییر در پروژه)
+        self._project_epochs = {}  # project_id -> int (فقط با invalidate کل پروژه، مثل ایمپورت)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _current_version(self, project_id, line_no):
+        if line_no is None:
+            return self._project_versions.get(project_id, 0)
+        return (self._project_epochs.get(project_id, 0),
+                self._line_versions.get((project_id, line_no), self._line_version_floor))
+
+    def version(self, project_id, line_no=None):
+        """نسخه فعلی کلید؛ باید قبل از خواندن از دیتابیس گرفته و همراه put داده شود."""
+        with self._lock:
+            return self._current_version(project_id, line_no)
+
+    def get(self, project_id, line_no=None):
+        """خروجی: (found, value)"""
+        key = (project_id, line_no)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            if entry[0] != self._current_version(project_id, line_no):
+                del self._entries[key]
+                self.stale += 1
+                self.misses += 1
+                return False, None
+            if time.monotonic() - entry[2] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, project_id, line_no, version, value):
+        """ذخیره مقدار؛ اگر در فاصله‌ی خواندن، نوشتنی روی همین کلید انجام شده باشد ذخیره نمی‌شود."""
+        key = (project_id, line_no)
+        with self._lock:
+            if version != self._current_version(project_id, line_no):
+                return
+            self._entries[key] = (version, value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, project_id, line_no=None):
+        """بالا بردن نسخه یک خط (و پروژه‌ی آن)؛ بدون line_no همه خطوط پروژه نامعتبر می‌شوند."""
+        with self._lock:
+            self.invalidations += 1
+            self._project_versions[project_id] = self._project_versions.get(project_id, 0) + 1
+            if line_no is None:
+                self._project_epochs[project_id] = self._project_epochs.get(project_id, 0) + 1
+            else:
+                self._clock += 1
+                self._line_versions[(project_id, line_no)] = self._clock
+                if len(self._line_versions) > 4 * self.max_entries:
+                    self._prune_line_versions()
+
+    def _prune_line_versions(self):
+        """
+        نسخه‌ی خطوطی که ورودی cache ندارند دور ریخته می‌شود تا _line_versions بی‌نهایت بزرگ نشود.
+        نسخه‌ی پیش‌فرض از همه‌ی نسخه‌های داده‌شده بزرگ‌تر می‌شود، پس put‌های در جریان برای آن خطوط رد می‌شوند.
+        """
+        kept = {key: self._line_versions.get(key, self._line_version_floor)
+                for key in self._entries if key[1] is not None}
+        self._clock += 1
+        self._line_version_floor = self._clock
+        self._line_versions = kept
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for project_id in set(self._project_versions) | set(self._project_epochs):
+                self._project_versions[project_id] = self._project_versions.get(project_id, 0) + 1
+                self._project_epochs[project_id] = self._project_epochs.get(project_id, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """آمار hit/miss cache به صورت dict (برای کنسول یا API)."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'stale': self.stale,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
 def resource_path(relative_path):
     try:
         base_path = sys._MEIPASS
@@ -61,14 +542,358 @@ class DataManager:
 
         db_url = f"postgresql+psycopg2://{user_enc}:{pwd_enc}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+        # تنظیمات pool از config.ini (بخش [Pool])
+        connect_args = {}
+        if DB_STATEMENT_TIMEOUT_MS > 0:
+            connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+
         self.engine = create_engine(
             db_url,
             echo=False,
-            pool_size=10,
-            max_overflow=20
+            poolclass=_InstrumentedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+            connect_args=connect_args
         )
+        self.pool_stats = PoolStats()
+        self.pool_stats.attach(self.engine)
         Base.metadata.create_all(self.engine)
+        self._ensure_columns()
+        self._ensure_indexes()
+        self._install_search_indexes()
         self.Session = sessionmaker(bind=self.engine)
+        self._install_progress_cache(self.Session)
+        self._install_line_suggestions(self.Session)
+        # جلوگیری از اجرای همزمان دو اسکن پوشه‌ی ISO (شروع برنامه و اسکن کامل دستی)
+        self._iso_rebuild_lock = threading.Lock()
+
+    def _ensure_columns(self):
+        """
+        create_all ستون جدید به جدول‌های موجود اضافه نمی‌کند؛
+        ستون‌های تعریف‌شده در models که در دیتابیس فعلی نیستند (همراه با server_default) اینجا اضافه می‌شوند.
+        """
+        inspector = sa_inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            try:
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+            except Exception as e:
+                logging.error(f"Error reading columns of {table.name}: {e}")
+                continue
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_ddl = CreateColumn(column).compile(dialect=self.engine.dialect)
+                try:
+                    with self.engine.begin() as conn:
+                        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+                except Exception as e:
+                    logging.error(f"Error adding column {table.name}.{column.name}: {e}")
+
+    def _ensure_indexes(self):
+        """
+        create_all روی جدول‌های موجود ایندکس جدید نمی‌سازد؛
+        ایندکس‌های تعریف‌شده در models که در دیتابیس فعلی نیستند اینجا ساخته می‌شوند.
+        """
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(self.engine, checkfirst=True)
+                except Exception as e:
+                    logging.error(f"Error creating index {index.name}: {e}")
+
+    def _install_search_indexes(self):
+        """
+        ایندکس‌های جستجوی زیررشته برای ستون‌های SUBSTRING_SEARCH_COLUMNS:
+        - PostgreSQL: افزونه pg_trgm و ایندکس GIN (gin_trgm_ops) که ILIKE '%term%' از آن استفاده می‌کند.
+        - سایر دیتابیس‌ها (SQLite): ایندکس n-gram درون‌حافظه‌ای که با رویدادهای نوشتن engine به‌روز می‌شود.
+        ایندکس نام فایل‌های ISO (find_iso_files) روی همه دیتابیس‌ها درون‌حافظه‌ای است.
+        """
+        self.iso_name_index = IsoNameIndex(IsoFileIndex, ISO_NAME_INDEX_SYNC_SECONDS)
+        self._ngram_indexes = {}
+        if self.engine.dialect.name == "postgresql":
+            with self.engine.connect() as conn:
+                try:
+                    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logging.warning(f"افزونه pg_trgm فعال نشد؛ جستجوی زیررشته بدون ایندکس trigram اجرا می‌شود: {e}")
+                    return
+                for model_class, column_name in SUBSTRING_SEARCH_COLUMNS.values():
+                    table_name = model_class.__tablename__
+                    try:
+                        conn.execute(text(
+                            f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_{column_name}_trgm" '
+                            f'ON "{table_name}" USING gin ("{column_name}" gin_trgm_ops)'
+                        ))
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        logging.warning(f"ساخت ایندکس trigram روی {table_name}.{column_name} ناموفق بود: {e}")
+            return
+
+        for key, (model_class, column_name) in SUBSTRING_SEARCH_COLUMNS.items():
+            self._ngram_indexes[key] = ColumnNGramIndex(model_class.id, getattr(model_class, column_name))
+        event.listen(self.engine, "after_cursor_execute", self._on_search_table_write)
+        event.listen(self.engine, "commit", self._on_search_tables_commit)
+        event.listen(self.engine, "rollback", self._on_search_tables_rollback)
+
+    @staticmethod
+    def _on_search_table_write(conn, cursor, statement, parameters, context, executemany):
+        match = _WRITE_STATEMENT_RE.match(statement)
+        if match:
+            kind = match.group(1).split()[0].upper()
+            conn.info.setdefault('search_writes', set()).add((kind, match.group(2).lower()))
+
+    def _on_search_tables_commit(self, conn):
+        writes = conn.info.pop('search_writes', None)
+        if not writes:
+            return
+        for index in self._ngram_indexes.values():
+            for kind, table_name in writes:
+                if table_name != index.table_name:
+                    continue
+                if kind == "INSERT":
+                    index.mark_inserted()
+                else:
+                    index.mark_changed()
+
+    @staticmethod
+    def _on_search_tables_rollback(conn):
+        conn.info.pop('search_writes', None)
+
+    def _substring_condition(self, session, key, term):
+        """
+        شرط جستجوی زیررشته (بدون حساسیت به حروف) روی یکی از ستون‌های SUBSTRING_SEARCH_COLUMNS.
+        % و _ در عبارت کاربر به صورت حرف عادی جستجو می‌شوند.
+        روی SQLite ابتدا مقادیر منطبق از ایندکس n-gram گرفته و به صورت IN به کوئری داده می‌شوند.
+        """
+        model_class, column_name = SUBSTRING_SEARCH_COLUMNS[key]
+        column = getattr(model_class, column_name)
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        condition = column.ilike(f"%{escaped}%", escape='\\')
+
+        index = self._ngram_indexes.get(key)
+        if index is None:
+            return condition
+        values = index.search(session, term, limit=NGRAM_MAX_CANDIDATES)
+        if values is None:
+            return condition
+        if not values:
+            return false()
+        return and_(column.in_(values), condition)
+
+    def _install_progress_cache(self, session_factory):
+        """
+        ساخت ProgressCache و اتصال آن به رویدادهای سشن:
+        خطوطی که داخل یک تراکنش تغییر کرده‌اند (_mark_progress_dirty) قبل از commit در جداول خلاصه
+        به‌روز می‌شوند و بعد از commit در cache نامعتبر می‌شوند.
+        """
+        self.progress_cache = ProgressCache()
+        event.listen(session_factory, "before_commit", self._on_session_before_commit)
+        event.listen(session_factory, "after_commit", self._on_session_commit)
+        event.listen(session_factory, "after_rollback", self._on_session_rollback)
+
+    @staticmethod
+    def _mark_progress_dirty(session, project_id, line_no=None):
+        """ثبت خط (یا کل پروژه با line_no=None) برای به‌روزرسانی خلاصه‌ها و cache پیشرفت هنگام commit سشن."""
+        session.info.setdefault('progress_dirty', set()).add((project_id, line_no))
+
+    @staticmethod
+    def _add_consumption_rollup_delta(session, project_id, line_no, day, mto_qty=0.0, spool_qty=0.0,
+                                      inch_dia=0.0, miv_count=0):
+        """ثبت اختلاف مصرف یک روز خط برای اعمال افزایشی روی daily_consumption_rollup هنگام commit سشن."""
+        delta = session.info.setdefault('rollup_deltas', {}).setdefault(
+            (project_id, line_no, day), [0.0, 0.0, 0.0, 0])
+        delta[0] += mto_qty
+        delta[1] += spool_qty
+        delta[2] += inch_dia
+        delta[3] += miv_count
+
+    @classmethod
+    def _add_miv_rollup_delta(cls, session, project_id, line_no, sign, direct_rows=(), spool_rows=()):
+        """
+        سهم مصرف‌های یک MIV در تجمیع روزانه را اضافه (sign=1) یا کم (sign=-1) می‌کند.
+        direct_rows: [(timestamp, used_qty, inch_dia)] و spool_rows: [(timestamp, used_qty)]؛
+        MIV در هر روزی که مصرف داشته یک بار در miv_count شمرده می‌شود.
+        """
+        per_day = defaultdict(lambda: [0.0, 0.0, 0.0])
+        for timestamp, used_qty, inch_dia in direct_rows:
+            if timestamp is not None:
+                day = per_day[timestamp.date()]
+                day[0] += used_qty or 0
+                day[2] += inch_dia
+        for timestamp, used_qty in spool_rows:
+            if timestamp is not None:
+                per_day[timestamp.date()][1] += used_qty or 0
+        for day, (mto_qty, spool_qty, inch_dia) in per_day.items():
+            cls._add_consumption_rollup_delta(session, project_id, line_no, day,
+                                              sign * mto_qty, sign * spool_qty, sign * inch_dia, sign)
+
+    @staticmethod
+    def _mark_rollup_stale(session, project_id, line_no):
+        """
+        خطی که مصرف‌هایش بدون اختلاف قابل محاسبه تغییر کرده (مثل حذف گروهی مصرف اسپول)؛
+        تجمیع روزانه‌ی آن هنگام commit از روی جداول مصرف بازسازی می‌شود.
+        """
+        session.info.setdefault('rollup_stale', set()).add((project_id, line_no))
+
+    def _on_session_before_commit(self, session):
+        dirty = session.info.get('progress_dirty') or set()
+        rollup_deltas = session.info.pop('rollup_deltas', None) or {}
+        rollup_stale = session.info.pop('rollup_stale', None) or set()
+        if not dirty and not rollup_deltas and not rollup_stale:
+            return
+        lines_by_project = defaultdict(set)
+        for project_id, line_no in dirty:
+            lines_by_project[project_id].add(line_no)
+        rebuilt = {project_id for project_id, line_nos in lines_by_project.items() if None in line_nos}
+
+        # تجمیع روزانه: اختلاف‌های ثبت‌شده‌ی MIVها اعمال و فقط خطوط stale از نو محاسبه می‌شوند
+        # (پروژه‌ای که کامل بازسازی می‌شود، تجمیعش را هم کامل می‌سازد)
+        stale_by_project = defaultdict(set)
+        for project_id, line_no in rollup_stale:
+            if project_id not in rebuilt:
+                stale_by_project[project_id].add(line_no)
+        for project_id, line_nos in stale_by_project.items():
+            self._refresh_consumption_rollup(session, project_id, sorted(line_nos))
+        self._apply_consumption_rollup_deltas(session, {
+            key: delta for key, delta in rollup_deltas.items()
+            if key[0] not in rebuilt and (key[0], key[1]) not in rollup_stale
+        })
+
+        for project_id, line_nos in lines_by_project.items():
+            # None یعنی کل پروژه تغییر کرده (مثل ایمپورت MTO)؛ پروژه‌ای که هنوز خلاصه ندارد هم کامل ساخته می‌شود
+            if None in line_nos or not self._refresh_line_summaries(session, project_id, line_nos):
+                self._refresh_progress_summaries(session, project_id)
+
+    def _on_session_commit(self, session):
+        dirty = session.info.pop('progress_dirty', None)
+        if dirty:
+            for project_id, line_no in dirty:
+                self.progress_cache.invalidate(project_id, line_no)
+
+    @staticmethod
+    def _on_session_rollback(session):
+        session.info.pop('progress_dirty', None)
+        session.info.pop('rollup_deltas', None)
+        session.info.pop('rollup_stale', None)
+
+    def _install_line_suggestions(self, session_factory):
+        """
+        ایندکس درون‌حافظه‌ای پیشنهاد شماره خط؛ با warm_line_suggestions در پس‌زمینه پر می‌شود و
+        پروژه‌هایی که در یک تراکنش علامت خورده‌اند (_mark_line_suggestions_dirty) بعد از commit به‌روز می‌شوند
+        (matcher فازی همان پروژه‌ها هم کنار گذاشته می‌شود تا در استفاده بعدی از نو ساخته شود).
+        تغییرات پروسه‌های دیگر با بررسی دوره‌ای (count, max(id)) جداول mto_items و projects دیده می‌شوند.
+        """
+        self.line_suggestions = LineSuggestionIndex()
+        self._fuzzy_line_matchers: Dict[int, FuzzyLineMatcher] = {}  # project_id -> matcher (suggest_line_no)
+        self._line_suggestions_lock = threading.Lock()
+        self._line_suggestions_loading = False
+        self._line_suggestions_signature = None
+        self._line_suggestions_checked_at = time.monotonic()
+        event.listen(session_factory, "after_commit", self._on_line_suggestions_commit)
+        event.listen(session_factory, "after_rollback", self._on_line_suggestions_rollback)
+
+    @staticmethod
+    def _mark_line_suggestions_dirty(session, project_id):
+        """ثبت پروژه برای به‌روزرسانی ایندکس پیشنهاد خط بعد از commit سشن."""
+        session.info.setdefault('line_suggestions_dirty', set()).add(project_id)
+
+    def _on_line_suggestions_commit(self, session):
+        dirty = session.info.pop('line_suggestions_dirty', None)
+        for project_id in dirty or ():
+            self._fuzzy_line_matchers.pop(project_id, None)
+        if dirty and self.line_suggestions.ready:
+            threading.Thread(target=self._refresh_line_suggestions, args=(dirty,),
+                             name="LineSuggestionsRefresh", daemon=True).start()
+
+    @staticmethod
+    def _on_line_suggestions_rollback(session):
+        session.info.pop('line_suggestions_dirty', None)
+
+    def warm_line_suggestions(self):
+        """شروع بارگذاری ایندکس پیشنهاد خط در یک thread پس‌زمینه (اگر هنوز بارگذاری نشده باشد)."""
+        if self.line_suggestions.ready or self._line_suggestions_loading:
+            return
+        self._line_suggestions_loading = True
+        threading.Thread(target=self._refresh_line_suggestions, name="LineSuggestionsLoader", daemon=True).start()
+
+    def _refresh_line_suggestions(self, project_ids=None):
+        """بارگذاری کامل (project_ids=None) یا جایگزینی خطوط پروژه‌های داده‌شده در ایندکس پیشنهاد خط."""
+        # بارگذاری‌ها پشت سر هم اجرا می‌شوند تا به‌روزرسانی یک پروژه با بارگذاری کامل قدیمی‌تر بازنویسی نشود
+        with self._line_suggestions_lock:
+            session = self.get_session()
+            try:
+                query = (
+                    select(MTOItem.line_no, Project.id, Project.name)
+                    .join(Project, MTOItem.project_id == Project.id)
+                    .where(MTOItem.is_active == True)
+                    .distinct()
+                )
+                if project_ids is None:
+                    # امضا قبل از خواندن گرفته می‌شود تا تغییری که حین بارگذاری رخ دهد در بررسی بعدی دیده شود
+                    self._line_suggestions_signature = self._read_line_suggestions_signature(session)
+                    self.line_suggestions.load(session.execute(query).all())
+                    logging.info(f"ایندکس پیشنهاد خط بارگذاری شد ({len(self.line_suggestions)} کلید).")
+                elif self.line_suggestions.ready:
+                    rows = session.execute(query.where(Project.id.in_(project_ids))).all()
+                    for project_id in project_ids:
+                        self.line_suggestions.replace_project(
+                            project_id, [row for row in rows if row[1] == project_id]
+                        )
+            except Exception as e:
+                logging.error(f"خطا در بارگذاری ایندکس پیشنهاد خط: {e}")
+            finally:
+                self._line_suggestions_loading = False
+                session.close()
+
+    @staticmethod
+    def _read_line_suggestions_signature(session):
+        """امضای (count, max(id)) آیتم‌های فعال MTO و پروژه‌ها؛ با هر ایمپورت یا پروژه‌ی جدید عوض می‌شود."""
+        items = session.execute(select(func.count(), func.max(MTOItem.id)).where(MTOItem.is_active == True)).one()
+        projects = session.execute(select(func.count(), func.max(Project.id))).one()
+        return tuple(items) + tuple(projects)
+
+    def _check_line_suggestions(self):
+        """هر LINE_SUGGESTIONS_SYNC_SECONDS ثانیه بررسی امضای جداول را در پس‌زمینه شروع می‌کند."""
+        now = time.monotonic()
+        if now - self._line_suggestions_checked_at < LINE_SUGGESTIONS_SYNC_SECONDS or self._line_suggestions_loading:
+            return
+        self._line_suggestions_checked_at = now
+        threading.Thread(target=self._sync_line_suggestions, name="LineSuggestionsSync", daemon=True).start()
+
+    def _sync_line_suggestions(self):
+        """اگر mto_items یا projects (مثلاً در پروسه‌ی دیگری) تغییر کرده باشد، matcherها دور ریخته و ایندکس از نو بارگذاری می‌شود."""
+        session = self.get_session()
+        try:
+            signature = self._read_line_suggestions_signature(session)
+        except Exception as e:
+            logging.error(f"خطا در بررسی تغییرات ایندکس پیشنهاد خط: {e}")
+            return
+        finally:
+            session.close()
+        if signature == self._line_suggestions_signature:
+            return
+        self._fuzzy_line_matchers.clear()
+        if self.line_suggestions.ready:
+            self._refresh_line_suggestions()
+        else:
+            self._line_suggestions_signature = signature
+
+    def invalidate_progress_cache(self, project_id=None, line_no=None):
+        """نامعتبر کردن دستی cache پیشرفت (بدون project_id کل cache خالی می‌شود)."""
+        if project_id is None:
+            self.progress_cache.clear()
+        else:
+            self.progress_cache.invalidate(project_id, line_no)
+
+    def get_progress_cache_stats(self) -> Dict[str, Any]:
+        """آمار hit/miss cache پیشرفت (برای کنسول برنامه و report_api)."""
+        return self.progress_cache.snapshot()
 
     @staticmethod
     def test_connection(db_user: str, db_password: str) -> tuple[bool, str]:
@@ -77,9 +902,13 @@ class DataManager:
             user_enc = quote_plus(db_user.strip())
             pwd_enc = quote_plus(db_password.strip())
             db_url = f"postgresql+psycopg2://{user_enc}:{pwd_enc}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-            test_engine = create_engine(db_url)
-            with test_engine.connect() as conn:
-                conn.execute(func.now())  # یک کوئری خیلی ساده
+            # NullPool: اتصال تست بلافاصله بعد از استفاده بسته می‌شود و engine (همراه با URL حاوی رمز) نگه داشته نمی‌شود
+            test_engine = create_engine(db_url, poolclass=NullPool)
+            try:
+                with test_engine.connect() as conn:
+                    conn.execute(func.now())  # یک کوئری خیلی ساده
+            finally:
+                test_engine.dispose()
             return True, "OK"
         except OperationalError as e:
             return False, f"اتصال ناموفق: {e}"
@@ -90,8 +919,92 @@ class DataManager:
         """یک سشن جدید برای ارتباط با دیتابیس ایجاد می‌کند."""
         return self.Session()
 
-    def log_activity(self, user, action, details="", session=None):
-        """ثبت لاگ در جدول ActivityLog"""
+    @contextmanager
+    def unit_of_work(self):
+        """
+        یک سشن مشترک برای چند عملیات پشت‌سرهم برمی‌گرداند و در پایان فقط یک commit انجام می‌دهد.
+        در صورت بروز خطا کل تراکنش rollback می‌شود.
+        """
+        session = self.get_session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    @contextmanager
+    def statement_counter(self):
+        """تعداد دستورات SQL و commitهای اجراشده روی engine را در طول بلاک می‌شمارد."""
+        counter = {'statements': 0, 'commits': 0}
+
+        def _on_execute(conn, cursor, statement, parameters, context, executemany):
+            counter['statements'] += 1
+
+        def _on_commit(conn):
+            counter['commits'] += 1
+
+        event.listen(self.engine, "before_cursor_execute", _on_execute)
+        event.listen(self.engine, "commit", _on_commit)
+        try:
+            yield counter
+        finally:
+            event.remove(self.engine, "before_cursor_execute", _on_execute)
+            event.remove(self.engine, "commit", _on_commit)
+
+    @property
+    def activity_writer(self) -> ActivityLogWriter:
+        """writer گروهی لاگ‌ها؛ در اولین استفاده ساخته می‌شود."""
+        writer = getattr(self, '_activity_writer', None)
+        if writer is None:
+            with _activity_writer_lock:
+                writer = getattr(self, '_activity_writer', None)
+                if writer is None:
+                    writer = self._activity_writer = ActivityLogWriter(self.get_session)
+        return writer
+
+    def flush_activity_log(self) -> int:
+        """لاگ‌های در صف را فوراً در دیتابیس می‌نویسد."""
+        writer = getattr(self, '_activity_writer', None)
+        return writer.flush() if writer else 0
+
+    def shutdown(self):
+        """بستن منابع پس‌زمینه DataManager (نوشتن لاگ‌های باقی‌مانده و بستن اتصال‌های pool) هنگام خروج برنامه."""
+        writer = getattr(self, '_activity_writer', None)
+        if writer:
+            writer.close()
+        self.engine.dispose()
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """آمار سلامت connection pool (برای کنسول برنامه و report_api)."""
+        stats = getattr(self, 'pool_stats', None)
+        if stats is None:
+            return {}
+        return stats.snapshot(self.engine.pool)
+
+    def format_pool_stats(self) -> str:
+        """خلاصه‌ی یک‌خطی آمار pool برای نمایش در کنسول."""
+        stats = self.get_pool_stats()
+        if not stats:
+            return "آمار pool در دسترس نیست."
+        return (f"Pool: {stats.get('checked_out', 0)}/{stats.get('pool_size', 0)} در حال استفاده، "
+                f"overflow {stats.get('overflow', 0)} (بیشینه {stats['overflow_peak']})، "
+                f"checkout {stats['checkouts']}، انتظار میانگین {stats['wait_avg_ms']}ms (بیشینه {stats['wait_max_ms']}ms)، "
+                f"invalidation {stats['invalidations']}، اتصال طولانی {stats['long_held_total']} (فعلی {stats['long_held_now']})")
+
+    def log_activity(self, user, action, details="", session=None, sync=False):
+        """
+        ثبت لاگ در جدول ActivityLog
+        - با session: لاگ داخل همان تراکنش فراخواننده ثبت می‌شود (همراه آن commit یا rollback می‌شود).
+        - با sync=True: لاگ بلافاصله در سشن مستقل commit می‌شود.
+        - در حالت عادی: لاگ در صف writer گروهی قرار می‌گیرد و با تأخیر کوتاه نوشته می‌شود.
+        """
+        if session is None and not sync:
+            self.activity_writer.enqueue(user, action, details)
+            return
+
         own_session = False
         if session is None:
             session = self.get_session()
@@ -119,83 +1032,111 @@ class DataManager:
     # متدهای اصلی برای مدیریت رکوردها (CRUD Operations)
     # --------------------------------------------------------------------
 
-    def register_miv_record(self, project_id, form_data, consumption_items, spool_consumption_items=None):
-        session = self.get_session()
-        try:
-            # ... (بخش ساخت MIVRecord) ...
-            new_record = MIVRecord(
-                project_id=project_id,
-                line_no=form_data['Line No'],
-                miv_tag=form_data['MIV Tag'],
-                location=form_data['Location'],
-                status=form_data['Status'],
-                comment=form_data.get('Comment', ''),
-                registered_for=form_data['Registered For'],
-                registered_by=form_data['Registered By'],
-                last_updated=datetime.now(),
-                is_complete=form_data.get('Complete', False)
-            )
-            session.add(new_record)
-            session.flush()
+    def register_miv_record(self, project_id, form_data, consumption_items, spool_consumption_items=None,
+                            session=None):
+        """
+        ثبت یک MIV همراه با مصرف‌های MTO و اسپول، آمار پیشرفت و لاگ فعالیت در یک unit of work.
+        بدون session: کل عملیات در یک سشن و با یک commit انجام می‌شود.
+        با session: همه مراحل داخل سشن فراخواننده انجام شده و خطا به او برگردانده می‌شود (commit با فراخواننده).
+        """
+        if session is None:
+            try:
+                with self.unit_of_work() as session:
+                    success, msg = self.register_miv_record(project_id, form_data, consumption_items,
+                                                            spool_consumption_items, session=session)
+                    if not success:
+                        session.rollback()
+                    return success, msg
+            except Exception as e:
+                import traceback
+                logging.error(f"خطا در ثبت رکورد: {e}\n{traceback.format_exc()}")
+                return False, f"خطا در ثبت رکورد: {e}"
+
+        if self.is_duplicate_miv_tag(form_data['MIV Tag'], project_id, session=session):
+            return False, f"تگ '{form_data['MIV Tag']}' در این پروژه تکراری است."
+
+        # ... (بخش ساخت MIVRecord) ...
+        new_record = MIVRecord(
+            project_id=project_id,
+            line_no=form_data['Line No'],
+            miv_tag=form_data['MIV Tag'],
+            location=form_data['Location'],
+            status=form_data['Status'],
+            comment=form_data.get('Comment', ''),
+            registered_for=form_data['Registered For'],
+            registered_by=form_data['Registered By'],
+            last_updated=datetime.now(),
+            is_complete=form_data.get('Complete', False)
+        )
+        session.add(new_record)
+        session.flush()
+
+        direct_deltas = defaultdict(float)
+        spool_deltas = defaultdict(float)
+        direct_rows, spool_rows = [], []  # (mto_item_id, timestamp, used_qty) و (timestamp, used_qty) برای تجمیع روزانه
+
+        consumption_rows = []
+        for item in consumption_items:
+            timestamp = datetime.now()
+            consumption_rows.append({
+                'mto_item_id': item['mto_item_id'],
+                'miv_record_id': new_record.id,
+                'used_qty': item['used_qty'],  # از UI گرد شده می‌آید
+                'timestamp': timestamp
+            })
+            direct_deltas[item['mto_item_id']] += item['used_qty']
+            direct_rows.append((item['mto_item_id'], timestamp, item['used_qty']))
+        if consumption_rows:
+            # یک INSERT گروهی به جای یک INSERT برای هر آیتم
+            session.execute(insert(MTOConsumption), consumption_rows)
+
+        if spool_consumption_items:
+            spool_notes = []
+            for consumption in spool_consumption_items:
+                # ... (بخش کم کردن از موجودی اسپول بدون تغییر) ...
+                spool_item = session.get(SpoolItem, consumption['spool_item_id'])
+                used_qty = consumption['used_qty']
+                if not spool_item: raise ValueError(f"Spool item ID {consumption['spool_item_id']} not found.")
+                is_pipe = "PIPE" in (spool_item.component_type or "").upper()
+                if not self._adjust_spool_stock(session, spool_item, -used_qty):
+                    if is_pipe:
+                        raise ValueError(f"Insufficient length for pipe in spool {spool_item.spool.spool_id}.")
+                    raise ValueError(
+                        f"Insufficient qty for {spool_item.component_type} in spool {spool_item.spool.spool_id}.")
 
-            for item in consumption_items:
-                session.add(MTOConsumption(
-                    mto_item_id=item['mto_item_id'],
+                timestamp = datetime.now()
+                session.add(SpoolConsumption(
+                    spool_item_id=spool_item.id,
+                    spool_id=spool_item.spool.id,
                     miv_record_id=new_record.id,
-                    used_qty=item['used_qty'],  # از UI گرد شده می‌آید
-                    timestamp=datetime.now()
+                    used_qty=used_qty,  # از UI گرد شده می‌آید
+                    timestamp=timestamp
                 ))
-
-            if spool_consumption_items:
-                spool_notes = []
-                for consumption in spool_consumption_items:
-                    # ... (بخش کم کردن از موجودی اسپول بدون تغییر) ...
-                    spool_item = session.get(SpoolItem, consumption['spool_item_id'])
-                    used_qty = consumption['used_qty']
-                    if not spool_item: raise ValueError(f"Spool item ID {consumption['spool_item_id']} not found.")
-                    is_pipe = "PIPE" in (spool_item.component_type or "").upper()
-                    if is_pipe:
-                        if (spool_item.length or 0) < used_qty: raise ValueError(
-                            f"Insufficient length for pipe in spool {spool_item.spool.spool_id}.")
-                        spool_item.length -= used_qty
-                    else:
-                        if (spool_item.qty_available or 0) < used_qty: raise ValueError(
-                            f"Insufficient qty for {spool_item.component_type} in spool {spool_item.spool.spool_id}.")
-                        spool_item.qty_available -= used_qty
-
-                    session.add(SpoolConsumption(
-                        spool_item_id=spool_item.id,
-                        spool_id=spool_item.spool.id,
-                        miv_record_id=new_record.id,
-                        used_qty=used_qty,  # از UI گرد شده می‌آید
-                        timestamp=datetime.now()
-                    ))
-
-                    # --- CHANGE: اصلاح واحد در Note ---
-                    unit = "m" if is_pipe else "عدد"
-                    spool_notes.append(
-                        f"{used_qty:.2f} {unit} از {spool_item.component_type} (اسپول: {spool_item.spool.spool_id})")
-
-                if spool_notes:
-                    final_comment = (new_record.comment or "") + " | مصرف اسپول: " + ", ".join(spool_notes)
-                    new_record.comment = final_comment
-
-            session.commit()
-            self.rebuild_mto_progress_for_line(project_id, form_data['Line No'])
-
-            self.log_activity(
-                user=form_data['Registered By'], action="REGISTER_MIV",
-                details=f"MIV Tag '{form_data['MIV Tag']}' for Line '{form_data['Line No']}'",
-            )
-            return True, "رکورد با موفقیت ثبت شد."
-
-        except Exception as e:
-            session.rollback()
-            import traceback
-            logging.error(f"خطا در ثبت رکورد: {e}\n{traceback.format_exc()}")
-            return False, f"خطا در ثبت رکورد: {e}"
-        finally:
-            session.close()
+                spool_deltas[self._spool_usage_key(spool_item)] += used_qty
+                spool_rows.append((timestamp, used_qty))
+
+                # --- CHANGE: اصلاح واحد در Note ---
+                unit = "m" if is_pipe else "عدد"
+                spool_notes.append(
+                    f"{used_qty:.2f} {unit} از {spool_item.component_type} (اسپول: {spool_item.spool.spool_id})")
+
+            if spool_notes:
+                final_comment = (new_record.comment or "") + " | مصرف اسپول: " + ", ".join(spool_notes)
+                new_record.comment = final_comment
+
+        # به‌روزرسانی افزایشی آمار پیشرفت و تجمیع روزانه در همان تراکنش
+        items = self._apply_mto_progress_delta(session, project_id, form_data['Line No'], direct_deltas, spool_deltas)
+        self._add_miv_rollup_delta(session, project_id, form_data['Line No'], 1, [
+            (timestamp, used_qty, self._consumed_inch_dia(items.get(item_id) or session.get(MTOItem, item_id), used_qty))
+            for item_id, timestamp, used_qty in direct_rows
+        ], spool_rows)
+
+        self.log_activity(
+            user=form_data['Registered By'], action="REGISTER_MIV",
+            details=f"MIV Tag '{form_data['MIV Tag']}' for Line '{form_data['Line No']}'",
+            session=session
+        )
+        return True, "رکورد با موفقیت ثبت شد."
 
     def update_miv_items(self, miv_record_id, updated_items, updated_spool_items, user="system"):
         session = self.get_session()
@@ -207,18 +1148,24 @@ class DataManager:
             project_id = record.project_id
             line_no = record.line_no
 
+            direct_deltas = defaultdict(float)
+            spool_deltas = defaultdict(float)
+
+            # مصرف‌های مستقیم قدیمی به صورت دلتای منفی (همراه مشخصات آیتم برای inch-dia تجمیع روزانه)
+            old_direct = self._miv_direct_consumptions(session, miv_record_id)
+            for row in old_direct:
+                direct_deltas[row.mto_item_id] -= row.used_qty
+
             # --- مدیریت مصرف اسپول ---
             # 1. بازگرداندن موجودی‌های قدیمی اسپول به انبار
             old_spool_consumptions = session.query(SpoolConsumption).filter(
                 SpoolConsumption.miv_record_id == miv_record_id).all()
+            old_spool = [(old_c.timestamp, old_c.used_qty) for old_c in old_spool_consumptions]
             for old_c in old_spool_consumptions:
                 spool_item = session.get(SpoolItem, old_c.spool_item_id)
                 if spool_item:
-                    is_pipe = "PIPE" in (spool_item.component_type or "").upper()
-                    if is_pipe:
-                        spool_item.length = (spool_item.length or 0) + old_c.used_qty
-                    else:
-                        spool_item.qty_available = (spool_item.qty_available or 0) + old_c.used_qty
+                    self._adjust_spool_stock(session, spool_item, old_c.used_qty)
+                    spool_deltas[self._spool_usage_key(spool_item)] -= old_c.used_qty
 
             # 2. حذف رکوردهای مصرف قدیمی (هم MTO و هم Spool)
             session.query(MTOConsumption).filter(MTOConsumption.miv_record_id == miv_record_id).delete()
@@ -227,13 +1174,17 @@ class DataManager:
 
             # --- ثبت مصرف‌های جدید ---
             # 3. ثبت مصرف مستقیم MTO
+            new_direct, new_spool = [], []
             for item in updated_items:
+                timestamp = datetime.now()
                 session.add(MTOConsumption(
                     mto_item_id=item["mto_item_id"],
                     miv_record_id=miv_record_id,
                     used_qty=item["used_qty"],
-                    timestamp=datetime.now()
+                    timestamp=timestamp
                 ))
+                direct_deltas[item["mto_item_id"]] += item["used_qty"]
+                new_direct.append((item["mto_item_id"], timestamp, item["used_qty"]))
 
             # 4. ثبت مصرف جدید اسپول
             spool_notes = []
@@ -247,31 +1198,40 @@ class DataManager:
 
                     is_pipe = "PIPE" in (spool_item.component_type or "").upper()
 
-                    if is_pipe:
-                        if (spool_item.length or 0) < used_qty:
+                    # کسر اتمی موجودی؛ اگر ثبت همزمان دیگری موجودی را تمام کرده باشد، UPDATE هیچ ردیفی را تغییر نمی‌دهد
+                    if not self._adjust_spool_stock(session, spool_item, -used_qty):
+                        if is_pipe:
                             raise ValueError(f"طول موجود پایپ در اسپول {spool_item.spool.spool_id} کافی نیست.")
-                        spool_item.length -= used_qty
-                    else:
-                        if (spool_item.qty_available or 0) < used_qty:
-                            raise ValueError(
-                                f"موجودی آیتم {spool_item.component_type} در اسپول {spool_item.spool.spool_id} کافی نیست.")
-                        spool_item.qty_available -= used_qty
+                        raise ValueError(
+                            f"موجودی آیتم {spool_item.component_type} در اسپول {spool_item.spool.spool_id} کافی نیست.")
 
+                    timestamp = datetime.now()
                     session.add(SpoolConsumption(
                         spool_item_id=spool_item.id,
                         spool_id=spool_item.spool.id,
                         miv_record_id=miv_record_id,
                         used_qty=used_qty,
-                        timestamp=datetime.now()
+                        timestamp=timestamp
                     ))
+                    spool_deltas[self._spool_usage_key(spool_item)] += used_qty
+                    new_spool.append((timestamp, used_qty))
                     # ساخت Note
                     unit = "mm" if is_pipe else "عدد"
                     spool_notes.append(
                         f"{used_qty:.1f} {unit} از {spool_item.component_type} (اسپول: {spool_item.spool.spool_id})")
 
-            # 5. (مهم) بازسازی کامل آمار خط بعد از تمام تغییرات
+            # 5. (مهم) اعمال اختلاف مصرف قدیم و جدید روی آمار خط و تجمیع روزانه در همان تراکنش
+            items = self._apply_mto_progress_delta(session, project_id, line_no, direct_deltas, spool_deltas)
+            old_items = {row.mto_item_id: row for row in old_direct}
+            self._add_miv_rollup_delta(session, project_id, line_no, -1, [
+                (row.timestamp, row.used_qty, self._consumed_inch_dia(row, row.used_qty)) for row in old_direct
+            ], old_spool)
+            self._add_miv_rollup_delta(session, project_id, line_no, 1, [
+                (timestamp, used_qty, self._consumed_inch_dia(
+                    items.get(item_id) or old_items.get(item_id) or session.get(MTOItem, item_id), used_qty))
+                for item_id, timestamp, used_qty in new_direct
+            ], new_spool)
             session.commit()
-            self.rebuild_mto_progress_for_line(project_id, line_no)
 
             self.log_activity(
                 user=user,
@@ -292,7 +1252,7 @@ class DataManager:
         """
         یک رکورد MIV و تمام مصرف‌های مرتبط با آن (MTO و Spool) را حذف می‌کند.
         موجودی مصرف شده از اسپول‌ها را به انبار برمی‌گرداند.
-        سپس جدول MTOProgress را برای آن خط به‌طور کامل بازسازی می‌کند.
+        سپس مصرف حذف‌شده را به صورت افزایشی از جدول MTOProgress آن خط کم می‌کند.
         """
         session = self.get_session()
         try:
@@ -305,16 +1265,20 @@ class DataManager:
             line_no = record.line_no
             miv_tag = record.miv_tag
 
+            direct_deltas = defaultdict(float)
+            spool_deltas = defaultdict(float)
+            old_direct = self._miv_direct_consumptions(session, record_id)
+            for row in old_direct:
+                direct_deltas[row.mto_item_id] -= row.used_qty
+
             # ۲. (مهم) موجودی‌های مصرفی اسپول را به انبار برگردان
             spool_consumptions = session.query(SpoolConsumption).filter(SpoolConsumption.miv_record_id == record_id).all()
+            old_spool = [(consumption.timestamp, consumption.used_qty) for consumption in spool_consumptions]
             for consumption in spool_consumptions:
                 spool_item = session.get(SpoolItem, consumption.spool_item_id)
                 if spool_item:
-                    is_pipe = "PIPE" in (spool_item.component_type or "").upper()
-                    if is_pipe:
-                        spool_item.length = (spool_item.length or 0) + consumption.used_qty
-                    else:
-                        spool_item.qty_available = (spool_item.qty_available or 0) + consumption.used_qty
+                    self._adjust_spool_stock(session, spool_item, consumption.used_qty)
+                    spool_deltas[self._spool_usage_key(spool_item)] -= consumption.used_qty
 
             # ۳. تمام رکوردهای مصرفی مرتبط (MTO و Spool) را حذف کن
             session.query(MTOConsumption).filter(MTOConsumption.miv_record_id == record_id).delete()
@@ -322,10 +1286,13 @@ class DataManager:
 
             # ۴. خود رکورد MIV را حذف کن
             session.delete(record)
-            session.commit()
 
-            # ۵. (مهم) آمار پیشرفت را برای این خط از نو بساز
-            self.rebuild_mto_progress_for_line(project_id, line_no)
+            # ۵. (مهم) مصرف حذف‌شده را از آمار پیشرفت و تجمیع روزانه‌ی این خط کم کن
+            self._apply_mto_progress_delta(session, project_id, line_no, direct_deltas, spool_deltas)
+            self._add_miv_rollup_delta(session, project_id, line_no, -1, [
+                (row.timestamp, row.used_qty, self._consumed_inch_dia(row, row.used_qty)) for row in old_direct
+            ], old_spool)
+            session.commit()
 
             # ۶. ثبت لاگ
             self.log_activity(
@@ -346,115 +1313,255 @@ class DataManager:
     def rebuild_mto_progress_for_line(self, project_id, line_no):
         """
         بازسازی کامل آمار پیشرفت با استفاده از inch_dia
-        (نسخه اصلاح‌شده)
+        مسیرهای ثبت/ویرایش/حذف MIV از _apply_mto_progress_delta استفاده می‌کنند؛
+        این متد فقط برای تعمیر یا بعد از ایمپورت داده‌ها به کار می‌رود.
         """
         session = self.get_session()
         try:
-            # گام 1: واکشی آیتم‌های MTO با مصرف مستقیم
-            base_query = (
-                session.query(
-                    MTOItem,
-                    func.coalesce(func.sum(MTOConsumption.used_qty), 0.0).label("direct_used")
-                )
-                .outerjoin(MTOConsumption, MTOItem.id == MTOConsumption.mto_item_id)
-                .filter(MTOItem.project_id == project_id, MTOItem.line_no == line_no)
-                .group_by(MTOItem.id)
-            )
+            self._rebuild_mto_progress_for_line(session, project_id, line_no)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            import traceback
+            logging.error(f"خطا در rebuild_mto_progress_for_line: {e}\n{traceback.format_exc()}")
+        finally:
+            session.close()
 
-            mto_items_with_direct_usage = base_query.all()
-            if not mto_items_with_direct_usage:
-                return
+    def verify_mto_progress_for_line(self, project_id, line_no, tolerance=0.05, repair=False):
+        """
+        آمار ذخیره‌شده در MTOProgress را با محاسبه کامل مقایسه می‌کند.
+        خروجی لیستی از اختلاف‌ها است؛ اگر repair=True باشد و اختلافی پیدا شود، خط بازسازی می‌شود.
+        """
+        session = self.get_session()
+        try:
+            expected_rows = self._compute_mto_progress_rows(session, project_id, line_no)
+            stored = {
+                p.mto_item_id: p for p in session.query(MTOProgress).filter(
+                    MTOProgress.project_id == project_id,
+                    MTOProgress.line_no == line_no
+                ).all()
+            }
 
-            # گام 2: واکشی مصرف اسپول
-            spool_consumptions_in_line = (
-                session.query(
-                    func.upper(SpoolItem.component_type).label("spool_type"),
-                    SpoolItem.p1_bore,
-                    func.sum(SpoolConsumption.used_qty).label("total_spool_used")
-                )
-                .join(MIVRecord, SpoolConsumption.miv_record_id == MIVRecord.id)
-                .join(SpoolItem, SpoolConsumption.spool_item_id == SpoolItem.id)
-                .filter(MIVRecord.project_id == project_id, MIVRecord.line_no == line_no)
-                .group_by("spool_type", SpoolItem.p1_bore)
-                .all()
+            mismatches = []
+            for row in expected_rows:
+                current = stored.get(row['mto_item_id'])
+                if current is None:
+                    mismatches.append({'mto_item_id': row['mto_item_id'], 'expected': row['used_qty'], 'stored': None})
+                elif abs((current.used_qty or 0) - row['used_qty']) > tolerance:
+                    mismatches.append({
+                        'mto_item_id': row['mto_item_id'], 'expected': row['used_qty'], 'stored': current.used_qty
+                    })
+
+            if mismatches and repair:
+                self._rebuild_mto_progress_for_line(session, project_id, line_no)
+                session.commit()
+                logging.warning(f"آمار خط {line_no} با {len(mismatches)} اختلاف بازسازی شد.")
+            return mismatches
+        except Exception as e:
+            session.rollback()
+            logging.error(f"خطا در verify_mto_progress_for_line: {e}")
+            return []
+        finally:
+            session.close()
+
+    def _rebuild_mto_progress_for_line(self, session, project_id, line_no):
+        """ردیف‌های MTOProgress یک خط را داخل سشن داده‌شده حذف و از نو درج می‌کند (بدون commit)."""
+        self._mark_progress_dirty(session, project_id, line_no)
+        progress_updates = self._compute_mto_progress_rows(session, project_id, line_no)
+        if not progress_updates:
+            return
+
+        session.query(MTOProgress).filter(
+            MTOProgress.mto_item_id.in_([row['mto_item_id'] for row in progress_updates])
+        ).delete(synchronize_session=False)
+        session.bulk_insert_mappings(MTOProgress, progress_updates)
+
+    def _compute_mto_progress_rows(self, session, project_id, line_no):
+        """محاسبه کامل ردیف‌های پیشرفت یک خط از روی مصرف مستقیم و مصرف اسپول."""
+        # گام 1: واکشی آیتم‌های MTO با مصرف مستقیم
+        mto_items_with_direct_usage = (
+            session.query(
+                MTOItem,
+                func.coalesce(func.sum(MTOConsumption.used_qty), 0.0).label("direct_used")
             )
+            .outerjoin(MTOConsumption, MTOItem.id == MTOConsumption.mto_item_id)
+            .filter(MTOItem.project_id == project_id, MTOItem.line_no == line_no, MTOItem.is_active == True)
+            .group_by(MTOItem.id)
+            .all()
+        )
+        if not mto_items_with_direct_usage:
+            return []
 
-            spool_usage_map = {
-                (usage.spool_type, usage.p1_bore): usage.total_spool_used
-                for usage in spool_consumptions_in_line
-            }
+        # گام 2: واکشی مصرف اسپول
+        spool_consumptions_in_line = (
+            session.query(
+                func.upper(SpoolItem.component_type).label("spool_type"),
+                SpoolItem.p1_bore,
+                func.sum(SpoolConsumption.used_qty).label("total_spool_used")
+            )
+            .join(MIVRecord, SpoolConsumption.miv_record_id == MIVRecord.id)
+            .join(SpoolItem, SpoolConsumption.spool_item_id == SpoolItem.id)
+            .filter(MIVRecord.project_id == project_id, MIVRecord.line_no == line_no)
+            .group_by("spool_type", SpoolItem.p1_bore)
+            .all()
+        )
 
-            progress_updates = []
-            mto_item_ids_in_line = [item.id for item, _ in mto_items_with_direct_usage]
+        spool_usage_map = {
+            (usage.spool_type, usage.p1_bore): usage.total_spool_used
+            for usage in spool_consumptions_in_line
+        }
 
-            # گام 3: محاسبات برای هر آیتم
-            for mto_item, direct_used in mto_items_with_direct_usage:
-                # ✅ Total از ستون inch_dia که از قبل محاسبه شده
-                total_inch_dia = mto_item.inch_dia or 0
+        progress_updates = []
 
-                # تعیین base_qty برای محاسبه نسبت
-                is_pipe = mto_item.item_type and 'pipe' in mto_item.item_type.lower()
-                base_qty = mto_item.length_m if is_pipe else mto_item.quantity
+        # گام 3: محاسبات برای هر آیتم
+        for mto_item, direct_used in mto_items_with_direct_usage:
+            # ✅ Total از ستون inch_dia که از قبل محاسبه شده
+            total_inch_dia = mto_item.inch_dia or 0
+            base_qty = self._mto_base_qty(mto_item)
 
-                # ✅ محاسبه مصرف مستقیم به صورت نسبت
-                if base_qty and base_qty > 0:
-                    direct_ratio = (direct_used or 0) / base_qty
-                    direct_used_inch_dia = total_inch_dia * direct_ratio
-                else:
-                    direct_used_inch_dia = 0
-
-                # ✅ محاسبه مصرف اسپول
-                mto_type_upper = str(mto_item.item_type).upper().strip()
-                spool_equivalents = {mto_type_upper}
-                for key, aliases in SPOOL_TYPE_MAPPING.items():
-                    if mto_type_upper == key or mto_type_upper in aliases:
-                        spool_equivalents.update([key] + list(aliases))
-                        break
-
-                spool_used_raw = 0
-                for eq_type in spool_equivalents:
-                    spool_used_raw += spool_usage_map.get((eq_type, mto_item.p1_bore_in), 0)
-
-                # ✅ تبدیل مصرف اسپول به inch_dia با همان روش نسبت
-                if base_qty and base_qty > 0:
-                    spool_ratio = spool_used_raw / base_qty
-                    spool_used_inch_dia = total_inch_dia * spool_ratio
-                else:
-                    spool_used_inch_dia = 0
+            spool_used_raw = 0
+            for eq_type in self._spool_type_equivalents(mto_item.item_type):
+                spool_used_raw += spool_usage_map.get((eq_type, mto_item.p1_bore_in), 0)
 
-                # جمع کل
-                total_used_inch_dia = direct_used_inch_dia + spool_used_inch_dia
-                remaining_inch_dia = max(0, total_inch_dia - total_used_inch_dia)
+            # ✅ تبدیل مصرف مستقیم و اسپول به inch_dia به روش نسبت
+            if base_qty and base_qty > 0:
+                total_used_inch_dia = total_inch_dia * ((direct_used or 0) + spool_used_raw) / base_qty
+            else:
+                total_used_inch_dia = 0
+
+            remaining_inch_dia = max(0, total_inch_dia - total_used_inch_dia)
+
+            progress_updates.append({
+                'mto_item_id': mto_item.id,
+                'project_id': project_id,
+                'line_no': line_no,
+                'item_code': mto_item.item_code,
+                'description': mto_item.description,
+                'unit': mto_item.unit,
+                # مقادیر گرد نمی‌شوند تا با جمع دلتاهای _apply_mto_progress_delta یکی باشند (گرد کردن فقط در نمایش)
+                'total_qty': total_inch_dia,
+                'used_qty': total_used_inch_dia,
+                'remaining_qty': remaining_inch_dia,
+                'last_updated': datetime.now()
+            })
+
+        return progress_updates
+
+    def _apply_mto_progress_delta(self, session, project_id, line_no, direct_deltas, spool_deltas):
+        """
+        فقط اختلاف مصرف یک MIV را روی ردیف‌های MTOProgress آیتم‌های درگیر اعمال می‌کند (بدون commit).
+        direct_deltas: {mto_item_id: delta_qty}
+        spool_deltas: {(SPOOL_TYPE, p1_bore): delta_qty}
+        اگر یکی از آیتم‌های درگیر هنوز ردیف پیشرفت نداشته باشد، خط به‌طور کامل بازسازی می‌شود.
+        خروجی: آیتم‌های MTO خوانده‌شده {mto_item_id: MTOItem} (برای محاسبه‌ی inch-dia مصرف بدون کوئری دوباره).
+        """
+        self._mark_progress_dirty(session, project_id, line_no)
+        direct_deltas = {k: v for k, v in direct_deltas.items() if v}
+        spool_deltas = {k: v for k, v in spool_deltas.items() if v}
+        if not direct_deltas and not spool_deltas:
+            return {}
 
-                progress_updates.append({
-                    'mto_item_id': mto_item.id,
-                    'project_id': project_id,
-                    'line_no': line_no,
-                    'item_code': mto_item.item_code,
-                    'description': mto_item.description,
-                    'unit': mto_item.unit,
-                    'total_qty': round(total_inch_dia, 2),
-                    'used_qty': round(total_used_inch_dia, 2),
-                    'remaining_qty': round(remaining_inch_dia, 2),
-                    'last_updated': datetime.now()
-                })
+        item_filter = MTOItem.id.in_(list(direct_deltas))
+        if spool_deltas:
+            spool_bores = {bore for _, bore in spool_deltas}
+            item_filter = item_filter | MTOItem.p1_bore_in.in_([b for b in spool_bores if b is not None])
+            if None in spool_bores:
+                item_filter = item_filter | MTOItem.p1_bore_in.is_(None)
+
+        affected = (
+            session.query(MTOItem, MTOProgress)
+            .outerjoin(MTOProgress, MTOProgress.mto_item_id == MTOItem.id)
+            .filter(MTOItem.project_id == project_id, MTOItem.line_no == line_no, MTOItem.is_active == True,
+                    item_filter)
+            .all()
+        )
 
-            # گام 4: حذف و درج
-            session.query(MTOProgress).filter(
-                MTOProgress.mto_item_id.in_(mto_item_ids_in_line)
-            ).delete(synchronize_session=False)
+        items = {mto_item.id: mto_item for mto_item, _ in affected}
+        now = datetime.now()
+        for mto_item, progress_row in affected:
+            delta_raw = direct_deltas.get(mto_item.id, 0)
+            for eq_type in self._spool_type_equivalents(mto_item.item_type):
+                delta_raw += spool_deltas.get((eq_type, mto_item.p1_bore_in), 0)
+            if not delta_raw:
+                continue
+
+            if progress_row is None:
+                # خط هنوز مقداردهی نشده؛ محاسبه کامل همین‌جا انجام می‌شود
+                session.flush()
+                self._rebuild_mto_progress_for_line(session, project_id, line_no)
+                return items
 
-            if progress_updates:
-                session.bulk_insert_mappings(MTOProgress, progress_updates)
+            base_qty = self._mto_base_qty(mto_item)
+            if not base_qty or base_qty <= 0:
+                continue
 
-            session.commit()
+            delta_inch_dia = (mto_item.inch_dia or 0) * delta_raw / base_qty
+            # جمع بدون گرد کردن؛ گرد کردن در هر دلتا بعد از چند MIV از محاسبه‌ی کامل فاصله می‌گرفت
+            used = max(0, (progress_row.used_qty or 0) + delta_inch_dia)
+            progress_row.used_qty = used
+            progress_row.remaining_qty = max(0, (progress_row.total_qty or 0) - used)
+            progress_row.last_updated = now
+        return items
 
-        except Exception as e:
-            session.rollback()
-            import traceback
-            logging.error(f"خطا در rebuild_mto_progress_for_line: {e}\n{traceback.format_exc()}")
-        finally:
-            session.close()
+    @staticmethod
+    def _mto_base_qty(mto_item):
+        """مقدار پایه آیتم MTO برای محاسبه نسبت مصرف (طول برای پایپ، تعداد برای بقیه)."""
+        is_pipe = mto_item.item_type and 'pipe' in mto_item.item_type.lower()
+        return mto_item.length_m if is_pipe else mto_item.quantity
+
+    @classmethod
+    def _consumed_inch_dia(cls, mto_item, used_qty):
+        """inch-dia مصرف مستقیم یک آیتم (هم‌ارز ستون inch_dia در _refresh_consumption_rollup)."""
+        base_qty = cls._mto_base_qty(mto_item) if mto_item is not None else None
+        if not base_qty or base_qty <= 0:
+            return 0.0
+        return (used_qty or 0) * (mto_item.inch_dia or 0) / base_qty
+
+    @staticmethod
+    def _miv_direct_consumptions(session, miv_record_id):
+        """مصرف‌های مستقیم یک MIV همراه زمان ثبت و مشخصات آیتم MTO (ورودی _consumed_inch_dia)."""
+        return session.query(
+            MTOConsumption.mto_item_id, MTOConsumption.used_qty, MTOConsumption.timestamp,
+            MTOItem.inch_dia, MTOItem.item_type, MTOItem.length_m, MTOItem.quantity
+        ).outerjoin(MTOItem, MTOItem.id == MTOConsumption.mto_item_id).filter(
+            MTOConsumption.miv_record_id == miv_record_id).all()
+
+    @staticmethod
+    def _spool_type_equivalents(item_type):
+        """مجموعه نوع‌های اسپول معادل یک نوع آیتم MTO بر اساس SPOOL_TYPE_MAPPING."""
+        mto_type_upper = str(item_type).upper().strip()
+        spool_equivalents = {mto_type_upper}
+        for key, aliases in SPOOL_TYPE_MAPPING.items():
+            if mto_type_upper == key or mto_type_upper in aliases:
+                spool_equivalents.update([key] + list(aliases))
+                break
+        return spool_equivalents
+
+    @staticmethod
+    def _adjust_spool_stock(session, spool_item, qty_delta: float) -> bool:
+        """
+        موجودی آیتم اسپول (طول برای پایپ، تعداد برای بقیه) را با یک UPDATE اتمی تغییر می‌دهد.
+        برای کسر موجودی (qty_delta منفی) شرط کافی بودن موجودی داخل خود UPDATE بررسی می‌شود؛ در نتیجه
+        دو ثبت همزمان روی یک آیتم نمی‌توانند بیش از موجودی مصرف کنند. خروجی False یعنی موجودی کافی نبود.
+        """
+        is_pipe = "PIPE" in (spool_item.component_type or "").upper()
+        column = SpoolItem.length if is_pipe else SpoolItem.qty_available
+
+        stmt = update(SpoolItem).where(SpoolItem.id == spool_item.id)
+        if qty_delta < 0:
+            stmt = stmt.where(func.coalesce(column, 0) >= -qty_delta)
+        stmt = stmt.values({column.key: func.coalesce(column, 0) + qty_delta})
+        result = session.execute(stmt.execution_options(synchronize_session=False))
+
+        # مقدار داخل سشن قدیمی شده است؛ در دسترسی بعدی از دیتابیس خوانده می‌شود
+        session.expire(spool_item, [column.key])
+        return result.rowcount == 1
+
+    @staticmethod
+    def _spool_usage_key(spool_item):
+        """کلید (نوع، سایز) مصرف اسپول؛ هم‌ارز گروه‌بندی upper(component_type), p1_bore در SQL."""
+        component_type = spool_item.component_type.upper() if spool_item.component_type is not None else None
+        return component_type, spool_item.p1_bore
 
     def get_consumptions_for_miv(self, miv_record_id):
         """
@@ -478,9 +1585,11 @@ class DataManager:
     # متدهای جستجو و اعتبارسنجی
     # --------------------------------------------------------------------
 
-    def is_duplicate_miv_tag(self, miv_tag, project_id):
+    def is_duplicate_miv_tag(self, miv_tag, project_id, session=None):
         """بررسی می‌کند که آیا یک MIV Tag در یک پروژه خاص تکراری است یا خیر."""
-        session = self.get_session()
+        own_session = session is None
+        if own_session:
+            session = self.get_session()
         try:
             exists = session.query(MIVRecord.id).filter(
                 MIVRecord.project_id == project_id,
@@ -488,22 +1597,33 @@ class DataManager:
             ).first()
             return exists is not None
         finally:
-            session.close()
+            if own_session:
+                session.close()
 
     def get_line_no_suggestions(self, typed_text: str, top_n: int = 15) -> List[Dict[str, Any]]:
         """
-        (نسخه بهینه‌سازی شده با استفاده از LIKE)
         در تمام پروژه‌ها جستجو کرده و شماره خط‌های مشابه را به همراه نام پروژه پیشنهاد می‌دهد.
-        این جستجو مستقیماً در دیتابیس و با سرعت بالا انجام می‌شود.
+        وقتی ایندکس پیشنهاد خط (LineSuggestionIndex) آماده است از حافظه جواب داده می‌شود و تطابق‌های
+        پیشوندی اول می‌آیند؛ در غیر این صورت بارگذاری آن شروع شده و از دیتابیس جستجو می‌شود.
         """
         if not typed_text or len(typed_text) < 2:
             return []
 
+        if self.line_suggestions.ready and normalize_line_key(typed_text):
+            self._check_line_suggestions()
+            return [
+                {
+                    'display': f"{line_no}  ({project_name})",
+                    'line_no': line_no,
+                    'project_name': project_name,
+                    'project_id': project_id
+                }
+                for line_no, project_id, project_name in self.line_suggestions.search(typed_text, top_n)
+            ]
+        self.warm_line_suggestions()
+
         session = self.get_session()
         try:
-            # ساخت عبارت جستجو برای اپراتور LIKE
-            search_term = f"%{typed_text}%"
-
             # کوئری بهینه که فیلتر را در دیتابیس اعمال می‌کند
             query = (
                 session.query(
@@ -512,7 +1632,8 @@ class DataManager:
                     Project.id
                 )
                 .join(Project, MTOItem.project_id == Project.id)
-                .filter(MTOItem.line_no.ilike(search_term))  # ilike برای جستجوی غیرحساس به حروف
+                .filter(self._substring_condition(session, 'mto_line_no', typed_text))  # غیرحساس به حروف
+                .filter(MTOItem.is_active == True)
                 .distinct()
                 .limit(top_n)
             )
@@ -593,7 +1714,8 @@ class DataManager:
             # این کوئری تمام اطلاعات لازم برای پنجره مصرف را برمی‌گرداند
             items = session.query(MTOItem).filter(
                 MTOItem.project_id == project_id,
-                MTOItem.line_no == line_no
+                MTOItem.line_no == line_no,
+                MTOItem.is_active == True
             ).all()
             return items
         finally:
@@ -619,45 +1741,46 @@ class DataManager:
     # متدهای گزارش‌گیری (مربوط به داشبورد و گزارش‌ها)
     # --------------------------------------------------------------------
 
-    @lru_cache(maxsize=128)
     def get_project_progress(self, project_id):
         """
         محاسبه پیشرفت کل پروژه (جمع inch_dia تمام خطوط)
-        نسخه بهینه: یک Query به جای Loop
+        از ردیف پیش‌تجمیع‌شده project_progress_summary خوانده می‌شود (بدون SUM روی mto_progress).
+        نتیجه در progress_cache نگه داشته می‌شود و با هر ثبت/ویرایش/حذف در پروژه نامعتبر می‌شود.
         """
+        found, cached = self.progress_cache.get(project_id)
+        if found:
+            return dict(cached)
+        version = self.progress_cache.version(project_id)
+
         session = self.get_session()
         try:
-            # 📊 یک Query برای گرفتن آمار کل پروژه
-            result = session.query(
-                func.count(func.distinct(MTOProgress.line_no)).label('total_lines'),
-                func.sum(MTOProgress.total_qty).label('total_inch_dia'),
-                func.sum(MTOProgress.used_qty).label('done_inch_dia')
-            ).filter(
-                MTOProgress.project_id == project_id
-            ).first()
+            self._ensure_progress_summaries(session, project_id)
+            summary = session.get(ProjectProgressSummary, project_id)
 
-            if not result or result.total_lines == 0:
-                return {
+            if not summary or not summary.total_lines:
+                progress = {
                     "total_lines": 0,
                     "total_weight": 0,
                     "done_weight": 0,
                     "percentage": 0
                 }
+            else:
+                total_inch_dia = summary.total_inch_dia or 0
+                done_inch_dia = summary.used_inch_dia or 0
+
+                percentage = round(
+                    (done_inch_dia / total_inch_dia * 100), 2
+                ) if total_inch_dia > 0 else 0
+
+                progress = {
+                    "total_lines": summary.total_lines,
+                    "total_weight": total_inch_dia,
+                    "done_weight": done_inch_dia,
+                    "percentage": percentage
+                }
 
-            total_lines = result.total_lines or 0
-            total_inch_dia = result.total_inch_dia or 0
-            done_inch_dia = result.done_inch_dia or 0
-
-            percentage = round(
-                (done_inch_dia / total_inch_dia * 100), 2
-            ) if total_inch_dia > 0 else 0
-
-            return {
-                "total_lines": total_lines,
-                "total_weight": total_inch_dia,
-                "done_weight": done_inch_dia,
-                "percentage": percentage
-            }
+            self.progress_cache.put(project_id, None, version, progress)
+            return dict(progress)
 
         except Exception as e:
             logging.error(f"⚠️ خطا در محاسبه پیشرفت پروژه {project_id}: {e}")
@@ -670,46 +1793,37 @@ class DataManager:
         finally:
             session.close()
 
-    @lru_cache(maxsize=256)
     def get_line_progress(self, project_id, line_no, readonly=True):
         """
-        محاسبه پیشرفت یک خط (بر اساس inch_dia)
+        محاسبه پیشرفت یک خط (بر اساس inch_dia) از روی ردیف line_progress_summary همان خط.
+        نتیجه در progress_cache با کلید (project_id, line_no) نگه داشته می‌شود.
         """
+        found, cached = self.progress_cache.get(project_id, line_no)
+        # خطی که هنوز مقداردهی نشده با readonly=False باید از دیتابیس خوانده و مقداردهی شود
+        if found and (readonly or cached["total_weight"]):
+            return dict(cached)
+        version = self.progress_cache.version(project_id, line_no)
+
         session = self.get_session()
         try:
-            query_result = session.query(
-                func.sum(MTOProgress.total_qty),
-                func.sum(MTOProgress.used_qty)
-            ).filter(
-                MTOProgress.project_id == project_id,
-                MTOProgress.line_no == line_no
-            ).first()
-
-            total_inch_dia, used_inch_dia = query_result
-            total_inch_dia = total_inch_dia or 0
-            used_inch_dia = used_inch_dia or 0
+            self._ensure_progress_summaries(session, project_id)
+            total_inch_dia, used_inch_dia = self._read_line_summary(session, project_id, line_no)
 
             if total_inch_dia == 0 and not readonly:
                 self.initialize_mto_progress_for_line(project_id, line_no)
-                query_result = session.query(
-                    func.sum(MTOProgress.total_qty),
-                    func.sum(MTOProgress.used_qty)
-                ).filter(
-                    MTOProgress.project_id == project_id,
-                    MTOProgress.line_no == line_no
-                ).first()
-                total_inch_dia, used_inch_dia = query_result
-                total_inch_dia = total_inch_dia or 0
-                used_inch_dia = used_inch_dia or 0
+                version = self.progress_cache.version(project_id, line_no)
+                total_inch_dia, used_inch_dia = self._read_line_summary(session, project_id, line_no)
 
             percentage = round((used_inch_dia / total_inch_dia * 100), 2) if total_inch_dia > 0 else 0
 
-            return {
+            progress = {
                 "line_no": line_no,
                 "total_weight": total_inch_dia,  # حالا واحدش inch-dia
                 "done_weight": used_inch_dia,
                 "percentage": percentage
             }
+            self.progress_cache.put(project_id, line_no, version, progress)
+            return dict(progress)
 
         except Exception as e:
             print(f"⚠️ خطا در محاسبه پیشرفت خط {line_no}: {e}")
@@ -717,6 +1831,541 @@ class DataManager:
         finally:
             session.close()
 
+    @staticmethod
+    def _read_line_summary(session, project_id, line_no):
+        """خروجی: (total_inch_dia, used_inch_dia) یک خط از جدول خلاصه (صفر اگر ردیفی نباشد)."""
+        row = session.execute(
+            select(LineProgressSummary.total_inch_dia, LineProgressSummary.used_inch_dia).where(
+                LineProgressSummary.project_id == project_id,
+                LineProgressSummary.line_no == line_no
+            )
+        ).first()
+        if row is None:
+            return 0, 0
+        return row.total_inch_dia or 0, row.used_inch_dia or 0
+
+    def get_line_status_rows(self, project_id, initialize_missing=False, session=None):
+        """
+        وضعیت همه خطوط پروژه از جدول پیش‌تجمیع‌شده line_progress_summary (یک ردیف برای هر خط).
+        خروجی بر اساس line_no مرتب است و هر ردیف کلیدهای
+        line_no / total_weight / done_weight / percentage / last_activity را دارد.
+        اگر initialize_missing=True باشد، خطوطی که هنوز MTOProgress ندارند
+        (مثل get_line_progress با readonly=False) مقداردهی اولیه و دوباره خوانده می‌شوند.
+        """
+        own_session = session is None
+        if own_session:
+            session = self.get_session()
+        try:
+            self._ensure_progress_summaries(session, project_id)
+            rows = self._query_line_status_rows(session, project_id)
+
+            if initialize_missing:
+                missing = [r["line_no"] for r in rows if not r["total_weight"]]
+                if missing:
+                    self.initialize_mto_progress_for_lines(project_id, missing)
+                    rows = self._query_line_status_rows(session, project_id)
+
+            return rows
+        except Exception as e:
+            logging.error(f"Error in get_line_status_rows for project {project_id}: {e}")
+            return []
+        finally:
+            if own_session:
+                session.close()
+
+    @staticmethod
+    def _query_line_status_rows(session, project_id):
+        """خواندن ردیف‌های line_progress_summary پروژه (بخش داخلی get_line_status_rows)."""
+        stmt = select(
+            LineProgressSummary.line_no,
+            LineProgressSummary.total_inch_dia,
+            LineProgressSummary.used_inch_dia,
+            LineProgressSummary.last_activity,
+        ).where(LineProgressSummary.project_id == project_id)
+
+        rows = []
+        for line_no, total_qty, used_qty, last_activity in session.execute(stmt):
+            total_qty = total_qty or 0
+            used_qty = used_qty or 0
+            rows.append({
+                "line_no": line_no,
+                "total_weight": total_qty,
+                "done_weight": used_qty,
+                "percentage": round((used_qty / total_qty * 100), 2) if total_qty > 0 else 0,
+                "last_activity": last_activity,
+            })
+        # مرتب‌سازی در پایتون تا ترتیب مستقل از collation دیتابیس باشد
+        rows.sort(key=lambda r: r["line_no"] or "")
+        return rows
+
+    # --------------------------------------------------------------------
+    # نگهداری جداول خلاصه پیشرفت (line_progress_summary / project_progress_summary)
+    # --------------------------------------------------------------------
+
+    @staticmethod
+    def _line_summary_select(project_id, line_nos=None):
+        """
+        کوئری گروهی محاسبه خلاصه خطوط از روی mto_items / mto_progress / miv_records.
+        خطوط متمایز MTO با جمع MTOProgress و آخرین فعالیت MIV (هر سه group by line_no) LEFT JOIN می‌شوند.
+        """
+        def scoped(column, model_project_id):
+            conditions = [model_project_id == project_id]
+            if line_nos is not None:
+                conditions.append(column.in_(line_nos))
+            return conditions
+
+        lines_sq = (
+            select(MTOItem.line_no.label("line_no"), func.count(MTOItem.id).label("item_count"))
+            .where(*scoped(MTOItem.line_no, MTOItem.project_id), MTOItem.is_active == True)
+            .group_by(MTOItem.line_no)
+            .subquery()
+        )
+        progress_sq = (
+            select(
+                MTOProgress.line_no.label("line_no"),
+                func.count(MTOProgress.id).label("tracked_items"),
+                func.sum(MTOProgress.total_qty).label("total_qty"),
+                func.sum(MTOProgress.used_qty).label("used_qty"),
+            )
+            .where(*scoped(MTOProgress.line_no, MTOProgress.project_id))
+            .group_by(MTOProgress.line_no)
+            .subquery()
+        )
+        activity_sq = (
+            select(
+                MIVRecord.line_no.label("line_no"),
+                func.max(MIVRecord.last_updated).label("last_activity"),
+            )
+            .where(*scoped(MIVRecord.line_no, MIVRecord.project_id))
+            .group_by(MIVRecord.line_no)
+            .subquery()
+        )
+
+        return (
+            select(
+                lines_sq.c.line_no,
+                lines_sq.c.item_count,
+                progress_sq.c.tracked_items,
+                progress_sq.c.total_qty,
+                progress_sq.c.used_qty,
+                activity_sq.c.last_activity,
+            )
+            .outerjoin(progress_sq, progress_sq.c.line_no == lines_sq.c.line_no)
+            .outerjoin(activity_sq, activity_sq.c.line_no == lines_sq.c.line_no)
+        )
+
+    def _line_summary_rows(self, session, project_id, line_nos=None, now=None):
+        """ردیف‌های line_progress_summary خطوط داده‌شده (یا همه خطوط پروژه) از روی _line_summary_select."""
+        now = now or datetime.now()
+        rows = []
+        for line_no, item_count, tracked, total_qty, used_qty, last_activity in session.execute(
+                self._line_summary_select(project_id, line_nos)):
+            total_qty = total_qty or 0
+            used_qty = used_qty or 0
+            rows.append({
+                "project_id": project_id,
+                "line_no": line_no,
+                "item_count": item_count or 0,
+                "tracked_items": tracked or 0,
+                "total_inch_dia": total_qty,
+                "used_inch_dia": used_qty,
+                "last_activity": last_activity,
+                "is_complete": total_qty > 0 and used_qty / total_qty * 100 >= 99.99,
+                "updated_at": now,
+            })
+        return rows
+
+    def _refresh_progress_summaries(self, session, project_id):
+        """
+        همه‌ی ردیف‌های خلاصه‌ی خطوط پروژه، ردیف خلاصه‌ی پروژه و تجمیع روزانه‌ی مصرف آن را داخل تراکنش
+        فراخواننده از نو محاسبه می‌کند (بدون commit). برای ایمپورت MTO، پروژه‌ی بدون خلاصه و بازسازی کامل.
+        """
+        now = datetime.now()
+        line_filter = [LineProgressSummary.project_id == project_id]
+
+        # قفل ردیف‌های موجود (روی PostgreSQL) تا دو تراکنش همزمان، خلاصه را با snapshot قدیمی ننویسند
+        session.execute(
+            select(LineProgressSummary.id).where(*line_filter)
+            .order_by(LineProgressSummary.line_no).with_for_update()
+        ).all()
+
+        rows = self._line_summary_rows(session, project_id, now=now)
+        session.execute(LineProgressSummary.__table__.delete().where(*line_filter))
+        for chunk in _chunks(rows, 1000):
+            session.execute(insert(LineProgressSummary), chunk)
+
+        self._refresh_project_summary(session, project_id, now)
+        self._refresh_consumption_rollup(session, project_id, None, now)
+
+    def _refresh_line_summaries(self, session, project_id, line_nos):
+        """
+        ردیف‌های خلاصه‌ی خطوط داده‌شده را از نو محاسبه می‌کند و اختلاف آن‌ها با مقدار قبلی را با یک UPDATE نسبی
+        روی ردیف خلاصه‌ی پروژه اعمال می‌کند؛ ردیف پروژه نه قفل می‌شود و نه از روی همه‌ی خطوط دوباره جمع زده می‌شود.
+        خروجی False یعنی پروژه هنوز ردیف خلاصه ندارد و باید با _refresh_progress_summaries کامل ساخته شود.
+        """
+        now = datetime.now()
+        line_nos = sorted(line_nos)
+
+        # مقدار قبلی خطوط (قفل‌شده روی PostgreSQL تا دو تراکنش همزمان روی یک خط، اختلاف را از snapshot قدیمی حساب نکنند)
+        old_rows = session.execute(
+            select(
+                LineProgressSummary.line_no, LineProgressSummary.item_count, LineProgressSummary.tracked_items,
+                LineProgressSummary.total_inch_dia, LineProgressSummary.used_inch_dia,
+                LineProgressSummary.is_complete, LineProgressSummary.last_activity,
+            )
+            .where(LineProgressSummary.project_id == project_id, LineProgressSummary.line_no.in_(line_nos))
+            .order_by(LineProgressSummary.line_no).with_for_update()
+        ).mappings().all()
+
+        rows = self._line_summary_rows(session, project_id, line_nos, now)
+        self._upsert_rows(session, LineProgressSummary, rows, ['project_id', 'line_no'])
+        # خطوطی که دیگر آیتم MTO ندارند از خلاصه حذف می‌شوند
+        gone = set(line_nos) - {row["line_no"] for row in rows}
+        if gone:
+            session.execute(LineProgressSummary.__table__.delete().where(
+                LineProgressSummary.project_id == project_id,
+                LineProgressSummary.line_no.in_(gone)
+            ))
+
+        delta = {"total_lines": 0, "completed_lines": 0, "item_count": 0, "total_inch_dia": 0.0, "used_inch_dia": 0.0}
+        for sign, line_rows in ((-1, old_rows), (1, rows)):
+            for row in line_rows:
+                delta["total_lines"] += sign * ((row["tracked_items"] or 0) > 0)
+                delta["completed_lines"] += sign * bool(row["is_complete"])
+                delta["item_count"] += sign * (row["item_count"] or 0)
+                delta["total_inch_dia"] += sign * (row["total_inch_dia"] or 0)
+                delta["used_inch_dia"] += sign * (row["used_inch_dia"] or 0)
+
+        # آخرین فعالیت فقط وقتی به پروژه داده می‌شود که از مقدار قبلی همان خط جلوتر رفته باشد
+        old_activity = {row["line_no"]: row["last_activity"] for row in old_rows}
+        last_activity = max((
+            row["last_activity"] for row in rows
+            if row["last_activity"] is not None and (
+                old_activity.get(row["line_no"]) is None or row["last_activity"] > old_activity[row["line_no"]])
+        ), default=None)
+
+        return self._apply_project_summary_delta(session, project_id, delta, last_activity, now)
+
+    @staticmethod
+    def _apply_project_summary_delta(session, project_id, delta, last_activity=None, now=None):
+        """
+        اختلاف خلاصه‌ی خطوط را با یک UPDATE نسبی (used += delta, completed_lines += تغییر وضعیت، ...) روی ردیف
+        project_progress_summary اعمال می‌کند؛ اگر چیزی عوض نشده باشد هیچ دستوری اجرا نمی‌شود.
+        last_activity فقط جلو می‌رود (حذف MIV آن را عقب نمی‌برد؛ rebuild_progress_summaries مقدار دقیق را می‌سازد).
+        خروجی False یعنی پروژه هنوز ردیف خلاصه ندارد.
+        """
+        if not any(delta.values()) and last_activity is None:
+            return True
+
+        summary = ProjectProgressSummary
+        total_lines = summary.total_lines + delta["total_lines"]
+        values = {
+            "total_lines": total_lines,
+            "completed_lines": summary.completed_lines + delta["completed_lines"],
+            "item_count": summary.item_count + delta["item_count"],
+            "total_inch_dia": summary.total_inch_dia + delta["total_inch_dia"],
+            "used_inch_dia": summary.used_inch_dia + delta["used_inch_dia"],
+            # در SET همه‌ی ستون‌ها مقدار قبل از UPDATE را دارند
+            "is_complete": and_(total_lines > 0, summary.completed_lines + delta["completed_lines"] == total_lines),
+            "updated_at": now or datetime.now(),
+        }
+        if last_activity is not None:
+            values["last_activity"] = case(
+                (or_(summary.last_activity.is_(None), summary.last_activity < last_activity), last_activity),
+                else_=summary.last_activity
+            )
+        result = session.execute(
+            update(summary).where(summary.project_id == project_id).values(values)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def _refresh_project_summary(self, session, project_id, now=None):
+        """ردیف project_progress_summary از روی ردیف‌های خلاصه خطوط (O(lines)) محاسبه می‌شود (فقط در بازسازی کامل)."""
+        session.execute(
+            select(ProjectProgressSummary.project_id)
+            .where(ProjectProgressSummary.project_id == project_id).with_for_update()
+        ).all()
+        totals = session.execute(
+            select(
+                func.count(case((LineProgressSummary.tracked_items > 0, 1))),
+                func.count(case((LineProgressSummary.is_complete, 1))),
+                func.coalesce(func.sum(LineProgressSummary.item_count), 0),
+                func.coalesce(func.sum(LineProgressSummary.total_inch_dia), 0.0),
+                func.coalesce(func.sum(LineProgressSummary.used_inch_dia), 0.0),
+                func.max(LineProgressSummary.last_activity),
+            ).where(LineProgressSummary.project_id == project_id)
+        ).one()
+        total_lines, completed_lines, item_count, total_inch_dia, used_inch_dia, last_activity = totals
+
+        self._upsert_rows(session, ProjectProgressSummary, [{
+            "project_id": project_id,
+            "total_lines": total_lines,
+            "completed_lines": completed_lines,
+            "item_count": item_count,
+            "total_inch_dia": total_inch_dia,
+            "used_inch_dia": used_inch_dia,
+            "last_activity": last_activity,
+            "is_complete": total_lines > 0 and completed_lines == total_lines,
+            "updated_at": now or datetime.now(),
+        }], ['project_id'])
+
+    @staticmethod
+    def _day_bucket(session, column):
+        """تبدیل timestamp به تاریخ روز؛ date() روی SQLite و CAST(... AS DATE) روی PostgreSQL."""
+        if session.get_bind().dialect.name == "sqlite":
+            return func.date(column)
+        return cast(column, Date)
+
+    def _refresh_consumption_rollup(self, session, project_id, line_nos=None, now=None):
+        """
+        ردیف‌های daily_consumption_rollup خطوط داده‌شده (یا کل پروژه) از روی مصرف‌های MTO و اسپول
+        همان خطوط بازسازی می‌شوند؛ خط و پروژه از رکورد MIV مصرف گرفته می‌شود.
+        فقط برای بازسازی کامل پروژه و خطوط stale؛ ثبت/ویرایش/حذف MIV از _apply_consumption_rollup_deltas استفاده می‌کند.
+        """
+        def scoped():
+            conditions = [MIVRecord.project_id == project_id]
+            if line_nos is not None:
+                conditions.append(MIVRecord.line_no.in_(line_nos))
+            return conditions
+
+        base_qty = self._mto_base_qty_sql()
+        item_inch_dia = func.coalesce(MTOItem.inch_dia, 0)
+        mto_part = (
+            select(
+                MIVRecord.line_no.label("line_no"),
+                self._day_bucket(session, MTOConsumption.timestamp).label("day"),
+                MTOConsumption.miv_record_id.label("miv_record_id"),
+                MTOConsumption.used_qty.label("mto_qty"),
+                literal(0.0, Float).label("spool_qty"),
+                case((base_qty > 0, MTOConsumption.used_qty * item_inch_dia / base_qty), else_=0.0).label("inch_dia"),
+            )
+            .join(MIVRecord, MIVRecord.id == MTOConsumption.miv_record_id)
+            .join(MTOItem, MTOItem.id == MTOConsumption.mto_item_id)
+            .where(*scoped())
+        )
+        spool_part = (
+            select(
+                MIVRecord.line_no.label("line_no"),
+                self._day_bucket(session, SpoolConsumption.timestamp).label("day"),
+                SpoolConsumption.miv_record_id.label("miv_record_id"),
+                literal(0.0, Float).label("mto_qty"),
+                SpoolConsumption.used_qty.label("spool_qty"),
+                literal(0.0, Float).label("inch_dia"),
+            )
+            .join(MIVRecord, MIVRecord.id == SpoolConsumption.miv_record_id)
+            .where(*scoped())
+        )
+        consumption = union_all(mto_part, spool_part).subquery()
+        daily = (
+            select(
+                consumption.c.line_no,
+                consumption.c.day,
+                func.coalesce(func.sum(consumption.c.mto_qty), 0.0),
+                func.coalesce(func.sum(consumption.c.spool_qty), 0.0),
+                func.coalesce(func.sum(consumption.c.inch_dia), 0.0),
+                func.count(func.distinct(consumption.c.miv_record_id)),
+            )
+            .where(consumption.c.day.isnot(None))
+            .group_by(consumption.c.line_no, consumption.c.day)
+        )
+
+        now = now or datetime.now()
+        rows = []
+        for line_no, day, mto_qty, spool_qty, inch_dia, miv_count in session.execute(daily):
+            if isinstance(day, str):
+                day = datetime.strptime(day, "%Y-%m-%d").date()
+            rows.append({
+                "project_id": project_id, "line_no": line_no, "day": day,
+                "mto_qty": round(mto_qty, 4), "spool_qty": round(spool_qty, 4), "inch_dia": round(inch_dia, 4),
+                "miv_count": miv_count, "updated_at": now,
+            })
+
+        delete_filter = [DailyConsumptionRollup.project_id == project_id]
+        if line_nos is not None:
+            delete_filter.append(DailyConsumptionRollup.line_no.in_(line_nos))
+        session.execute(DailyConsumptionRollup.__table__.delete().where(*delete_filter))
+        for chunk in _chunks(rows, 1000):
+            session.execute(insert(DailyConsumptionRollup), chunk)
+
+    @staticmethod
+    def _apply_consumption_rollup_deltas(session, deltas, now=None):
+        """
+        اختلاف‌های ثبت‌شده با _add_consumption_rollup_delta را با یک upsert افزایشی
+        (mto_qty/spool_qty/inch_dia/miv_count += delta روی کلید پروژه، خط، روز) اعمال می‌کند.
+        روزهایی که دیگر هیچ MIV ندارند حذف می‌شوند.
+        """
+        now = now or datetime.now()
+        rows = [
+            {
+                "project_id": project_id, "line_no": line_no, "day": day, "mto_qty": mto_qty,
+                "spool_qty": spool_qty, "inch_dia": inch_dia, "miv_count": miv_count, "updated_at": now,
+            }
+            for (project_id, line_no, day), (mto_qty, spool_qty, inch_dia, miv_count) in sorted(deltas.items())
+            if mto_qty or spool_qty or inch_dia or miv_count
+        ]
+        if not rows:
+            return
+
+        rollup = DailyConsumptionRollup
+        table = rollup.__table__
+        increment_cols = ("mto_qty", "spool_qty", "inch_dia", "miv_count")
+        dialect = session.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            for chunk in _chunks(rows, 1000):
+                stmt = dialect_insert(table).values(chunk)
+                update_cols = {c: table.c[c] + stmt.excluded[c] for c in increment_cols}
+                update_cols["updated_at"] = stmt.excluded.updated_at
+                session.execute(stmt.on_conflict_do_update(index_elements=['project_id', 'line_no', 'day'],
+                                                           set_=update_cols))
+        else:
+            for row in rows:
+                key_filter = [table.c.project_id == row["project_id"], table.c.line_no == row["line_no"],
+                              table.c.day == row["day"]]
+                result = session.execute(table.update().where(*key_filter).values(
+                    {**{c: table.c[c] + row[c] for c in increment_cols}, "updated_at": now}))
+                if result.rowcount == 0:
+                    session.execute(insert(table), [row])
+
+        removed_days = [row for row in rows if row["miv_count"] < 0]
+        if removed_days:
+            session.execute(table.delete().where(
+                table.c.miv_count <= 0,
+                or_(*[and_(table.c.project_id == row["project_id"], table.c.line_no == row["line_no"],
+                           table.c.day == row["day"]) for row in removed_days])
+            ))
+
+    @staticmethod
+    def _as_date(value):
+        """تبدیل ورودی تاریخ (date / datetime / رشته YYYY-MM-DD) به date؛ مقدار خالی None می‌شود."""
+        if not value:
+            return None
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, str):
+            return datetime.strptime(value.strip()[:10], "%Y-%m-%d").date()
+        return value
+
+    def get_daily_consumption(self, project_id=None, line_no=None, start_date=None, end_date=None,
+                              session=None) -> List[Dict[str, Any]]:
+        """
+        سری زمانی روزانه مصرف از جدول daily_consumption_rollup (به جای اسکن جداول مصرف).
+        بدون project_id همه پروژه‌ها جمع زده می‌شوند؛ خروجی بر اساس تاریخ مرتب است.
+        تاریخ نامعتبر ValueError می‌دهد.
+        """
+        start_date, end_date = self._as_date(start_date), self._as_date(end_date)
+        own_session = session is None
+        if own_session:
+            session = self.get_session()
+        try:
+            if project_id is None:
+                self._ensure_all_progress_summaries(session)
+            else:
+                self._ensure_progress_summaries(session, project_id)
+
+            query = select(
+                DailyConsumptionRollup.day,
+                func.sum(DailyConsumptionRollup.mto_qty),
+                func.sum(DailyConsumptionRollup.spool_qty),
+                func.sum(DailyConsumptionRollup.inch_dia),
+                func.sum(DailyConsumptionRollup.miv_count),
+            )
+            if project_id is not None:
+                query = query.where(DailyConsumptionRollup.project_id == project_id)
+            if line_no:
+                query = query.where(DailyConsumptionRollup.line_no == line_no)
+            if start_date:
+                query = query.where(DailyConsumptionRollup.day >= start_date)
+            if end_date:
+                query = query.where(DailyConsumptionRollup.day <= end_date)
+            query = query.group_by(DailyConsumptionRollup.day).order_by(DailyConsumptionRollup.day)
+
+            return [
+                {
+                    "date": day.strftime('%Y-%m-%d'),
+                    "mto_qty": round(float(mto_qty or 0), 2),
+                    "spool_qty": round(float(spool_qty or 0), 2),
+                    "inch_dia": round(float(inch_dia or 0), 2),
+                    "miv_count": int(miv_count or 0),
+                }
+                for day, mto_qty, spool_qty, inch_dia, miv_count in session.execute(query)
+            ]
+        except Exception as e:
+            logging.error(f"Error in get_daily_consumption: {e}")
+            return []
+        finally:
+            if own_session:
+                session.close()
+
+    @staticmethod
+    def _upsert_rows(session, model_class, rows, key_columns):
+        """
+        درج یا به‌روزرسانی گروهی ردیف‌ها بر اساس کلید یکتا:
+        روی PostgreSQL و SQLite با INSERT ... ON CONFLICT DO UPDATE، روی بقیه با DELETE + INSERT.
+        """
+        if not rows:
+            return
+        dialect = session.get_bind().dialect.name
+        table = model_class.__table__
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            for chunk in _chunks(rows, 1000):
+                stmt = dialect_insert(table).values(chunk)
+                update_cols = {c: stmt.excluded[c] for c in chunk[0] if c not in key_columns}
+                session.execute(stmt.on_conflict_do_update(index_elements=key_columns, set_=update_cols))
+            return
+
+        for row in rows:
+            session.execute(table.delete().where(*[table.c[c] == row[c] for c in key_columns]))
+        for chunk in _chunks(rows, 1000):
+            session.execute(insert(table), chunk)
+
+    def _ensure_progress_summaries(self, session, project_id):
+        """
+        اگر پروژه هنوز ردیف خلاصه ندارد (دیتابیس قدیمی یا پروژه‌ی تازه)، خلاصه‌ها یک‌بار ساخته می‌شوند.
+        """
+        if session.get(ProjectProgressSummary, project_id) is not None:
+            return
+        if session.get(Project, project_id) is not None:
+            self.rebuild_progress_summaries(project_id)
+
+    def _ensure_all_progress_summaries(self, session):
+        """ساخت خلاصه‌ها برای همه پروژه‌هایی که هنوز ردیف خلاصه ندارند (گزارش‌های سراسری)."""
+        has_summary = exists().where(ProjectProgressSummary.project_id == Project.id)
+        for (project_id,) in session.execute(select(Project.id).where(~has_summary)).all():
+            self.rebuild_progress_summaries(project_id)
+
+    def rebuild_progress_summaries(self, project_id=None):
+        """
+        بازسازی کامل جداول خلاصه پیشرفت و تجمیع روزانه مصرف برای یک پروژه یا همه پروژه‌ها
+        (تعمیر / backfill بعد از مهاجرت).
+        """
+        session = self.get_session()
+        try:
+            if project_id is None:
+                project_ids = [pid for (pid,) in session.query(Project.id).all()]
+            else:
+                project_ids = [project_id]
+            for pid in project_ids:
+                self._refresh_progress_summaries(session, pid)
+            session.commit()
+            for pid in project_ids:
+                self.progress_cache.invalidate(pid)
+            return True, f"خلاصه پیشرفت {len(project_ids)} پروژه بازسازی شد."
+        except Exception as e:
+            session.rollback()
+            logging.error(f"خطا در بازسازی جداول خلاصه پیشرفت: {e}")
+            return False, f"خطا در بازسازی جداول خلاصه پیشرفت: {e}"
+        finally:
+            session.close()
+
     def generate_project_report(self, project_id):
         """
         تولید گزارش کامل پیشرفت پروژه
@@ -728,19 +2377,13 @@ class DataManager:
             "lines": []
         }
 
-        # گرفتن شماره تمام خطوط پروژه
-        from models import MTOItem
         session = self.get_session()
         try:
-            lines = (
-                session.query(MTOItem.line_no)
-                .filter(MTOItem.project_id == project_id)
-                .distinct()
-                .all()
-            )
-            for (line_no,) in lines:
-                line_progress = self.get_line_progress(project_id, line_no)
-                report["lines"].append(line_progress)
+            # وضعیت همه خطوط با یک کوئری گروهی
+            report["lines"] = [
+                {k: row[k] for k in ("line_no", "total_weight", "done_weight", "percentage")}
+                for row in self.get_line_status_rows(project_id, session=session)
+            ]
 
             # ثبت گزارش به عنوان فعالیت
             self.log_activity(
@@ -773,6 +2416,7 @@ class DataManager:
                     return False, f"پروژه‌ای با نام '{new_name}' از قبل وجود دارد."
 
                 project.name = new_name
+                self._mark_line_suggestions_dirty(session, project_id)
                 session.commit()
                 self.log_activity(user, "RENAME_PROJECT", f"Project '{original_name}' renamed to '{new_name}'")
                 return True, f"نام پروژه با موفقیت به '{new_name}' تغییر یافت."
@@ -813,6 +2457,7 @@ class DataManager:
                 )
                 session.add(new_record)
 
+            self._mark_progress_dirty(session, to_project_id, line_no)
             session.commit()
             self.log_activity(user, "COPY_LINE",
                               f"Line '{line_no}' copied from project {from_project_id} to {to_project_id}")
@@ -850,34 +2495,45 @@ class DataManager:
             session.close()
 
     def is_line_complete(self, project_id, line_no):
+        """
+        بررسی تکمیل بودن خط: همه‌ی آیتم‌های MTO باید به اندازه‌ی مقدار لازم (طول برای پایپ، تعداد برای بقیه) مصرف شده باشند.
+        کل بررسی با یک کوئری تجمیعی انجام می‌شود.
+        """
         session = self.get_session()
         try:
-            mto_items = session.query(MTOItem).filter(
-                MTOItem.project_id == project_id,
-                MTOItem.line_no == line_no
-            ).all()
-
-            if not mto_items:
-                return False
-
-            for item in mto_items:
-                if item.item_type and 'pipe' in item.item_type.lower():
-                    total_required = item.length_m or 0
-                else:
-                    total_required = item.quantity or 0
-
-                total_used = session.query(func.coalesce(func.sum(MTOConsumption.used_qty), 0.0)) \
-                    .filter(MTOConsumption.mto_item_id == item.id).scalar()
+            per_item = (
+                session.query(
+                    MTOItem.id,
+                    self._mto_base_qty_sql(zero_if_null=True).label("required"),
+                    func.coalesce(func.sum(MTOConsumption.used_qty), 0.0).label("used"),
+                )
+                .outerjoin(MTOConsumption, MTOConsumption.mto_item_id == MTOItem.id)
+                .filter(MTOItem.project_id == project_id, MTOItem.line_no == line_no, MTOItem.is_active == True)
+                .group_by(MTOItem.id, MTOItem.item_type, MTOItem.length_m, MTOItem.quantity)
+                .subquery()
+            )
+            item_count, incomplete_count = session.query(
+                func.count(per_item.c.id),
+                func.coalesce(func.sum(case((per_item.c.used < per_item.c.required, 1), else_=0)), 0),
+            ).one()
 
-                if total_used < total_required:
-                    return False
-            return True
+            return item_count > 0 and incomplete_count == 0
         finally:
             session.close()
 
+    @staticmethod
+    def _mto_base_qty_sql(zero_if_null=False):
+        """معادل SQL تابع _mto_base_qty: طول برای پایپ و تعداد برای بقیه."""
+        is_pipe = func.lower(func.coalesce(MTOItem.item_type, '')).like('%pipe%')
+        if zero_if_null:
+            return case((is_pipe, func.coalesce(MTOItem.length_m, 0)), else_=func.coalesce(MTOItem.quantity, 0))
+        return case((is_pipe, MTOItem.length_m), else_=MTOItem.quantity)
+
     def get_enriched_line_progress(self, project_id, line_no, readonly=True):
         """
         داده‌های پیشرفت متریال یک خط را به همراه اطلاعات تکمیلی از MTOItem برمی‌گرداند.
+        با readonly=True چیزی نوشته نمی‌شود: آیتم‌هایی که هنوز ردیف پیشرفت ندارند در حافظه محاسبه می‌شوند
+        (اولین ثبت MIV خط، ردیف‌ها را داخل همان تراکنش می‌سازد).
         """
         session = self.get_session()
         try:
@@ -885,29 +2541,41 @@ class DataManager:
             if not readonly:
                 self.initialize_mto_progress_for_line(project_id, line_no)
 
-            # جوین MTOProgress با MTOItem برای گرفتن اطلاعات بیشتر
+            # آیتم‌های فعال خط همراه ردیف پیشرفتشان (در صورت وجود)
             results = session.query(
                 MTOProgress,
+                MTOItem.id,
                 MTOItem.p1_bore_in,
                 MTOItem.item_type
-            ).join(
-                MTOItem, MTOProgress.mto_item_id == MTOItem.id
+            ).select_from(MTOItem).outerjoin(
+                MTOProgress, MTOProgress.mto_item_id == MTOItem.id
             ).filter(
-                MTOProgress.project_id == project_id,
-                MTOProgress.line_no == line_no
+                MTOItem.project_id == project_id,
+                MTOItem.line_no == line_no,
+                MTOItem.is_active == True
             ).all()
 
+            computed = None
             progress_data = []
-            for item in results:
-                progress_record, p1_bore, item_type = item
+            for progress_record, mto_item_id, p1_bore, item_type in results:
+                if progress_record is None:
+                    if computed is None:
+                        computed = {row['mto_item_id']: row
+                                    for row in self._compute_mto_progress_rows(session, project_id, line_no)}
+                    values = computed.get(mto_item_id)
+                    if values is None:
+                        continue
+                else:
+                    values = {column: getattr(progress_record, column) for column in (
+                        'item_code', 'description', 'unit', 'total_qty', 'used_qty', 'remaining_qty')}
                 progress_data.append({
-                    "mto_item_id": progress_record.mto_item_id,
-                    "Item Code": progress_record.item_code,
-                    "Description": progress_record.description,
-                    "Unit": progress_record.unit,
-                    "Total Qty": progress_record.total_qty or 0,
-                    "Used Qty": progress_record.used_qty or 0,
-                    "Remaining Qty": progress_record.remaining_qty or 0,
+                    "mto_item_id": mto_item_id,
+                    "Item Code": values['item_code'],
+                    "Description": values['description'],
+                    "Unit": values['unit'],
+                    "Total Qty": round(values['total_qty'] or 0, 2),
+                    "Used Qty": round(values['used_qty'] or 0, 2),
+                    "Remaining Qty": round(values['remaining_qty'] or 0, 2),
                     "Bore": p1_bore,
                     "Type": item_type
                 })
@@ -919,50 +2587,52 @@ class DataManager:
             session.close()
 
     def initialize_mto_progress_for_line(self, project_id, line_no):
+        """
+        برای آیتم‌های MTO خط که هنوز ردیف پیشرفت ندارند، ردیف MTOProgress (بر حسب inch-dia) می‌سازد.
+        کل عملیات یک دستور INSERT ... SELECT ... GROUP BY است.
+        """
+        self.initialize_mto_progress_for_lines(project_id, [line_no])
+
+    def initialize_mto_progress_for_lines(self, project_id, line_nos):
+        """
+        نسخه گروهی initialize_mto_progress_for_line: همه خطوط داده‌شده با یک INSERT ... SELECT
+        (برای هر تکه از خطوط) و یک commit مقداردهی می‌شوند.
+        """
+        line_nos = list(line_nos)
+        if not line_nos:
+            return
         session = self.get_session()
         try:
-            mto_items = session.query(MTOItem).filter(
-                MTOItem.project_id == project_id,
-                MTOItem.line_no == line_no
-            ).all()
-
-            for item in mto_items:
-                exists = session.query(MTOProgress).filter(
-                    MTOProgress.mto_item_id == item.id
-                ).first()
-
-                if not exists:
-                    # 🆕 total_qty حالا همان inch_dia است
-                    total_qty_inch_dia = item.inch_dia or 0
-
-                    # محاسبه used_qty (بر اساس inch_dia)
-                    total_used = session.query(
-                        func.coalesce(func.sum(MTOConsumption.used_qty), 0.0)
-                    ).filter(MTOConsumption.mto_item_id == item.id).scalar()
-
-                    # تبدیل used_qty به inch_dia
-                    is_pipe = item.item_type and 'pipe' in item.item_type.lower()
-                    base_qty = item.length_m if is_pipe else item.quantity
-
-                    if base_qty and base_qty > 0:
-                        used_qty_inch_dia = total_used * (total_qty_inch_dia / base_qty)
-                    else:
-                        used_qty_inch_dia = 0
-
-                    new_progress = MTOProgress(
-                        project_id=project_id,
-                        line_no=line_no,
-                        mto_item_id=item.id,
-                        item_code=item.item_code,
-                        description=item.description,
-                        unit=item.unit,
-                        total_qty=round(total_qty_inch_dia, 2),
-                        used_qty=round(used_qty_inch_dia, 2),
-                        remaining_qty=round(max(0, total_qty_inch_dia - used_qty_inch_dia), 2),
-                        last_updated=datetime.now()
-                    )
-                    session.add(new_progress)
-
+            # 🆕 total_qty همان inch_dia است و used_qty به نسبت inch_dia / base_qty تبدیل می‌شود
+            # (بدون گرد کردن، مثل _compute_mto_progress_rows و _apply_mto_progress_delta)
+            total_qty = func.coalesce(MTOItem.inch_dia, 0)
+            base_qty = self._mto_base_qty_sql()
+            total_used = func.coalesce(func.sum(MTOConsumption.used_qty), 0.0)
+            used_qty = case((base_qty > 0, total_used * total_qty / base_qty), else_=0.0)
+            remaining_qty = case((total_qty - used_qty > 0, total_qty - used_qty), else_=0.0)
+
+            has_progress = exists().where(MTOProgress.mto_item_id == MTOItem.id)
+            rows = (
+                select(
+                    literal(project_id, Integer), MTOItem.line_no, MTOItem.id,
+                    MTOItem.item_code, MTOItem.description, MTOItem.unit,
+                    total_qty, used_qty, remaining_qty,
+                    literal(datetime.now(), DateTime),
+                )
+                .select_from(MTOItem)
+                .outerjoin(MTOConsumption, MTOConsumption.mto_item_id == MTOItem.id)
+                .group_by(MTOItem.id, MTOItem.line_no, MTOItem.item_code, MTOItem.description, MTOItem.unit,
+                          MTOItem.inch_dia, MTOItem.item_type, MTOItem.length_m, MTOItem.quantity)
+            )
+            for chunk in _chunks(line_nos):
+                for line_no in chunk:
+                    self._mark_progress_dirty(session, project_id, line_no)
+                session.execute(insert(MTOProgress).from_select(
+                    ['project_id', 'line_no', 'mto_item_id', 'item_code', 'description', 'unit',
+                     'total_qty', 'used_qty', 'remaining_qty', 'last_updated'],
+                    rows.where(MTOItem.project_id == project_id, MTOItem.line_no.in_(chunk),
+                               MTOItem.is_active == True, ~has_progress)
+                ))
             session.commit()
         except Exception as e:
             session.rollback()
@@ -1014,56 +2684,65 @@ class DataManager:
         """
         بروزرسانی جدول mto_progress بر اساس آیتم‌های مصرفی جدید.
         updates: لیستی از تاپل‌ها (item_code, qty, unit, description)
+        مقدار کل و مصرف‌شده‌ی همه‌ی آیتم‌های خط با یک کوئری گروه‌بندی‌شده خوانده می‌شود.
         """
         session = self.get_session()
         try:
-            for item_code, qty, unit, desc in updates:
-                # پیدا کردن آیتم‌ها از MTOItem
-                query = session.query(MTOItem).filter(
-                    MTOItem.project_id == project_id,
-                    MTOItem.line_no == line_no
+            # مجموع مقدار لازم و مصرف‌شده به تفکیک item_code و description (یک کوئری برای کل خط)
+            per_item = (
+                session.query(
+                    MTOItem.id.label("mto_item_id"),
+                    MTOItem.item_code,
+                    MTOItem.description,
+                    self._mto_base_qty_sql(zero_if_null=True).label("total"),
+                    func.coalesce(func.sum(MTOConsumption.used_qty), 0.0).label("used"),
+                )
+                .outerjoin(MTOConsumption, MTOConsumption.mto_item_id == MTOItem.id)
+                .filter(MTOItem.project_id == project_id, MTOItem.line_no == line_no, MTOItem.is_active == True)
+                .group_by(MTOItem.id, MTOItem.item_code, MTOItem.description,
+                          MTOItem.item_type, MTOItem.length_m, MTOItem.quantity)
+                .all()
+            )
+            by_code, by_desc = defaultdict(list), defaultdict(list)
+            for row in per_item:
+                by_code[row.item_code].append(row)
+                by_desc[row.description].append(row)
+
+            progress_ids = {
+                row.item_code: row.id for row in session.query(MTOProgress.id, MTOProgress.item_code).filter(
+                    MTOProgress.project_id == project_id,
+                    MTOProgress.line_no == line_no,
+                    MTOProgress.item_code.in_({item_code or "" for item_code, _, _, _ in updates})
                 )
+            }
 
+            progress_updates = {}
+            for item_code, qty, unit, desc in updates:
+                # پیدا کردن آیتم‌ها از MTOItem
                 if item_code and str(item_code).strip():
-                    query = query.filter(MTOItem.item_code == str(item_code).strip())
+                    mto_items = by_code.get(str(item_code).strip(), [])
                 else:
-                    query = query.filter(MTOItem.description == str(desc).strip())
-
-                mto_items = query.all()
-
-                # محاسبه Total Qty
-                total_qty = 0
-                for mto_item in mto_items:
-                    if mto_item.item_type and "pipe" in mto_item.item_type.lower():
-                        total_qty += mto_item.length_m or 0
-                    else:
-                        total_qty += mto_item.quantity or 0
-
-                # محاسبه Used Qty
-                used_qty = 0
-                for mto_item in mto_items:
-                    used_qty += (
-                                    session.query(func.coalesce(func.sum(MTOConsumption.used_qty), 0.0))
-                                    .filter(MTOConsumption.mto_item_id == mto_item.id)
-                                    .scalar()
-                                ) or 0
+                    mto_items = by_desc.get(str(desc).strip(), [])
 
+                total_qty = sum(row.total for row in mto_items)
+                used_qty = sum(row.used for row in mto_items)
                 remaining_qty = max(0, total_qty - used_qty)
 
                 # پیدا کردن یا ساخت رکورد در MTOProgress
-                progress_row = session.query(MTOProgress).filter(
-                    MTOProgress.line_no == line_no,
-                    MTOProgress.item_code == (item_code or "")
-                ).first()
-
-                if progress_row:
-                    progress_row.total_qty = total_qty
-                    progress_row.used_qty = used_qty
-                    progress_row.remaining_qty = remaining_qty
-                    progress_row.last_updated = datetime.now()
-                else:
+                progress_id = progress_ids.get(item_code or "")
+                if progress_id:
+                    progress_updates[progress_id] = {
+                        'id': progress_id,
+                        'total_qty': total_qty,
+                        'used_qty': used_qty,
+                        'remaining_qty': remaining_qty,
+                        'last_updated': datetime.now(),
+                    }
+                elif mto_items:
                     new_progress = MTOProgress(
+                        project_id=project_id,
                         line_no=line_no,
+                        mto_item_id=mto_items[0].mto_item_id,
                         item_code=item_code or "",
                         description=desc,
                         unit=unit,
@@ -1073,7 +2752,13 @@ class DataManager:
                         last_updated=datetime.now()
                     )
                     session.add(new_progress)
+                    session.flush()
+                    progress_ids[item_code or ""] = new_progress.id
 
+            # همه‌ی ویرایش‌ها با یک UPDATE گروهی (executemany)
+            if progress_updates:
+                session.bulk_update_mappings(MTOProgress, list(progress_updates.values()))
+            self._mark_progress_dirty(session, project_id, line_no)
             session.commit()
         except Exception as e:
             session.rollback()
@@ -1086,7 +2771,7 @@ class DataManager:
         try:
             query = session.query(func.coalesce(func.sum(MTOConsumption.used_qty), 0.0)) \
                 .join(MTOItem, MTOConsumption.mto_item_id == MTOItem.id) \
-                .filter(MTOItem.project_id == project_id, MTOItem.line_no == line_no)
+                .filter(MTOItem.project_id == project_id, MTOItem.line_no == line_no, MTOItem.is_active == True)
 
             if item_code and str(item_code).strip():
                 query = query.filter(MTOItem.item_code == str(item_code).strip())
@@ -1098,25 +2783,35 @@ class DataManager:
             session.close()
 
     def suggest_line_no(self, project_id, line_no_input):
-        session = self.get_session()
-        try:
-            all_lines = [x[0] for x in session.query(MTOItem.line_no)
-            .filter(MTOItem.project_id == project_id)
-            .distinct().all()]
-            norm_input = str(line_no_input).replace(" ", "").lower()
-            normalized_lines = {line: str(line).replace(" ", "").lower() for line in all_lines}
+        """نزدیک‌ترین شماره خط پروژه به ورودی (امتیاز بیشتر از 0.6) یا None."""
+        suggestions = self.suggest_line_nos(project_id, line_no_input, top_k=1, min_score=0.6)
+        if suggestions and suggestions[0][1] > 0.6:
+            return suggestions[0][0]
+        return None
 
-            best_match = None
-            best_ratio = 0
-            for original, normalized in normalized_lines.items():
-                ratio = difflib.SequenceMatcher(None, norm_input, normalized).ratio()
-                if ratio > best_ratio:
-                    best_ratio = ratio
-                    best_match = original
+    def suggest_line_nos(self, project_id, line_no_input, top_k: int = 5,
+                         min_score: float = 0.6) -> List[Tuple[str, float]]:
+        """
+        پیشنهاد فازی شماره خط در یک پروژه به صورت [(line_no, score), ...] از بیشترین امتیاز.
+        matcher هر پروژه یک بار ساخته و نگه داشته می‌شود و بعد از ایمپورت MTO همان پروژه
+        (یا تغییر mto_items در پروسه‌ی دیگر) دور ریخته می‌شود.
+        """
+        return self._get_fuzzy_line_matcher(project_id).search(line_no_input, top_k, min_score)
 
-            return best_match if best_ratio > 0.6 else None
-        finally:
-            session.close()
+    def _get_fuzzy_line_matcher(self, project_id) -> FuzzyLineMatcher:
+        self._check_line_suggestions()
+        matcher = self._fuzzy_line_matchers.get(project_id)
+        if matcher is None:
+            session = self.get_session()
+            try:
+                lines = session.execute(
+                    select(MTOItem.line_no).where(MTOItem.project_id == project_id, MTOItem.is_active == True)
+                    .distinct()
+                ).scalars().all()
+            finally:
+                session.close()
+            matcher = self._fuzzy_line_matchers[project_id] = FuzzyLineMatcher(lines)
+        return matcher
 
     # --------------------------------------------------------------------
     # متدهای لازم برای گذارش گیری
@@ -1129,7 +2824,8 @@ class DataManager:
         session = self.get_session()
         try:
             lines = session.query(MTOItem.line_no).filter(
-                MTOItem.project_id == project_id
+                MTOItem.project_id == project_id,
+                MTOItem.is_active == True
             ).distinct().order_by(MTOItem.line_no).all()
 
             return [line[0] for line in lines]
@@ -1159,9 +2855,11 @@ class DataManager:
 
             # --- Filters ---
             if filters.get('item_code'):
-                summary_query = summary_query.filter(MTOProgress.item_code.ilike(f"%{filters['item_code']}%"))
+                summary_query = summary_query.filter(
+                    self._substring_condition(session, 'progress_item_code', filters['item_code']))
             if filters.get('description'):
-                summary_query = summary_query.filter(MTOProgress.description.ilike(f"%{filters['description']}%"))
+                summary_query = summary_query.filter(
+                    self._substring_condition(session, 'progress_description', filters['description']))
 
             # اجرای کوئری برای گرفتن تمام نتایج فیلتر شده
             all_results = summary_query.all()
@@ -1223,31 +2921,19 @@ class DataManager:
         """
         گزارش لیست وضعیت خطوط (Line Status List) را برای یک پروژه تولید می‌کند.
         """
-        session = self.get_session()
         try:
-            lines = self.get_lines_for_project(project_id)
-            report_data = []
-            for line_no in lines:
-                progress_info = self.get_line_progress(project_id, line_no)
-                last_activity = session.query(func.max(MIVRecord.last_updated)).filter(
-                    MIVRecord.project_id == project_id,
-                    MIVRecord.line_no == line_no
-                ).scalar()
-
-                status = "Complete" if progress_info.get("percentage", 0) >= 99.99 else "In-Progress"
-
-                report_data.append({
-                    "Line No": line_no,
-                    "Progress (%)": progress_info.get("percentage", 0),
-                    "Status": status,
-                    "Last Activity Date": last_activity.strftime('%Y-%m-%d') if last_activity else "N/A"
-                })
-            return sorted(report_data, key=lambda x: x['Line No'])
+            return [
+                {
+                    "Line No": row["line_no"],
+                    "Progress (%)": row["percentage"],
+                    "Status": "Complete" if row["percentage"] >= 99.99 else "In-Progress",
+                    "Last Activity Date": row["last_activity"].strftime('%Y-%m-%d') if row["last_activity"] else "N/A"
+                }
+                for row in self.get_line_status_rows(project_id)
+            ]
         except Exception as e:
             logging.error(f"Error in get_project_line_status_list: {e}")
             return []
-        finally:
-            session.close()
 
     def get_detailed_line_report(self, project_id: int, line_no: str) -> Dict[str, List]:
         """
@@ -1335,62 +3021,92 @@ class DataManager:
 
     def get_spool_inventory_report(self, **filters) -> Dict[str, Any]:
         """
-        --- CHANGE: بازنویسی کامل برای افزودن فیلتر، مرتب‌سازی و صفحه‌بندی ---
-        گزارش موجودی انبار اسپول را تولید می‌کند.
+        گزارش موجودی انبار اسپول با فیلتر، مرتب‌سازی و صفحه‌بندی keyset.
+        - sort_by یکی از SPOOL_INVENTORY_SORT_KEYS (پیش‌فرض spool_id) و sort_order برابر 'asc' یا 'desc'.
+        - صفحه بعد با cursor (مقدار next_cursor پاسخ قبلی) خوانده می‌شود و هزینه آن مستقل از عمق صفحه است.
+          page بدون cursor (سازگاری با نسخه قبل) همچنان با OFFSET اجرا می‌شود.
+        - count: 'estimate' (پیش‌فرض؛ شمارش دقیق تا SEARCH_COUNT_CAP و بیشتر از آن تخمینی)، 'exact' یا 'none'.
+          شمارش فقط برای صفحه اول (بدون cursor) انجام می‌شود.
         """
+        sort_by = filters.get('sort_by') or 'spool_id'
+        descending = filters.get('sort_order', 'asc') == 'desc'
+        order = [(column, descending) for column in
+                 SPOOL_INVENTORY_SORT_KEYS.get(sort_by, SPOOL_INVENTORY_SORT_KEYS['spool_id'])]
+        order.append((SpoolItem.id, descending))
+
+        per_page = max(1, min(int(filters.get('per_page') or 20), SPOOL_INVENTORY_MAX_PAGE_SIZE))
+        page = max(1, int(filters.get('page') or 1))
+        cursor = filters.get('cursor')
+        after = self._decode_cursor(cursor, len(order)) if cursor else None
+        count_mode = filters.get('count', 'estimate')
+
         session = self.get_session()
         try:
-            query = session.query(Spool, SpoolItem).join(
-                SpoolItem, Spool.id == SpoolItem.spool_id_fk
-            ).filter(
-                (SpoolItem.qty_available > 0.001) | (SpoolItem.length > 0.001)
-            )
+            conditions = [(SpoolItem.qty_available > 0.001) | (SpoolItem.length > 0.001)]
 
             # --- Filters ---
             if filters.get('spool_id'):
-                query = query.filter(Spool.spool_id.ilike(f"%{filters['spool_id']}%"))
+                conditions.append(Spool.spool_id.ilike(f"%{filters['spool_id']}%"))
             if filters.get('location'):
-                query = query.filter(Spool.location.ilike(f"%{filters['location']}%"))
+                conditions.append(Spool.location.ilike(f"%{filters['location']}%"))
             if filters.get('component_type'):
-                query = query.filter(SpoolItem.component_type.ilike(f"%{filters['component_type']}%"))
+                conditions.append(SpoolItem.component_type.ilike(f"%{filters['component_type']}%"))
             if filters.get('material'):
-                query = query.filter(SpoolItem.material.ilike(f"%{filters['material']}%"))
+                conditions.append(SpoolItem.material.ilike(f"%{filters['material']}%"))
 
-            # --- Sorting ---
-            sort_by = filters.get('sort_by', 'spool_id')
-            sort_order = filters.get('sort_order', 'asc')
-            sort_column = getattr(Spool, sort_by, getattr(SpoolItem, sort_by, Spool.spool_id))
-            query = query.order_by(desc(sort_column) if sort_order == 'desc' else sort_column)
+            query = select(
+                Spool.id, Spool.spool_id, Spool.location, SpoolItem.id, SpoolItem.component_type, SpoolItem.item_code,
+                SpoolItem.material, SpoolItem.p1_bore, SpoolItem.schedule, SpoolItem.length, SpoolItem.qty_available
+            ).join(SpoolItem, Spool.id == SpoolItem.spool_id_fk).where(*conditions)
 
             # --- Pagination ---
-            page = filters.get('page', 1)
-            per_page = filters.get('per_page', 20)
-            total_records = query.count()
-            total_pages = (total_records + per_page - 1) // per_page
-
-            results = query.offset((page - 1) * per_page).limit(per_page).all()
+            if after is not None:
+                query = query.where(self._keyset_condition(order, after, self._nulls_sort_largest(session)))
+            elif page > 1:
+                query = query.offset((page - 1) * per_page)
+            query = query.order_by(*self._keyset_order_by(order)).limit(per_page + 1)
+
+            rows = session.execute(query).all()
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+
+            total_records, total_is_exact = None, False
+            if cursor is None and count_mode != 'none':
+                id_query = select(SpoolItem.id).join(Spool, Spool.id == SpoolItem.spool_id_fk).where(*conditions)
+                if count_mode == 'exact':
+                    total_records = session.execute(select(func.count()).select_from(id_query.subquery())).scalar()
+                    total_is_exact = True
+                else:
+                    total_records, total_is_exact = self._estimate_count(session, id_query)
 
             report_data = []
-            for spool, item in results:
-                is_pipe = "PIPE" in (item.component_type or "").upper()
+            for row in rows:
+                is_pipe = "PIPE" in (row.component_type or "").upper()
                 report_data.append({
-                    "Spool ID": spool.spool_id,
-                    "Location": spool.location,
-                    "Component Type": item.component_type,
-                    "Item Code": item.item_code,
-                    "Material": item.material,
-                    "Bore1": item.p1_bore,
-                    "Schedule": item.schedule,
-                    "Available": round(item.length if is_pipe else item.qty_available, 2),
+                    "Spool ID": row.spool_id,
+                    "Location": row.location,
+                    "Component Type": row.component_type,
+                    "Item Code": row.item_code,
+                    "Material": row.material,
+                    "Bore1": row.p1_bore,
+                    "Schedule": row.schedule,
+                    "Available": round(row.length if is_pipe else row.qty_available, 2),
                     "Unit": "m" if is_pipe else "pcs"
                 })
 
+            next_cursor = None
+            if has_more:
+                last = rows[-1]._mapping
+                next_cursor = self._encode_cursor([last[column] for column, _ in order])
+
             return {
                 "pagination": {
                     "total_records": total_records,
-                    "total_pages": total_pages,
-                    "current_page": page,
-                    "per_page": per_page
+                    "total_is_exact": total_is_exact,
+                    "total_pages": (total_records + per_page - 1) // per_page if total_records is not None else None,
+                    "current_page": page if cursor is None else None,
+                    "per_page": per_page,
+                    "next_cursor": next_cursor
                 },
                 "data": report_data
             }
@@ -1448,10 +3164,10 @@ class DataManager:
         try:
             # گزارش اول: توزیع پیشرفت خطوط (برای نمودار میله‌ای یا دایره‌ای)
             if report_name == 'line_progress_distribution':
-                lines = self.get_project_line_status_list(project_id)
+                lines = self.get_line_status_rows(project_id, session=session)
                 bins = {"0-25%": 0, "25-50%": 0, "50-75%": 0, "75-99%": 0, "100%": 0}
                 for line in lines:
-                    p = line['Progress (%)']
+                    p = line['percentage']
                     if p < 25:
                         bins["0-25%"] += 1
                     elif p < 50:
@@ -1493,19 +3209,22 @@ class DataManager:
 
             # گزارش سوم: تاریخچه مصرف در طول زمان (برای نمودار خطی)
             elif report_name == 'consumption_over_time':
-                # این گزارش سراسری است و به پروژه وابسته نیست
-                query = session.query(
-                    func.strftime('%Y-%m-%d', SpoolConsumption.timestamp).label('date'),
-                    func.count(SpoolConsumption.id).label('consumption_count')
-                ).group_by('date').order_by('date')
-
-                results = query.all()
+                # از جدول تجمیع روزانه خوانده می‌شود؛ بدون project_id سراسری است
+                days = self.get_daily_consumption(
+                    project_id, line_no=params.get('line_no'),
+                    start_date=params.get('start_date'), end_date=params.get('end_date'), session=session
+                )
                 return {
-                    "title": "تعداد آیتم‌های مصرفی از انبار اسپول در طول زمان",
+                    "title": "مصرف متریال (MTO و اسپول) در طول زمان",
                     "type": "line",
                     "data": {
-                        "labels": [r.date for r in results],
-                        "datasets": [{"label": "تعداد مصرف", "data": [r.consumption_count for r in results]}]
+                        "labels": [d["date"] for d in days],
+                        "datasets": [
+                            {"label": "تعداد MIV", "data": [d["miv_count"] for d in days]},
+                            {"label": "مصرف MTO", "data": [d["mto_qty"] for d in days]},
+                            {"label": "مصرف اسپول", "data": [d["spool_qty"] for d in days]},
+                            {"label": "Inch-Dia", "data": [d["inch_dia"] for d in days]},
+                        ]
                     }
                 }
 
@@ -1586,12 +3305,10 @@ class DataManager:
                 if not spool_item:
                     raise Exception(f"آیتم اسپول با شناسه {spool_item_id} یافت نشد.")
 
-                if spool_item.qty_available < used_qty:
+                # ۱. کاهش اتمی موجودی از آیتم اسپول (بررسی موجودی داخل همان UPDATE انجام می‌شود)
+                if not self._adjust_spool_stock(session, spool_item, -used_qty):
                     raise Exception(f"موجودی آیتم {spool_item.id} کافی نیست.")
 
-                # ۱. کاهش موجودی از آیتم اسپول
-                spool_item.qty_available -= used_qty
-
                 # ۲. ثبت رکورد مصرف در جدول SpoolConsumption
                 new_consumption = SpoolConsumption(
                     spool_item_id=spool_item.id,
@@ -1603,6 +3320,9 @@ class DataManager:
                 session.add(new_consumption)
                 spool_ids_used.add(str(spool_item.spool.id))
 
+            self._mark_progress_dirty(session, miv_record.project_id, miv_record.line_no)
+            # MIV ممکن است امروز مصرف دیگری هم داشته باشد (miv_count)؛ تجمیع روزانه‌ی خط از نو ساخته می‌شود
+            self._mark_rollup_stale(session, miv_record.project_id, miv_record.line_no)
             session.commit()
 
             self.log_activity(
@@ -1651,6 +3371,7 @@ class DataManager:
         mto_item_query = session.query(MTOItem).filter(
             MTOItem.project_id == project_id,
             MTOItem.line_no == line_no,
+            MTOItem.is_active == True,
             func.upper(MTOItem.item_type).in_(spool_equivalents)
         )
         if p1_bore is not None:
@@ -1729,6 +3450,9 @@ class DataManager:
                 if hasattr(spool, key):
                     setattr(spool, key, value)
 
+            # آیتم‌ها دستی عوض می‌شوند؛ merge بعدی این اسپول را دوباره با فایل مقایسه می‌کند
+            spool.items_signature = None
+
             # پاک کردن آیتم‌های قدیمی
             session.query(SpoolItem).filter(SpoolItem.spool_id_fk == spool.id).delete()
             session.flush()
@@ -1857,18 +3581,77 @@ class DataManager:
             session.flush()  # برای گرفتن شناسه پروژه جدید
         return project
 
-    def update_project_mto_from_csv(self, project_name: str, mto_file_path: str) -> Tuple[bool, str]:
+    def _bulk_insert_dataframe(self, session, model_class, df: pd.DataFrame, chunk_size: int = 10000) -> int:
         """
-        --- CHANGE: استفاده از تابع نرمال‌سازی جدید برای انعطاف‌پذیری بیشتر ---
+        یک DataFrame نرمال‌شده را در جدول مدل داده‌شده، داخل تراکنش جاری سشن درج می‌کند.
+        - روی PostgreSQL از COPY FROM STDIN با بافر CSV جریانی استفاده می‌شود.
+        - روی سایر دیتابیس‌ها (مثلاً SQLite) همان درج executemany در تکه‌های chunk_size ردیفی انجام می‌شود.
+        ستون‌های عددی بر اساس نوع ستون مدل تبدیل می‌شوند تا هر دو مسیر نتیجه‌ی یکسان بدهند.
         """
-        # --- CHANGE: تعریف نگاشت بر اساس نام‌های نرمال‌شده و ستون‌های ضروری دیتابیس ---
-        REQUIRED_DB_COLS = {'line_no', 'description'}
-        MTO_COLUMN_MAP = {
-            'UNIT': 'unit', 'LINENO': 'line_no', 'CLASS': 'item_class', 'TYPE': 'item_type',
-            'DESCRIPTION': 'description', 'ITEMCODE': 'item_code', 'MAT': 'material_code',
-            'P1BOREIN': 'p1_bore_in', 'P2BOREIN': 'p2_bore_in', 'P3BOREIN': 'p3_bore_in',
-            'LENGTHM': 'length_m', 'QUANTITY': 'quantity', 'JOINT': 'joint', 'INCHDIA': 'inch_dia'
-        }
+        table = model_class.__table__
+        columns = [c for c in table.columns if c.name in df.columns]
+        if df.empty or not columns:
+            return 0
+
+        df = df[[c.name for c in columns]].copy()
+        for column in columns:
+            if isinstance(column.type, Integer):
+                df[column.name] = pd.to_numeric(df[column.name], errors='coerce').round().astype('Int64')
+            elif isinstance(column.type, Float):
+                df[column.name] = pd.to_numeric(df[column.name], errors='coerce')
+            elif isinstance(column.type, String):
+                # مثل FORCE_NOT_NULL در مسیر COPY، متن خالی در هر دو مسیر رشته‌ی خالی ذخیره می‌شود
+                df[column.name] = df[column.name].fillna('')
+
+        started = time.perf_counter()
+        if session.get_bind().dialect.name == 'postgresql':
+            method = "COPY"
+            self._copy_dataframe(session, table, df, columns, chunk_size)
+        else:
+            method = "executemany"
+            for start in range(0, len(df), chunk_size):
+                chunk = df.iloc[start:start + chunk_size].astype(object)
+                records = chunk.where(chunk.notna(), None).to_dict(orient='records')
+                session.execute(table.insert(), records)
+
+        elapsed = time.perf_counter() - started
+        logging.info(f"Bulk load ({method}): {len(df)} rows into '{table.name}' in {elapsed:.2f}s")
+        return len(df)
+
+    @staticmethod
+    def _copy_dataframe(session, table, df: pd.DataFrame, columns, chunk_size: int):
+        """
+        داده‌ها را با COPY FROM STDIN روی همان اتصال (و تراکنش) سشن بارگذاری می‌کند.
+        مقدار خالیِ ستون‌های متنی رشته‌ی خالی می‌ماند (FORCE_NOT_NULL) و در ستون‌های عددی NULL می‌شود.
+        """
+        column_list = ", ".join(f'"{c.name}"' for c in columns)
+        text_columns = [f'"{c.name}"' for c in columns if isinstance(c.type, String)]
+        options = "FORMAT csv"
+        if text_columns:
+            options += f", FORCE_NOT_NULL ({', '.join(text_columns)})"
+        copy_sql = f'COPY "{table.name}" ({column_list}) FROM STDIN WITH ({options})'
+
+        dbapi_connection = session.connection().connection
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(copy_sql, _DataFrameCsvStream(df, chunk_size))
+        finally:
+            cursor.close()
+
+    def update_project_mto_from_csv(self, project_name: str, mto_file_path: str,
+                                    mode: str = "merge", mto_df: pd.DataFrame | None = None,
+                                    chunk_size: int | None = None) -> Tuple[bool, str]:
+        """
+        آپدیت آیتم‌های MTO یک پروژه از روی فایل CSV.
+        - mode="merge" (پیش‌فرض): فقط تفاوت‌ها اعمال می‌شوند (درج آیتم جدید، ویرایش آیتم تغییرکرده،
+          حذف آیتم حذف‌شده) و مصرف‌های ثبت‌شده روی آیتم‌ها حفظ می‌شوند.
+        - mode="replace": رفتار قدیمی؛ تمام آیتم‌ها، مصرف‌ها و پیشرفت‌های پروژه حذف و از نو درج می‌شوند.
+        - mto_df: در صورت ارسال، DataFrame از قبل پارس‌شده (مثلاً در process pool) به جای خواندن فایل استفاده می‌شود.
+        - chunk_size: در صورت ارسال (یا برای فایل‌های بزرگ‌تر از MTO_STREAMING_THRESHOLD_BYTES) فایل به صورت
+          تکه‌تکه خوانده و درج می‌شود تا مصرف حافظه مستقل از حجم فایل باشد؛ همه‌ی تکه‌ها در یک تراکنش هستند.
+        """
+        if mode not in ("merge", "replace"):
+            return False, f"حالت آپدیت نامعتبر است: {mode}"
 
         session = self.get_session()
         try:
@@ -1878,59 +3661,251 @@ class DataManager:
                 project = self.get_or_create_project(session, project_name)
                 project_id = project.id
 
-                # خواندن و پردازش DataFrame با تابع جدید
-                mto_df_raw = pd.read_csv(mto_file_path, dtype=str).fillna('')
-                mto_df = self._normalize_and_rename_df(
-                    mto_df_raw, MTO_COLUMN_MAP, REQUIRED_DB_COLS, os.path.basename(mto_file_path)
-                )
-                mto_df['project_id'] = project_id
+                if mto_df is not None:
+                    chunks = [mto_df]
+                else:
+                    if chunk_size is None and os.path.getsize(mto_file_path) > MTO_STREAMING_THRESHOLD_BYTES:
+                        chunk_size = MTO_STREAMING_CHUNK_ROWS
+                    if chunk_size:
+                        chunks = self._iter_mto_chunks(mto_file_path, chunk_size)
+                    else:
+                        chunks = [self._read_mto_dataframe(mto_file_path)]
+                chunks = (chunk.assign(project_id=project_id) for chunk in chunks)
+                # آیتم‌های MTO کل پروژه عوض می‌شوند؛ cache پیشرفت همه خطوط بعد از commit نامعتبر می‌شود
+                self._mark_progress_dirty(session, project_id)
+                self._mark_line_suggestions_dirty(session, project_id)
+
+                if mode == "replace":
+                    # حذف داده‌های قدیمی
+                    mto_item_ids_to_delete = session.query(MTOItem.id).filter(MTOItem.project_id == project_id).scalar_subquery()
+                    session.query(MTOConsumption).filter(MTOConsumption.mto_item_id.in_(mto_item_ids_to_delete)).delete(synchronize_session=False)
+                    session.query(MTOProgress).filter(MTOProgress.project_id == project_id).delete(synchronize_session=False)
+                    session.query(MTOItem).filter(MTOItem.project_id == project_id).delete(synchronize_session=False)
+                    session.flush()
+
+                    # درج داده‌های جدید (COPY روی PostgreSQL، executemany روی سایر دیتابیس‌ها)
+                    inserted = sum(self._bulk_insert_dataframe(session, MTOItem, chunk) for chunk in chunks)
+                    details = f"{inserted} آیتم MTO برای '{project_name}' جایگزین شد."
+                else:
+                    stats = self._merge_mto_items(session, project_id, chunks)
+                    details = (f"MTO '{project_name}': {stats['inserted']} جدید، {stats['updated']} ویرایش، "
+                               f"{stats['retired']} حذف، {stats['unchanged']} بدون تغییر"
+                               f"{'، ' + str(stats['kept_consumed']) + ' آیتم حذف‌شده‌ی دارای مصرف غیرفعال شد' if stats['kept_consumed'] else ''}.")
 
-                # تبدیل ستون‌های عددی
-                for col in ['p1_bore_in', 'p2_bore_in', 'p3_bore_in', 'length_m', 'quantity', 'joint', 'inch_dia']:
-                     if col in mto_df.columns:
-                        mto_df[col] = pd.to_numeric(mto_df[col], errors='coerce')
+            self.log_activity("system", "MTO_UPDATE_SUCCESS", details)
+            return True, f"✔ داده‌های MTO برای پروژه '{project_name}' با موفقیت به‌روزرسانی شدند. ({details})"
 
+        except (ValueError, KeyError, FileNotFoundError) as e:
+            session.rollback()
+            logging.error(f"شکست در آپدیت MTO برای {project_name}: {e}")
+            return False, f"خطا در فایل MTO پروژه '{project_name}': {e}"
+        except Exception as e:
+            session.rollback()
+            logging.error(f"An unexpected error occurred during MTO update for {project_name}: {e}")
+            return False, f"خطای غیرمنتظره در آپدیت MTO پروژه '{project_name}': {e}"
+        finally:
+            session.close()
 
-                # حذف داده‌های قدیمی (بدون تغییر)
-                mto_item_ids_to_delete = session.query(MTOItem.id).filter(MTOItem.project_id == project_id).scalar_subquery()
-                session.query(MTOConsumption).filter(MTOConsumption.mto_item_id.in_(mto_item_ids_to_delete)).delete(synchronize_session=False)
-                session.query(MTOProgress).filter(MTOProgress.project_id == project_id).delete(synchronize_session=False)
-                session.query(MTOItem).filter(MTOItem.project_id == project_id).delete(synchronize_session=False)
-                session.flush()
+    @staticmethod
+    def _read_mto_dataframe(mto_file_path: str) -> pd.DataFrame:
+        """فایل CSV مربوط به MTO را خوانده، ستون‌ها را نرمال‌سازی و ستون‌های عددی را تبدیل می‌کند."""
+        mto_df_raw = pd.read_csv(mto_file_path, dtype=str).fillna('')
+        mto_df = DataManager._normalize_and_rename_df(
+            mto_df_raw, MTO_COLUMN_MAP, MTO_REQUIRED_DB_COLS, os.path.basename(mto_file_path)
+        )
+        return DataManager._coerce_mto_numeric(mto_df)
 
-                # درج داده‌های جدید
-                mto_records = mto_df.to_dict(orient='records')
-                if mto_records:
-                    session.bulk_insert_mappings(MTOItem, mto_records)
+    @staticmethod
+    def _iter_mto_chunks(mto_file_path: str, chunk_size: int):
+        """
+        فایل MTO را در تکه‌های chunk_size ردیفی می‌خواند.
+        نگاشت ستون‌ها فقط یک بار از روی هدر ساخته می‌شود و تبدیل نوع برای هر تکه جداگانه انجام می‌شود.
+        """
+        header = pd.read_csv(mto_file_path, dtype=str, nrows=0).columns
+        rename_map = DataManager._resolve_column_map(
+            header, MTO_COLUMN_MAP, MTO_REQUIRED_DB_COLS, os.path.basename(mto_file_path)
+        )
+        for chunk in pd.read_csv(mto_file_path, dtype=str, chunksize=chunk_size, usecols=list(rename_map)):
+            chunk = chunk.fillna('').rename(columns=rename_map)
+            yield DataManager._coerce_mto_numeric(chunk)
+
+    @staticmethod
+    def _coerce_mto_numeric(mto_df: pd.DataFrame) -> pd.DataFrame:
+        """تبدیل ستون‌های عددی MTO (مقادیر نامعتبر به NaN تبدیل می‌شوند)."""
+        for col in MTO_NUMERIC_COLS:
+            if col in mto_df.columns:
+                mto_df[col] = pd.to_numeric(mto_df[col], errors='coerce')
+        return mto_df
+
+    @staticmethod
+    def _merge_value(value, numeric: bool):
+        """مقدار یک ستون را برای مقایسه در merge یکسان‌سازی می‌کند (NaN/None و فاصله‌های اضافی)."""
+        if numeric:
+            if value is None or pd.isna(value):
+                return None
+            return round(float(value), 6)
+        if value is None or (isinstance(value, float) and pd.isna(value)):
+            return ''
+        return str(value).strip()
 
-            self.log_activity("system", "MTO_UPDATE_SUCCESS", f"{len(mto_df)} آیتم MTO برای '{project_name}' آپدیت شد.")
-            return True, f"✔ داده‌های MTO برای پروژه '{project_name}' با موفقیت به‌روزرسانی شدند."
+    @staticmethod
+    def _mto_merge_value(column, value):
+        """یکسان‌سازی مقدار یک ستون MTO برای ساخت کلید merge."""
+        return DataManager._merge_value(value, column in MTO_NUMERIC_COLS)
+
+    @staticmethod
+    def _merge_changes(record: dict, current, value_cols, numeric_cols) -> dict:
+        """ستون‌هایی از record که با ردیف فعلی دیتابیس متفاوت‌اند (NaN به None تبدیل می‌شود)."""
+        changes = {}
+        for col in value_cols:
+            new_value = DataManager._merge_value(record.get(col), col in numeric_cols)
+            if new_value != DataManager._merge_value(current[col], col in numeric_cols):
+                changes[col] = None if new_value is None else record.get(col)
+        return changes
+
+    def _merge_mto_items(self, session, project_id: int, mto_chunks) -> Dict[str, int]:
+        """
+        آیتم‌های فایل را با آیتم‌های فعلی پروژه بر اساس کلید (line_no, item_code, description, bores) مقایسه می‌کند.
+        آیتم‌های جدید درج، آیتم‌های تغییرکرده ویرایش و آیتم‌های حذف‌شده (در صورت نداشتن مصرف) حذف می‌شوند.
+        آیتم حذف‌شده‌ای که مصرف دارد با is_active=False بازنشسته می‌شود تا تاریخچه مصرف از بین نرود ولی
+        در پیشرفت، خلاصه‌ها و انتخاب آیتم‌ها شمرده نشود؛ اگر در ریویژن بعدی برگردد دوباره فعال می‌شود.
+        mto_chunks یک iterable از DataFrameها است تا فایل‌های بزرگ تکه‌تکه پردازش شوند؛ برای هر تکه فقط آیتم‌های
+        فعلی خطوط همان تکه خوانده می‌شوند و از کل پروژه فقط idهای جفت‌شده و آیتم‌های حذف‌شده در حافظه می‌مانند.
+        """
+        stats = {'inserted': 0, 'updated': 0, 'retired': 0, 'kept_consumed': 0, 'unchanged': 0}
+
+        def merge_key(row):
+            return tuple(self._mto_merge_value(c, row.get(c)) for c in MTO_MERGE_KEY_COLUMNS)
+
+        # آیتم‌هایی که همین ادغام درج می‌کند (id بزرگ‌تر) با ردیف‌های بعدی فایل جفت نمی‌شوند
+        last_existing_id = session.query(func.max(MTOItem.id)).filter(MTOItem.project_id == project_id).scalar()
+        if last_existing_id is None:
+            # پروژه‌ی جدید یا خالی: نیازی به مقایسه نیست و کل فایل یکجا درج می‌شود
+            for mto_df in mto_chunks:
+                stats['inserted'] += self._bulk_insert_dataframe(session, MTOItem, mto_df)
+            return stats
+
+        existing_columns = [MTOItem.id, MTOItem.is_active] + \
+            [getattr(MTOItem, c) for c in MTO_MERGE_KEY_COLUMNS + MTO_MERGE_VALUE_COLUMNS]
+        matched_ids = set()
+        affected_lines = set()
+        for mto_df in mto_chunks:
+            # فقط آیتم‌های فعلی خطوط همین تکه خوانده می‌شوند (برای آیتم‌های تکراری، اول آیتم‌های فعال و بعد
+            # به ترتیب id جفت می‌شوند)؛ آیتم‌هایی که در تکه‌های قبلی جفت شده‌اند کنار گذاشته می‌شوند
+            existing = defaultdict(list)
+            for lines in _chunks(mto_df['line_no'].drop_duplicates().tolist()):
+                rows = session.query(*existing_columns).filter(
+                    MTOItem.project_id == project_id, MTOItem.id <= last_existing_id, MTOItem.line_no.in_(lines)
+                ).order_by(MTOItem.is_active.desc(), MTOItem.id)
+                for row in rows:
+                    if row.id not in matched_ids:
+                        existing[merge_key(row._mapping)].append(row._mapping)
+
+            value_cols = [c for c in MTO_MERGE_VALUE_COLUMNS if c in mto_df.columns]
+            inserts, updates = [], []
+            for record in mto_df.to_dict(orient='records'):
+                matches = existing.get(merge_key(record))
+                if not matches:
+                    inserts.append(record)
+                    affected_lines.add(record['line_no'])
+                    continue
+
+                current = matches.pop(0)
+                matched_ids.add(current['id'])
+                changes = self._merge_changes(record, current, value_cols, MTO_NUMERIC_COLS)
+                if not current['is_active']:
+                    changes['is_active'] = True
+                if changes:
+                    changes['id'] = current['id']
+                    updates.append(changes)
+                    affected_lines.add(current['line_no'])
+                else:
+                    stats['unchanged'] += 1
+
+            # اعمال تغییرات هر تکه قبل از خواندن تکه‌ی بعدی (حافظه محدود به اندازه‌ی تکه)
+            if updates:
+                session.bulk_update_mappings(MTOItem, updates)
+            if inserts:
+                self._bulk_insert_dataframe(session, MTOItem, pd.DataFrame(inserts))
+            stats['updated'] += len(updates)
+            stats['inserted'] += len(inserts)
+
+        # آیتم‌هایی که در فایل جدید نیستند؛ پیمایش صفحه‌به‌صفحه بر اساس id
+        removed, already_retired = {}, set()
+        last_id = 0
+        while True:
+            page = session.query(MTOItem.id, MTOItem.line_no, MTOItem.is_active).filter(
+                MTOItem.project_id == project_id, MTOItem.id > last_id, MTOItem.id <= last_existing_id
+            ).order_by(MTOItem.id).limit(MTO_MERGE_SCAN_PAGE_SIZE).all()
+            if not page:
+                break
+            last_id = page[-1].id
+            for item_id, line_no, is_active in page:
+                if item_id not in matched_ids:
+                    removed[item_id] = line_no
+                    if not is_active:
+                        already_retired.add(item_id)
+        consumed_ids = set()
+        for chunk in _chunks(list(removed)):
+            consumed_ids.update(
+                item_id for (item_id,) in
+                session.query(MTOConsumption.mto_item_id).filter(MTOConsumption.mto_item_id.in_(chunk)).distinct()
+            )
+        retired_ids = [item_id for item_id in removed if item_id not in consumed_ids]
+        deactivated_ids = [item_id for item_id in consumed_ids if item_id not in already_retired]
+
+        for chunk in _chunks(retired_ids):
+            session.query(MTOProgress).filter(MTOProgress.mto_item_id.in_(chunk)).delete(synchronize_session=False)
+            session.query(MTOItem).filter(MTOItem.id.in_(chunk)).delete(synchronize_session=False)
+        for chunk in _chunks(deactivated_ids):
+            session.query(MTOProgress).filter(MTOProgress.mto_item_id.in_(chunk)).delete(synchronize_session=False)
+            session.query(MTOItem).filter(MTOItem.id.in_(chunk)).update(
+                {MTOItem.is_active: False}, synchronize_session=False)
+        affected_lines.update(removed[item_id] for item_id in retired_ids + deactivated_ids)
+        session.flush()
+
+        # پیشرفت فقط برای خطوطی که قبلاً مقداردهی شده‌اند و تغییر کرده‌اند از نو محاسبه می‌شود
+        initialized_lines = set()
+        for chunk in _chunks(list(affected_lines)):
+            initialized_lines.update(
+                line for (line,) in session.query(MTOProgress.line_no).filter(
+                    MTOProgress.project_id == project_id, MTOProgress.line_no.in_(chunk)
+                ).distinct()
+            )
+        for line_no in initialized_lines:
+            self._rebuild_mto_progress_for_line(session, project_id, line_no)
 
-        except (ValueError, KeyError, FileNotFoundError) as e:
-            session.rollback()
-            logging.error(f"شکست در آپدیت MTO برای {project_name}: {e}")
-            return False, f"خطا در فایل MTO پروژه '{project_name}': {e}"
-        except Exception as e:
-            session.rollback()
-            logging.error(f"An unexpected error occurred during MTO update for {project_name}: {e}")
-            return False, f"خطای غیرمنتظره در آپدیت MTO پروژه '{project_name}': {e}"
-        finally:
-            session.close()
+        stats['retired'] = len(retired_ids)
+        stats['kept_consumed'] = len(deactivated_ids)
+        return stats
 
-    def process_selected_csv_files(self, file_paths: List[str]) -> Tuple[bool, str]:
+    def process_selected_csv_files(self, file_paths: List[str], progress_callback=None,
+                                   max_workers: int | None = None) -> Tuple[bool, str]:
         """
-        --- NEW: تابع جدید برای پردازش هوشمند فایل‌های CSV انتخاب شده ---
-        فایل‌ها را دسته‌بندی کرده و عملیات آپدیت مربوطه (MTO یا Spool) را اجرا می‌کند.
+        فایل‌های CSV انتخاب‌شده را دسته‌بندی کرده و عملیات آپدیت مربوطه (Spool، MTO یا MIV) را اجرا می‌کند.
+        - فایل‌های MTO کوچک در یک process pool پارس می‌شوند و فایل‌های بزرگ به صورت streaming خوانده می‌شوند.
+        - بارگذاری هر پروژه در دیتابیس به صورت همزمان و در تراکنش مستقل خودش انجام می‌شود.
+        - progress_callback(file_name, ok, message) پس از اتمام هر فایل در همان thread فراخواننده صدا زده می‌شود.
         """
+        def report(path, ok, message):
+            if progress_callback:
+                try:
+                    progress_callback(os.path.basename(path), ok, message)
+                except Exception as callback_error:
+                    logging.error(f"Progress callback failed: {callback_error}")
+
         try:
             # دسته‌بندی فایل‌های انتخاب شده
             mto_files = {}
+            miv_files = []
             spool_file = None
             spool_items_file = None
 
             for path in file_paths:
                 filename = os.path.basename(path)
-                if filename.upper().startswith("MTO-") and filename.upper().endswith(".CSV"):
+                if filename.upper().startswith("MIV-") and filename.upper().endswith((".CSV", ".XLSX")):
+                    miv_files.append(path)
+                elif filename.upper().startswith("MTO-") and filename.upper().endswith(".CSV"):
                     project_name = filename.replace("MTO-", "").replace(".csv", "")
                     mto_files[project_name] = path
                 elif filename.upper() == "SPOOLS.CSV":
@@ -1941,9 +3916,10 @@ class DataManager:
             # بررسی شرایط لازم برای هر نوع آپدیت
             can_update_spool = spool_file and spool_items_file
             can_update_mto = bool(mto_files)
+            can_import_miv = bool(miv_files)
 
-            if not can_update_spool and not can_update_mto:
-                return False, "هیچ فایل معتبری انتخاب نشد.\nبرای آپدیت MTO، نام فایل باید `MTO-ProjectName.csv` باشد.\nبرای آپدیت Spool، هر دو فایل `Spools.csv` و `SpoolItems.csv` باید انتخاب شوند."
+            if not can_update_spool and not can_update_mto and not can_import_miv:
+                return False, "هیچ فایل معتبری انتخاب نشد.\nبرای آپدیت MTO، نام فایل باید `MTO-ProjectName.csv` باشد.\nبرای آپدیت Spool، هر دو فایل `Spools.csv` و `SpoolItems.csv` باید انتخاب شوند.\nبرای ایمپورت گروهی MIV، نام فایل باید با `MIV-` شروع شود."
 
             summary_log = []
 
@@ -1951,21 +3927,28 @@ class DataManager:
             # این عملیات اول انجام می‌شود چون ممکن است MTO به آن وابسته باشد.
             if can_update_spool:
                 logging.info("Processing Spool files...")
-                success, message = self.replace_all_spool_data(spool_file, spool_items_file)
+                success, message = self.merge_spool_data(spool_file, spool_items_file)
+                report(spool_file, success, message)
                 if not success:
                     # اگر آپدیت اسپول شکست بخورد، کل عملیات متوقف می‌شود
                     return False, f"خطا در به‌روزرسانی Spool: {message}"
                 summary_log.append(message)
 
-            # ۲. آپدیت داده‌های MTO (برای هر فایل MTO به صورت مجزا)
+            # ۲. آپدیت داده‌های MTO (پارس موازی، سپس بارگذاری همزمان هر پروژه در تراکنش خودش)
             if can_update_mto:
-                for project_name, mto_path in sorted(mto_files.items()):
-                    logging.info(f"Processing MTO file for project '{project_name}'...")
-                    success, message = self.update_project_mto_from_csv(project_name, mto_path)
+                errors = self._update_projects_mto_parallel(mto_files, summary_log, report, max_workers)
+                if errors:
+                    summary_log.extend(errors)
+                    return False, "\n".join(summary_log + ["عملیات MTO برای پروژه‌های بالا ناموفق بود."])
+
+            # ۳. ایمپورت گروهی MIVها (بعد از MTO چون به آیتم‌های MTO ارجاع می‌دهند)
+            if can_import_miv:
+                for miv_path in sorted(miv_files):
+                    logging.info(f"Importing MIV file '{os.path.basename(miv_path)}'...")
+                    success, message = self.import_miv_records_from_file(miv_path)
+                    report(miv_path, success, message)
                     if not success:
-                        # اگر آپدیت یک پروژه شکست بخورد، کل عملیات متوقف می‌شود
-                        error_msg = f"خطا در آپدیت پروژه '{project_name}': {message}. عملیات متوقف شد."
-                        return False, error_msg
+                        return False, f"{message}\nعملیات متوقف شد."
                     summary_log.append(message)
 
             return True, "\n".join(summary_log)
@@ -1975,38 +3958,95 @@ class DataManager:
             logging.error(f"An unexpected error occurred in process_selected_csv_files: {traceback.format_exc()}")
             return False, f"یک خطای پیش‌بینی نشده در پردازش فایل‌ها رخ داد: {e}"
 
-    def replace_all_spool_data(self, spool_file_path: str, spool_items_file_path: str) -> Tuple[bool, str]:
+    def _update_projects_mto_parallel(self, mto_files: Dict[str, str], summary_log: List[str], report,
+                                      max_workers: int | None = None) -> List[str]:
         """
-        --- CHANGE: استفاده از تابع نرمال‌سازی جدید برای انعطاف‌پذیری بیشتر ---
+        فایل‌های MTO چند پروژه را در دیتابیس بارگذاری می‌کند؛ هر پروژه در یک thread و تراکنش جداگانه.
+        فایل‌های کوچک در process pool پارس می‌شوند و هر نتیجه بلافاصله به thread بارگذاری سپرده می‌شود؛
+        فایل‌های بزرگ‌تر از MTO_STREAMING_THRESHOLD_BYTES مستقیماً با مسیرشان بارگذاری و تکه‌تکه خوانده می‌شوند.
+        پیام موفقیت‌ها به summary_log اضافه و لیست پیام‌های خطا برگردانده می‌شود.
         """
-        # --- CHANGE: تعریف نگاشت بر اساس نام‌های نرمال‌شده و ستون‌های ضروری دیتابیس ---
-        REQUIRED_SPOOL_DB_COLS = {"spool_id"}
-        REQUIRED_SPOOL_ITEM_DB_COLS = {"spool_id_str", "component_type"}
+        workers = max_workers or min(len(mto_files), os.cpu_count() or 1)
+        errors = []
+
+        streamed, small = [], []
+        for project_name, path in sorted(mto_files.items()):
+            try:
+                is_large = os.path.getsize(path) > MTO_STREAMING_THRESHOLD_BYTES
+            except OSError:
+                # خطای فایل (مثلاً نبودن آن) هنگام پارس گزارش می‌شود
+                is_large = False
+            (streamed if is_large else small).append(project_name)
+
+        # SQLite نوشتن همزمان را پشتیبانی نمی‌کند، پس در آن حالت فقط یک thread استفاده می‌شود.
+        db_workers = 1 if self.engine.dialect.name == 'sqlite' else min(workers, self.engine.pool.size())
+        load_futures = {}
+        handed_off = set()
+
+        with ThreadPoolExecutor(max_workers=max(1, db_workers)) as db_pool:
+            def load(project_name, mto_df=None):
+                # mto_df=None یعنی فایل در خود thread بارگذاری خوانده می‌شود (برای فایل بزرگ به صورت streaming)
+                handed_off.add(project_name)
+                future = db_pool.submit(self.update_project_mto_from_csv, project_name,
+                                        mto_files[project_name], "merge", mto_df)
+                load_futures[future] = project_name
+
+            for project_name in streamed:
+                load(project_name)
+
+            # پارس و نرمال‌سازی فایل‌های کوچک (CPU-bound) در process pool
+            started = time.perf_counter()
+            if small:
+                try:
+                    with ProcessPoolExecutor(max_workers=min(workers, len(small))) as pool:
+                        futures = {pool.submit(_parse_mto_file, mto_files[name]): name for name in small}
+                        for future in as_completed(futures):
+                            # future از dict حذف می‌شود تا DataFrame فقط تا پایان بارگذاری در حافظه بماند
+                            project_name = futures.pop(future)
+                            try:
+                                load(project_name, future.result())
+                            except (ValueError, KeyError, FileNotFoundError) as e:
+                                handed_off.add(project_name)
+                                errors.append(f"خطا در فایل MTO پروژه '{project_name}': {e}")
+                                report(mto_files[project_name], False, errors[-1])
+                            del future
+                except (BrokenProcessPool, OSError) as e:
+                    # در برخی محیط‌ها (مثلاً نسخه‌ی فریزشده) ساخت پروسه ممکن نیست؛
+                    # فایل‌های باقی‌مانده در خود threadهای بارگذاری خوانده می‌شوند.
+                    logging.warning(f"Process pool unavailable, parsing MTO files in loader threads: {e}")
+                    for project_name in small:
+                        if project_name not in handed_off:
+                            load(project_name)
+            logging.info(f"Parsed {len(small)} MTO files with {workers} workers in {time.perf_counter() - started:.2f}s; "
+                         f"{len(streamed)} large files streamed")
+
+            for future in as_completed(load_futures):
+                project_name = load_futures[future]
+                success, message = future.result()
+                report(mto_files[project_name], success, message)
+                if success:
+                    summary_log.append(message)
+                else:
+                    errors.append(f"خطا در آپدیت پروژه '{project_name}': {message}")
 
-        SPOOL_COLUMN_MAP = {
-            "SPOOLID": "spool_id", "ROWNO": "row_no", "LOCATION": "location", "COMMAND": "command"
-        }
-        SPOOL_ITEM_COLUMN_MAP = {
-            "SPOOLID": "spool_id_str", "COMPONENTTYPE": "component_type", "CLASSANGLE": "class_angle",
-            "P1BORE": "p1_bore", "P2BORE": "p2_bore", "MATERIAL": "material", "SCHEDULE": "schedule",
-            "THICKNESS": "thickness", "LENGTH": "length", "QTYAVAILABLE": "qty_available", "ITEMCODE": "item_code"
-        }
+        return errors
+
+    def replace_all_spool_data(self, spool_file_path: str, spool_items_file_path: str) -> Tuple[bool, str]:
+        """
+        تمام داده‌های Spool (اسپول‌ها، آیتم‌ها و مصرف‌ها) را حذف و از روی فایل‌ها جایگزین می‌کند.
+        برای آپدیت بدون از دست رفتن تاریخچه‌ی مصرف از merge_spool_data استفاده کنید.
+        """
         session = self.get_session()
         try:
             with session.begin():
-                # پردازش فایل Spools.csv
-                spools_df_raw = pd.read_csv(spool_file_path, dtype=str).fillna('')
-                spools_df = self._normalize_and_rename_df(
-                    spools_df_raw, SPOOL_COLUMN_MAP, REQUIRED_SPOOL_DB_COLS, os.path.basename(spool_file_path)
-                )
-                spools_df['spool_id'] = spools_df['spool_id'].str.strip().str.upper()
+                spools_df, spool_items_df = self._read_spool_dataframes(spool_file_path, spool_items_file_path)
 
-                # پردازش فایل SpoolItems.csv
-                spool_items_df_raw = pd.read_csv(spool_items_file_path, dtype=str).fillna('')
-                spool_items_df = self._normalize_and_rename_df(
-                    spool_items_df_raw, SPOOL_ITEM_COLUMN_MAP, REQUIRED_SPOOL_ITEM_DB_COLS, os.path.basename(spool_items_file_path)
-                )
-                spool_items_df['spool_id_str'] = spool_items_df['spool_id_str'].str.strip().str.upper()
+                # خطوطی که مصرف اسپول داشته‌اند؛ تجمیع روزانه‌ی آن‌ها بعد از حذف مصرف‌ها بازسازی می‌شود
+                consumed_lines = session.query(MIVRecord.project_id, MIVRecord.line_no).join(
+                    SpoolConsumption, SpoolConsumption.miv_record_id == MIVRecord.id).distinct().all()
+                for project_id, line_no in consumed_lines:
+                    self._mark_progress_dirty(session, project_id, line_no)
+                    self._mark_rollup_stale(session, project_id, line_no)
 
                 # حذف داده‌های قدیمی (بدون تغییر)
                 session.query(SpoolConsumption).delete(synchronize_session=False)
@@ -2014,27 +4054,18 @@ class DataManager:
                 session.query(Spool).delete(synchronize_session=False)
                 session.flush()
 
-                # درج داده‌های جدید Spools و ساخت نگاشت (بدون تغییر)
-                spool_records = spools_df.to_dict(orient="records")
-                if spool_records:
-                    session.bulk_insert_mappings(Spool, spool_records)
+                # درج داده‌های جدید Spools و ساخت نگاشت
+                self._bulk_insert_dataframe(session, Spool, spools_df)
                 session.flush()
 
                 spool_id_map = {spool.spool_id: spool.id for spool in session.query(Spool.id, Spool.spool_id).all()}
 
-                # درج داده‌های جدید SpoolItems (بدون تغییر)
+                # درج داده‌های جدید SpoolItems
                 spool_items_df["spool_id_fk"] = spool_items_df["spool_id_str"].map(spool_id_map)
                 spool_items_df.dropna(subset=["spool_id_fk"], inplace=True)
                 spool_items_df["spool_id_fk"] = spool_items_df["spool_id_fk"].astype(int)
 
-                # تبدیل ستون‌های عددی
-                for col in ["class_angle", "p1_bore", "p2_bore", "thickness", "length", "qty_available"]:
-                     if col in spool_items_df.columns:
-                        spool_items_df[col] = pd.to_numeric(spool_items_df[col], errors='coerce')
-
-                item_records = spool_items_df.drop(columns=["spool_id_str"]).to_dict(orient="records")
-                if item_records:
-                    session.bulk_insert_mappings(SpoolItem, item_records)
+                self._bulk_insert_dataframe(session, SpoolItem, spool_items_df.drop(columns=["spool_id_str"]))
 
             self.log_activity("system", "SPOOL_UPDATE_SUCCESS", f"{len(spools_df)} اسپول و {len(spool_items_df)} آیتم اسپول جایگزین شدند.")
             return True, "✔ داده‌های Spool با موفقیت به صورت کامل جایگزین شدند."
@@ -2046,6 +4077,441 @@ class DataManager:
         finally:
             session.close()
 
+    def _read_spool_dataframes(self, spool_file_path: str, spool_items_file_path: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """فایل‌های Spools.csv و SpoolItems.csv را خوانده، ستون‌ها را نرمال‌سازی و ستون‌های عددی را تبدیل می‌کند."""
+        spools_df_raw = pd.read_csv(spool_file_path, dtype=str).fillna('')
+        spools_df = self._normalize_and_rename_df(
+            spools_df_raw, SPOOL_COLUMN_MAP, SPOOL_REQUIRED_DB_COLS, os.path.basename(spool_file_path)
+        )
+        spools_df['spool_id'] = spools_df['spool_id'].str.strip().str.upper()
+        for col in SPOOL_NUMERIC_COLS:
+            if col in spools_df.columns:
+                spools_df[col] = pd.to_numeric(spools_df[col], errors='coerce').round().astype('Int64')
+
+        spool_items_df_raw = pd.read_csv(spool_items_file_path, dtype=str).fillna('')
+        spool_items_df = self._normalize_and_rename_df(
+            spool_items_df_raw, SPOOL_ITEM_COLUMN_MAP, SPOOL_ITEM_REQUIRED_DB_COLS, os.path.basename(spool_items_file_path)
+        )
+        spool_items_df['spool_id_str'] = spool_items_df['spool_id_str'].str.strip().str.upper()
+
+        # تبدیل ستون‌های عددی
+        for col in SPOOL_ITEM_NUMERIC_COLS:
+            if col in spool_items_df.columns:
+                spool_items_df[col] = pd.to_numeric(spool_items_df[col], errors='coerce')
+        return spools_df, spool_items_df
+
+    @staticmethod
+    def _spool_item_signatures(spool_items_df: pd.DataFrame) -> Dict[int, str]:
+        """
+        امضای آیتم‌های هر اسپول در فایل ({spool_id_fk: 'تعداد:hash'})؛ مستقل از ترتیب ردیف‌ها.
+        اسپولی که امضای ذخیره‌شده‌اش با فایل یکی است در merge مقایسه نمی‌شود.
+        """
+        if spool_items_df.empty:
+            return {}
+        columns = [c for c in SPOOL_ITEM_MERGE_KEY_COLUMNS + SPOOL_ITEM_MERGE_VALUE_COLUMNS if c in spool_items_df.columns]
+        row_hashes = pd.util.hash_pandas_object(spool_items_df[columns], index=False)
+        grouped = pd.DataFrame({'fk': spool_items_df['spool_id_fk'].to_numpy(), 'h': row_hashes.to_numpy()}).sort_values('fk')
+        fks, starts, counts = np.unique(grouped['fk'].to_numpy(), return_index=True, return_counts=True)
+        # جمع hashها به پیمانه‌ی 2^64 (ترتیب ردیف‌ها اثری ندارد)
+        sums = np.add.reduceat(grouped['h'].to_numpy(dtype=np.uint64), starts)
+        return {int(fk): f"{count}:{int(total):016x}" for fk, count, total in zip(fks, counts, sums)}
+
+    def merge_spool_data(self, spool_file_path: str, spool_items_file_path: str) -> Tuple[bool, str]:
+        """
+        داده‌های Spool را به صورت افزایشی با فایل‌ها همگام می‌کند و مصرف‌های ثبت‌شده را حفظ می‌کند.
+        - اسپول‌ها با spool_id و آیتم‌ها با (اسپول، مشخصات آیتم) شناسایی می‌شوند.
+        - آیتم‌ها فقط برای اسپول‌هایی مقایسه می‌شوند که امضای آیتم‌هایشان (items_signature) با فایل فرق دارد.
+        - فقط ردیف‌های جدید درج، ردیف‌های تغییرکرده ویرایش و ردیف‌های حذف‌شده (بدون مصرف) حذف می‌شوند؛
+          موجودی آیتم حذف‌شده‌ی دارای مصرف صفر می‌شود تا در انتخاب اسپول و گزارش موجودی دیده نشود.
+        - مقدار طول/تعداد در فایل موجودی اولیه است؛ موجودی آیتم‌ها در خود SQL برابر (مقدار فایل - مجموع مصرف) می‌شود
+          و ردیف‌ها پیش از آن قفل (FOR UPDATE) می‌شوند تا با ثبت مصرف همزمان تداخل نکند.
+        """
+        session = self.get_session()
+        try:
+            with session.begin():
+                spools_df, spool_items_df = self._read_spool_dataframes(spool_file_path, spool_items_file_path)
+                spools_df = spools_df.drop_duplicates(subset=['spool_id'], keep='last')
+                stats = {key: 0 for key in (
+                    'spools_inserted', 'spools_updated', 'spools_retired',
+                    'items_inserted', 'items_updated', 'items_retired', 'items_kept_consumed')}
+
+                # --- اسپول‌ها ---
+                spool_value_cols = [c for c in SPOOL_MERGE_VALUE_COLUMNS if c in spools_df.columns]
+                existing_spools = {
+                    row.spool_id: row._mapping for row in
+                    session.query(Spool.id, Spool.spool_id, Spool.items_signature,
+                                  *[getattr(Spool, c) for c in SPOOL_MERGE_VALUE_COLUMNS])
+                }
+                stored_signatures = {row['id']: row['items_signature'] for row in existing_spools.values()}
+                new_spools, spool_updates = [], []
+                for record in spools_df.to_dict(orient='records'):
+                    current = existing_spools.pop(record['spool_id'], None)
+                    if current is None:
+                        new_spools.append(record)
+                        continue
+                    changes = self._merge_changes(record, current, spool_value_cols, SPOOL_NUMERIC_COLS)
+                    if changes:
+                        changes['id'] = current['id']
+                        spool_updates.append(changes)
+
+                if spool_updates:
+                    session.bulk_update_mappings(Spool, spool_updates)
+                if new_spools:
+                    self._bulk_insert_dataframe(session, Spool, pd.DataFrame(new_spools))
+                session.flush()
+                stats['spools_inserted'], stats['spools_updated'] = len(new_spools), len(spool_updates)
+                missing_spool_ids = [row['id'] for row in existing_spools.values()]
+
+                # --- آیتم‌های اسپول ---
+                spool_id_map = {spool_id: pk for pk, spool_id in session.query(Spool.id, Spool.spool_id)}
+                spool_items_df['spool_id_fk'] = spool_items_df['spool_id_str'].map(spool_id_map)
+                spool_items_df = spool_items_df.dropna(subset=['spool_id_fk']).drop(columns=['spool_id_str'])
+                spool_items_df['spool_id_fk'] = spool_items_df['spool_id_fk'].astype(int)
+
+                # فقط اسپول‌هایی که آیتم‌هایشان در فایل تغییر کرده (یا از فایل حذف شده‌اند) مقایسه می‌شوند
+                file_signatures = self._spool_item_signatures(spool_items_df)
+                empty_signature = "0:" + "0" * 16
+                signature_updates = []
+                missing_spool_set = set(missing_spool_ids)
+                for spool_pk in spool_id_map.values():
+                    if spool_pk in missing_spool_set:
+                        continue
+                    signature = file_signatures.get(spool_pk, empty_signature)
+                    if stored_signatures.get(spool_pk) != signature:
+                        signature_updates.append({'id': spool_pk, 'items_signature': signature})
+                # امضای اسپول حذف‌شده از فایل پاک می‌شود تا اگر برگردد دوباره مقایسه شود
+                signature_updates.extend({'id': spool_pk, 'items_signature': None} for spool_pk in missing_spool_ids)
+                changed_spool_ids = sorted(row['id'] for row in signature_updates)
+                spool_items_df = spool_items_df[spool_items_df['spool_id_fk'].isin(changed_spool_ids)]
+
+                def item_key(row):
+                    return (row['spool_id_fk'],) + tuple(
+                        self._merge_value(row.get(c), c in SPOOL_ITEM_NUMERIC_COLS) for c in SPOOL_ITEM_MERGE_KEY_COLUMNS)
+
+                # آیتم‌های فعلی همین اسپول‌ها قفل می‌شوند تا ثبت مصرف همزمان تا پایان merge منتظر بماند
+                existing_items = defaultdict(list)
+                item_columns = [SpoolItem.id, SpoolItem.spool_id_fk] + [
+                    getattr(SpoolItem, c) for c in SPOOL_ITEM_MERGE_KEY_COLUMNS + SPOOL_ITEM_MERGE_VALUE_COLUMNS]
+                locked_ids = []
+                for chunk in _chunks(changed_spool_ids):
+                    for row in session.query(*item_columns).filter(SpoolItem.spool_id_fk.in_(chunk)) \
+                            .order_by(SpoolItem.id).with_for_update():
+                        existing_items[item_key(row._mapping)].append(row._mapping)
+                        locked_ids.append(row.id)
+
+                consumed = {}
+                for chunk in _chunks(locked_ids):
+                    consumed.update(
+                        session.query(SpoolConsumption.spool_item_id, func.sum(SpoolConsumption.used_qty))
+                        .filter(SpoolConsumption.spool_item_id.in_(chunk))
+                        .group_by(SpoolConsumption.spool_item_id).all()
+                    )
+
+                item_value_cols = [c for c in SPOOL_ITEM_MERGE_VALUE_COLUMNS if c in spool_items_df.columns]
+                new_items, item_updates = [], []
+                balance_updates = defaultdict(list)  # ستون موجودی -> [{item_id, file_qty}]
+                for record in spool_items_df.to_dict(orient='records'):
+                    matches = existing_items.get(item_key(record))
+                    if not matches:
+                        new_items.append(record)
+                        continue
+                    current = matches.pop(0)
+                    # موجودی فعلی = مقدار فایل منهای مصرف ثبت‌شده (طول برای پایپ، تعداد برای بقیه)
+                    balance_col = 'length' if 'PIPE' in str(record.get('component_type') or '').upper() else 'qty_available'
+                    file_qty = record.get(balance_col)
+                    has_balance = balance_col in item_value_cols and not pd.isna(file_qty)
+                    if has_balance:
+                        record[balance_col] = max(float(file_qty) - (consumed.get(current['id'], 0) or 0), 0.0)
+                    changes = self._merge_changes(record, current, item_value_cols, SPOOL_ITEM_NUMERIC_COLS)
+                    if has_balance and changes.pop(balance_col, None) is not None:
+                        balance_updates[balance_col].append({'item_id': current['id'], 'file_qty': float(file_qty)})
+                    if changes:
+                        changes['id'] = current['id']
+                        item_updates.append(changes)
+
+                if item_updates:
+                    session.bulk_update_mappings(SpoolItem, item_updates)
+                items_table = SpoolItem.__table__
+                used_qty = select(func.coalesce(func.sum(SpoolConsumption.used_qty), 0.0)).where(
+                    SpoolConsumption.spool_item_id == items_table.c.id).scalar_subquery()
+                balance = bindparam('file_qty', type_=Float) - used_qty
+                for balance_col, params in balance_updates.items():
+                    session.execute(
+                        update(items_table).where(items_table.c.id == bindparam('item_id'))
+                        .values({balance_col: case((balance > 0, balance), else_=0.0)}),
+                        params
+                    )
+                if new_items:
+                    self._bulk_insert_dataframe(session, SpoolItem, pd.DataFrame(new_items))
+                updated_ids = {row['id'] for row in item_updates}
+                updated_ids.update(p['item_id'] for params in balance_updates.values() for p in params)
+                stats['items_inserted'], stats['items_updated'] = len(new_items), len(updated_ids)
+
+                # آیتم‌هایی که در فایل نیستند: بدون مصرف حذف می‌شوند، با مصرف موجودی‌شان صفر می‌شود
+                removed_item_ids = [row['id'] for rows in existing_items.values() for row in rows]
+                retired_item_ids = [item_id for item_id in removed_item_ids if item_id not in consumed]
+                emptied_item_ids = [item_id for item_id in removed_item_ids if item_id in consumed]
+                for chunk in _chunks(retired_item_ids):
+                    session.query(SpoolProgress).filter(SpoolProgress.spool_item_id.in_(chunk)).delete(synchronize_session=False)
+                    session.query(SpoolItem).filter(SpoolItem.id.in_(chunk)).delete(synchronize_session=False)
+                for chunk in _chunks(emptied_item_ids):
+                    stats['items_kept_consumed'] += session.query(SpoolItem).filter(
+                        SpoolItem.id.in_(chunk), (SpoolItem.qty_available != 0) | (SpoolItem.length != 0)
+                    ).update({SpoolItem.qty_available: 0.0, SpoolItem.length: 0.0}, synchronize_session=False)
+                stats['items_retired'] = len(retired_item_ids)
+                if signature_updates:
+                    session.bulk_update_mappings(Spool, signature_updates)
+                session.flush()
+
+                # اسپول‌هایی که در فایل نیستند و دیگر آیتم یا مصرفی ندارند حذف می‌شوند
+                for chunk in _chunks(missing_spool_ids):
+                    in_use = {spool_fk for (spool_fk,) in session.query(SpoolItem.spool_id_fk)
+                              .filter(SpoolItem.spool_id_fk.in_(chunk)).distinct()}
+                    in_use.update(spool_fk for (spool_fk,) in session.query(SpoolConsumption.spool_id)
+                                  .filter(SpoolConsumption.spool_id.in_(chunk)).distinct())
+                    retired_spools = [spool_pk for spool_pk in chunk if spool_pk not in in_use]
+                    if retired_spools:
+                        session.query(SpoolProgress).filter(SpoolProgress.spool_id.in_(retired_spools)).delete(synchronize_session=False)
+                        session.query(Spool).filter(Spool.id.in_(retired_spools)).delete(synchronize_session=False)
+                    stats['spools_retired'] += len(retired_spools)
+
+                details = (f"اسپول: {stats['spools_inserted']} جدید، {stats['spools_updated']} ویرایش، {stats['spools_retired']} حذف | "
+                           f"آیتم: {stats['items_inserted']} جدید، {stats['items_updated']} ویرایش، {stats['items_retired']} حذف"
+                           f"{'، موجودی ' + str(stats['items_kept_consumed']) + ' آیتم حذف‌شده‌ی دارای مصرف صفر شد' if stats['items_kept_consumed'] else ''}")
+                self.log_activity("system", "SPOOL_MERGE_SUCCESS", details, session)
+
+            return True, f"✔ داده‌های Spool با موفقیت همگام شدند. ({details})"
+
+        except (ValueError, KeyError, FileNotFoundError) as e:
+            return False, f"خطا در فایل‌های Spool: {e}"
+        except Exception as e:
+            logging.error(f"خطا در همگام‌سازی Spool: {e}")
+            return False, f"خطای دیتابیس در همگام‌سازی Spool: {e}"
+        finally:
+            session.close()
+
+    def import_miv_records_from_file(self, file_path: str, user: str = "system",
+                                     skip_invalid: bool = False) -> Tuple[bool, str]:
+        """
+        ایمپورت دسته‌ای MIVها از فایل CSV یا Excel.
+        هر ردیف فایل یک قلم مصرفی است و اطلاعات سربرگ MIV (پروژه، خط، تگ، ...) در ردیف‌های آن تکرار می‌شود.
+        اعتبارسنجی (تگ تکراری، پروژه/خط/آیتم ناشناخته، مصرف بیش از MTO) به صورت برداری با pandas انجام می‌شود،
+        درج‌ها گروهی هستند و آمار پیشرفت هر خط درگیر فقط یک بار بازسازی می‌شود.
+        با skip_invalid=False هر خطا کل فایل را رد می‌کند؛ در غیر این صورت فقط MIVهای نامعتبر کنار گذاشته می‌شوند.
+        """
+        REQUIRED_DB_COLS = {'project_name', 'line_no', 'miv_tag', 'used_qty'}
+        MIV_IMPORT_COLUMN_MAP = {
+            'PROJECT': 'project_name', 'PROJECTNAME': 'project_name', 'LINENO': 'line_no', 'MIVTAG': 'miv_tag',
+            'LOCATION': 'location', 'STATUS': 'status', 'COMMENT': 'comment', 'REGISTEREDFOR': 'registered_for',
+            'REGISTEREDBY': 'registered_by', 'DATE': 'last_updated', 'ITEMCODE': 'item_code',
+            'DESCRIPTION': 'description', 'USEDQTY': 'used_qty'
+        }
+        file_name = os.path.basename(file_path)
+
+        try:
+            if file_path.lower().endswith(('.xlsx', '.xls')):
+                df_raw = pd.read_excel(file_path, dtype=str).fillna('')
+            else:
+                df_raw = pd.read_csv(file_path, dtype=str).fillna('')
+            df = self._normalize_and_rename_df(df_raw, MIV_IMPORT_COLUMN_MAP, REQUIRED_DB_COLS, file_name)
+        except (ValueError, KeyError, FileNotFoundError) as e:
+            return False, f"خطا در فایل MIV '{file_name}': {e}"
+
+        if df.empty:
+            return False, f"فایل '{file_name}' هیچ ردیفی ندارد."
+
+        # --- نرمال‌سازی ستون‌ها ---
+        for col in ['location', 'status', 'comment', 'registered_for', 'registered_by', 'last_updated',
+                    'item_code', 'description']:
+            if col not in df.columns:
+                df[col] = ''
+            df[col] = df[col].astype(str).str.strip()
+        df['project_name'] = df['project_name'].astype(str).str.strip()
+        for col in ['line_no', 'item_code']:
+            df[col] = df[col].astype(str).str.strip().str.upper()
+        # تگ با همان نگارش فایل ذخیره می‌شود؛ مقایسه‌ها با کلید (پروژه، تگ با حروف بزرگ) انجام می‌شود
+        df['miv_tag'] = df['miv_tag'].astype(str).str.strip()
+        df['tag_key'] = df['miv_tag'].str.upper()
+        df['miv_key'] = df['project_name'] + '\x1f' + df['tag_key']
+        df['description_key'] = df['description'].str.upper()
+        df['registered_by'] = df['registered_by'].where(df['registered_by'] != '', user)
+        df['used_qty'] = pd.to_numeric(df['used_qty'], errors='coerce')
+        df['last_updated'] = pd.to_datetime(df['last_updated'], errors='coerce')
+        df['row_no'] = df.index + 2  # شماره ردیف در فایل (با احتساب هدر)
+        df['error'] = ''
+
+        def flag(mask, message):
+            df.loc[mask & (df['error'] == ''), 'error'] = message
+
+        flag((df['project_name'] == '') | (df['line_no'] == '') | (df['miv_tag'] == ''),
+             "پروژه، Line No یا MIV Tag خالی است")
+        flag(df['used_qty'].isna() | (df['used_qty'] <= 0), "مقدار مصرف نامعتبر است")
+        flag((df['item_code'] == '') & (df['description_key'] == ''), "Item Code یا Description لازم است")
+
+        header_conflicts = df.groupby('miv_key')['line_no'].nunique()
+        flag(df['miv_key'].isin(header_conflicts[header_conflicts > 1].index),
+             "یک MIV Tag در یک پروژه با چند خط مختلف آمده است")
+
+        session = self.get_session()
+        try:
+            # --- اعتبارسنجی در برابر دیتابیس ---
+            project_names = df['project_name'].unique().tolist()
+            project_map = dict(session.query(Project.name, Project.id).filter(Project.name.in_(project_names)).all())
+            df['project_id'] = df['project_name'].map(project_map)
+            flag(df['project_id'].isna(), "پروژه ناشناخته است")
+
+            # تکراری بودن تگ مثل is_duplicate_miv_tag در هر پروژه جداگانه و بدون حساسیت به حروف بررسی می‌شود
+            existing_tags = set()
+            known_pids = df['project_id'].dropna().astype(int).unique().tolist()
+            for tags_chunk in _chunks(df['tag_key'].unique().tolist()):
+                existing_tags.update(session.query(MIVRecord.project_id, func.upper(MIVRecord.miv_tag)).filter(
+                    MIVRecord.project_id.in_(known_pids), func.upper(MIVRecord.miv_tag).in_(tags_chunk)).all())
+            df['tag_exists'] = [(pid, key) in existing_tags for pid, key in zip(df['project_id'], df['tag_key'])]
+            flag(df['tag_exists'], "MIV Tag از قبل در این پروژه ثبت شده است")
+
+            # ستون miv_tag در دیتابیس (با همین نگارش) یکتاست؛ همان تگ در پروژه‌ی دیگر قابل درج نیست
+            tag_owner = {}
+            for tags_chunk in _chunks(df['miv_tag'].unique().tolist()):
+                tag_owner.update(session.query(MIVRecord.miv_tag, MIVRecord.project_id).filter(
+                    MIVRecord.miv_tag.in_(tags_chunk)).all())
+            taken_elsewhere = [tag in tag_owner and tag_owner[tag] != pid for tag, pid in zip(df['miv_tag'], df['project_id'])]
+            in_many_projects = df.groupby('miv_tag')['project_name'].transform('nunique') > 1
+            flag(pd.Series(taken_elsewhere, index=df.index) | in_many_projects,
+                 "همین MIV Tag در پروژه‌ی دیگری ثبت شده است")
+
+            known = df[df['project_id'].notna()]
+            mto_query = session.query(
+                MTOItem.id.label('mto_item_id'), MTOItem.project_id, MTOItem.line_no.label('db_line_no'),
+                MTOItem.item_code, MTOItem.description, MTOItem.item_type, MTOItem.length_m, MTOItem.quantity,
+                MTOItem.inch_dia
+            ).filter(
+                MTOItem.project_id.in_(known['project_id'].astype(int).unique().tolist()),
+                func.upper(MTOItem.line_no).in_(known['line_no'].unique().tolist()),
+                MTOItem.is_active == True
+            )
+            mto_df = pd.read_sql(mto_query.statement, session.bind)
+            mto_df['line_no'] = mto_df['db_line_no'].fillna('').str.strip().str.upper()
+            mto_df['item_code'] = mto_df['item_code'].fillna('').str.strip().str.upper()
+            mto_df['description_key'] = mto_df['description'].fillna('').str.strip().str.upper()
+            mto_df = mto_df.sort_values('mto_item_id')
+
+            line_keys = set(zip(mto_df['project_id'], mto_df['line_no']))
+            df['line_known'] = [(pid, line) in line_keys for pid, line in zip(df['project_id'], df['line_no'])]
+            flag(~df['line_known'], "شماره خط در MTO پروژه وجود ندارد")
+
+            # تطبیق آیتم: با Item Code اگر داده شده، در غیر این صورت با Description
+            by_code = mto_df[mto_df['item_code'] != ''].drop_duplicates(['project_id', 'line_no', 'item_code'])
+            by_desc = mto_df.drop_duplicates(['project_id', 'line_no', 'description_key'])
+            item_cols = ['mto_item_id', 'db_line_no', 'item_type', 'length_m', 'quantity', 'inch_dia']
+            df = df.merge(by_code[['project_id', 'line_no', 'item_code'] + item_cols],
+                          on=['project_id', 'line_no', 'item_code'], how='left')
+            desc_match = df.merge(by_desc[['project_id', 'line_no', 'description_key'] + item_cols],
+                                  on=['project_id', 'line_no', 'description_key'], how='left', suffixes=('', '_d'))
+            use_desc = (df['item_code'] == '').to_numpy()
+            for col in item_cols:
+                df[col] = df[col].where(~use_desc, desc_match[f"{col}_d"].to_numpy())
+            flag(df['mto_item_id'].isna(), "آیتم در MTO خط یافت نشد")
+
+            # بررسی مصرف بیش از مقدار MTO (مصرف قبلی + مصرف فایل)
+            matched = df[df['error'] == '']
+            item_ids = matched['mto_item_id'].astype(int).unique().tolist()
+            already_used = {}
+            for ids_chunk in _chunks(item_ids):
+                already_used.update(session.query(
+                    MTOConsumption.mto_item_id, func.sum(MTOConsumption.used_qty)
+                ).filter(MTOConsumption.mto_item_id.in_(ids_chunk)).group_by(MTOConsumption.mto_item_id).all())
+
+            is_pipe = df['item_type'].fillna('').str.lower().str.contains('pipe')
+            df['base_qty'] = pd.to_numeric(df['length_m'].where(is_pipe, df['quantity']), errors='coerce')
+            file_used = matched.groupby('mto_item_id')['used_qty'].sum()
+            total_used = file_used.add(pd.Series(already_used, dtype=float), fill_value=0)
+            df['total_used'] = df['mto_item_id'].map(total_used)
+            flag(df['base_qty'].notna() & (df['total_used'] > df['base_qty'] + 0.001), "مصرف بیش از مقدار MTO است")
+
+            # --- تصمیم‌گیری درباره MIVهای نامعتبر ---
+            errors = df[df['error'] != '']
+            bad_tags = set(errors['miv_key'])
+            if not errors.empty and not skip_invalid:
+                details = "\n".join(f"ردیف {r.row_no} ({r.miv_tag}): {r.error}" for r in errors.head(20).itertuples())
+                more = f"\n... و {len(errors) - 20} خطای دیگر" if len(errors) > 20 else ""
+                return False, f"فایل '{file_name}' {len(errors)} ردیف نامعتبر دارد و ایمپورت نشد:\n{details}{more}"
+
+            valid = df[~df['miv_key'].isin(bad_tags)].copy()
+            if valid.empty:
+                return False, f"هیچ MIV معتبری در فایل '{file_name}' یافت نشد."
+
+            # --- درج گروهی ---
+            now = datetime.now()
+            valid['mto_item_id'] = valid['mto_item_id'].astype(int)
+            valid['project_id'] = valid['project_id'].astype(int)
+            identifier = valid['item_code'].where(valid['item_code'] != '', valid['description'])
+            valid['comment_part'] = valid['used_qty'].round(2).astype(str) + " x " + identifier
+            auto_comments = valid.groupby('miv_key')['comment_part'].agg(" | ".join)
+
+            headers = valid.drop_duplicates('miv_key')
+            miv_records = [
+                {
+                    'project_id': r.project_id,
+                    'line_no': r.db_line_no,
+                    'miv_tag': r.miv_tag,
+                    'location': r.location,
+                    'status': r.status,
+                    'comment': r.comment or auto_comments[r.miv_key],
+                    'registered_for': r.registered_for,
+                    'registered_by': r.registered_by,
+                    'last_updated': r.last_updated.to_pydatetime() if pd.notna(r.last_updated) else now,
+                    'is_complete': False
+                } for r in headers.itertuples()
+            ]
+            session.bulk_insert_mappings(MIVRecord, miv_records)
+            session.flush()
+
+            tag_to_id = {}
+            header_pids = headers['project_id'].unique().tolist()
+            for tags_chunk in _chunks(headers['tag_key'].unique().tolist()):
+                for pid, key, rec_id in session.query(
+                        MIVRecord.project_id, func.upper(MIVRecord.miv_tag), MIVRecord.id
+                ).filter(MIVRecord.project_id.in_(header_pids), func.upper(MIVRecord.miv_tag).in_(tags_chunk)).all():
+                    tag_to_id[(pid, key)] = rec_id
+            valid['miv_record_id'] = [tag_to_id.get((pid, key)) for pid, key in zip(valid['project_id'], valid['tag_key'])]
+            valid['timestamp'] = valid['last_updated'].fillna(pd.Timestamp(now))
+
+            consumption_records = valid[['mto_item_id', 'miv_record_id', 'used_qty', 'timestamp']].to_dict(orient='records')
+            session.bulk_insert_mappings(MTOConsumption, consumption_records)
+
+            # --- تجمیع روزانه: مصرف هر (پروژه، خط، روز) همین فایل به‌صورت افزایشی اضافه می‌شود ---
+            inch_dia = pd.to_numeric(valid['inch_dia'], errors='coerce').fillna(0)
+            valid['inch_dia_used'] = (valid['used_qty'] * inch_dia / valid['base_qty']).where(valid['base_qty'] > 0, 0.0)
+            valid['day'] = valid['timestamp'].dt.date
+            daily = valid.groupby(['project_id', 'db_line_no', 'day']).agg(
+                mto_qty=('used_qty', 'sum'), inch_dia=('inch_dia_used', 'sum'), miv_count=('miv_record_id', 'nunique'))
+            for (project_id, line_no, day), row in daily.iterrows():
+                self._add_consumption_rollup_delta(session, int(project_id), line_no, day, float(row.mto_qty), 0.0,
+                                                   float(row.inch_dia), int(row.miv_count))
+
+            # --- محاسبه آمار پیشرفت فقط یک بار برای هر خط درگیر ---
+            affected_lines = headers[['project_id', 'db_line_no']].drop_duplicates()
+            for project_id, line_no in affected_lines.itertuples(index=False):
+                self._rebuild_mto_progress_for_line(session, int(project_id), line_no)
+
+            self.log_activity(user, "BULK_IMPORT_MIV",
+                              f"{len(miv_records)} MIV و {len(consumption_records)} قلم مصرفی از '{file_name}' ایمپورت شد.",
+                              session)
+            session.commit()
+
+            message = f"✔ {len(miv_records)} MIV با {len(consumption_records)} قلم مصرفی از '{file_name}' ثبت شد."
+            if bad_tags:
+                message += f" ({len(bad_tags)} MIV نامعتبر کنار گذاشته شد.)"
+            return True, message
+
+        except Exception as e:
+            session.rollback()
+            import traceback
+            logging.error(f"خطا در ایمپورت گروهی MIV از {file_name}: {e}\n{traceback.format_exc()}")
+            return False, f"خطای غیرمنتظره در ایمپورت MIV از '{file_name}': {e}"
+        finally:
+            session.close()
+
     def _validate_and_normalize_df(self, df: pd.DataFrame, required_columns: set, file_name: str) -> pd.DataFrame:
         """
         ستون‌های DataFrame را به حروف بزرگ تبدیل کرده و وجود ستون‌های ضروری را بررسی می‌کند.
@@ -2065,7 +4531,8 @@ class DataManager:
 
         return df
 
-    def _normalize_and_rename_df(self, df: pd.DataFrame, column_map: dict, required_db_cols: set,
+    @staticmethod
+    def _normalize_and_rename_df(df: pd.DataFrame, column_map: dict, required_db_cols: set,
                                  file_name: str) -> pd.DataFrame:
         """
         --- CHANGE: اضافه کردن .copy() در انتها برای جلوگیری از هشدار ---
@@ -2074,31 +4541,38 @@ class DataManager:
         3. وجود ستون‌های ضروری را پس از تغییر نام، بررسی می‌کند.
         """
 
+        rename_map = DataManager._resolve_column_map(df.columns, column_map, required_db_cols, file_name)
+        found_db_cols = set(rename_map.values())
+
+        df.rename(columns=rename_map, inplace=True)
+
+        final_cols = [col for col in df.columns if col in found_db_cols]
+
+        # --- CHANGE: با افزودن .copy()، یک DataFrame جدید و مستقل ساخته می‌شود ---
+        return df[final_cols].copy()
+
+    @staticmethod
+    def _resolve_column_map(columns, column_map: dict, required_db_cols: set, file_name: str) -> dict:
+        """
+        نام ستون‌های فایل را نرمال‌سازی کرده (حذف علائم، تبدیل به حروف بزرگ) و نگاشت
+        {نام اصلی: نام ستون دیتابیس} را برمی‌گرداند. در صورت نبود ستون‌های ضروری ValueError می‌دهد.
+        """
+
         def normalize_header(name: str) -> str:
             """یک نام ستون را گرفته و آن را پاکسازی می‌کند."""
             return re.sub(r'[^A-Z0-9]', '', str(name).upper())
 
         rename_map = {}
-        found_db_cols = set()
-
-        for original_col in df.columns:
+        for original_col in columns:
             normalized_col = normalize_header(original_col)
             if normalized_col in column_map:
-                db_col = column_map[normalized_col]
-                rename_map[original_col] = db_col
-                found_db_cols.add(db_col)
+                rename_map[original_col] = column_map[normalized_col]
 
-        missing_cols = required_db_cols - found_db_cols
+        missing_cols = required_db_cols - set(rename_map.values())
         if missing_cols:
             missing_str = ", ".join(sorted(list(missing_cols)))
             raise ValueError(f"فایل '{file_name}' ستون‌های ضروری زیر را ندارد: {missing_str}")
-
-        df.rename(columns=rename_map, inplace=True)
-
-        final_cols = [col for col in df.columns if col in found_db_cols]
-
-        # --- CHANGE: با افزودن .copy()، یک DataFrame جدید و مستقل ساخته می‌شود ---
-        return df[final_cols].copy()
+        return rename_map
 
     # --------------------------------------------------------------------
     # متدهای لازم برای جستجوی ایزو ها
@@ -2115,49 +4589,34 @@ class DataManager:
         m = re.search(r'(\d{6})', norm)
         return norm[:m.end(1)] if m else norm
 
+    def warm_iso_name_index(self):
+        """بارگذاری ایندکس نام فایل‌های ISO در یک thread پس‌زمینه تا اولین جستجو منتظر نماند."""
+        def load():
+            session = self.get_session()
+            try:
+                self.iso_name_index.warm(session)
+            except Exception as e:
+                logging.error(f"خطا در بارگذاری ایندکس نام فایل‌های ISO: {e}")
+            finally:
+                session.close()
+
+        threading.Thread(target=load, name="IsoNameIndexLoader", daemon=True).start()
+
     def find_iso_files(self, line_text: str, limit: int = 200) -> list[str]:
         """
-        (نسخه هوشمند با مقایسه شباهت)
-        ابتدا با یک کوئری سریع کاندیداها را پیدا کرده، سپس آن‌ها را بر اساس بیشترین شباهت
-        به ورودی کاربر مرتب می‌کند تا بهترین نتایج در ابتدا نمایش داده شوند.
+        فایل‌های ISO مرتبط با شماره خط، به ترتیب بیشترین شباهت.
+        جستجو روی ایندکس درون‌حافظه‌ای IsoNameIndex انجام می‌شود و به غلط تایپی، جداکننده‌ها و
+        پسوندهای اضافه (شیت/ریویژن) حساس نیست.
         """
-        from models import IsoFileIndex
         session = self.get_session()
         try:
             norm_input = self._normalize_line_key(line_text)
             if not norm_input:
                 return []
-
-            # مرحله ۱: واکشی کاندیداها از دیتابیس با یک کوئری منعطف‌تر
-            # ما به جای prefix، از خود norm_input برای جستجوی انعطاف‌پذیرتر استفاده می‌کنیم.
-            # این کار نتایج مرتبط بیشتری را در مرحله اول برمی‌گرداند.
-            search_term = f"%{norm_input}%"
-            candidate_records = session.query(
-                IsoFileIndex.file_path,
-                IsoFileIndex.normalized_name
-            ).filter(
-                IsoFileIndex.normalized_name.like(search_term)
-            ).limit(limit * 2).all()  # کمی بیشتر از حد مجاز می‌خوانیم تا فضای کافی برای مرتب‌سازی داشته باشیم
-
-            if not candidate_records:
-                return []
-
-            # مرحله ۲: محاسبه شباهت و مرتب‌سازی در پایتون
-            scored_results = []
-            for file_path, normalized_name in candidate_records:
-                # SequenceMatcher شباهت بین دو رشته را محاسبه می‌کند
-                ratio = difflib.SequenceMatcher(None, norm_input, normalized_name).ratio()
-                # اگر ورودی کاربر در نام فایل وجود داشته باشد، یک امتیاز اضافه می‌دهیم
-                if norm_input in normalized_name:
-                    ratio += 0.1
-
-                scored_results.append((ratio, file_path))
-
-            # مرتب‌سازی نتایج بر اساس امتیاز شباهت (از بیشترین به کمترین)
-            scored_results.sort(key=lambda x: x[0], reverse=True)
-
-            # برگرداندن مسیر فایل‌ها به تعداد limit
-            return [file_path for ratio, file_path in scored_results[:limit]]
+            results = self.iso_name_index.search(
+                session, norm_input, self._extract_prefix_key(line_text), limit
+            )
+            return [file_path for file_path, score in results]
 
         except Exception as e:
             logging.error(f"خطا در جستجوی هوشمند فایل ISO: {e}")
@@ -2195,6 +4654,7 @@ class DataManager:
                 )
                 session.add(record)
             session.commit()
+            self.iso_name_index.add(file_path, normalized_name, prefix_key)
         except Exception as e:
             session.rollback()
             logging.error(f"خطا در upsert_iso_index_entry برای فایل {file_path}: {e}")
@@ -2207,16 +4667,34 @@ class DataManager:
         try:
             session.query(IsoFileIndex).filter(IsoFileIndex.file_path == file_path).delete()
             session.commit()
+            self.iso_name_index.discard(file_path)
         except Exception as e:
             session.rollback()
             logging.error(f"خطا در remove_iso_index_entry برای فایل {file_path}: {e}")
         finally:
             session.close()
 
-    def rebuild_iso_index_from_scratch(self, base_dir: str, event_handler=None):
+    def rebuild_iso_index_from_scratch(self, base_dir: str, event_handler=None, force_full: bool = False):
         """
-        نسخه اصلاح‌شده: بازسازی ایندکس ایزو با batch insert/update/delete
+        همگام‌سازی ایندکس ایزو با یک پیمایش موازی (IsoDirectoryCrawler).
+        دسته‌های فایل همزمان با ادامه‌ی پیمایش در دیتابیس درج/به‌روزرسانی می‌شوند و پیشرفت
+        بر اساس پوشه‌های تمام‌شده گزارش می‌شود؛ در پایان رکوردهای فایل‌های حذف‌شده پاک می‌شوند.
+
+        به صورت پیش‌فرض اسکن افزایشی است: پوشه‌هایی که امضای (mtime) آن‌ها در iso_directory_signatures
+        تغییر نکرده لیست نمی‌شوند. با force_full=True همه‌ی پوشه‌ها و فایل‌ها دوباره خوانده می‌شوند
+        (برای فایل‌هایی که درجا بازنویسی شده‌اند و mtime پوشه را عوض نمی‌کنند).
         """
+        if not self._iso_rebuild_lock.acquire(blocking=False):
+            logging.warning("ISO index rebuild skipped: another scan is already running.")
+            if event_handler and hasattr(event_handler, 'status_updated'):
+                event_handler.status_updated.emit("Another ISO scan is already running.", "warning")
+            return
+        try:
+            self._rebuild_iso_index(base_dir, event_handler, force_full)
+        finally:
+            self._iso_rebuild_lock.release()
+
+    def _rebuild_iso_index(self, base_dir: str, event_handler, force_full: bool):
         session = self.get_session()
 
         def emit_status(message, level):
@@ -2237,46 +4715,46 @@ class DataManager:
             db_records = session.query(IsoFileIndex.id, IsoFileIndex.file_path, IsoFileIndex.last_modified).all()
             db_files_map = {path: (rec_id, last_mod) for rec_id, path, last_mod in db_records}
 
-            paths_to_add = []
-            paths_to_update = []
-
-            # --- قدم 2: شمارش فایل‌ها ---
-            emit_status("Counting total files for progress calculation...", "info")
-            total_files = 0
-            for _, _, files in os.walk(base_dir):
-                total_files += len([f for f in files if f.lower().endswith(('.pdf', '.dwg'))])
-
-            if total_files == 0:
-                emit_status("No files found. Index will be cleared.", "warning")
-                if db_files_map:
-                    session.query(IsoFileIndex).delete()
-                    session.commit()
-                emit_progress(100, "Completed")
-                return
-
-            # --- قدم 3: اسکن دیسک ---
-            emit_status(f"Scanning {total_files} files on disk...", "info")
-            processed_files = 0
-
-            for root, _, files in os.walk(base_dir):
-                for filename in files:
-                    if not filename.lower().endswith(('.pdf', '.dwg')):
-                        continue
-
-                    file_path = os.path.join(root, filename)
-                    try:
-                        disk_last_modified = datetime.fromtimestamp(os.path.getmtime(file_path))
-                    except (FileNotFoundError, OSError):
-                        continue
-
-                    if file_path in db_files_map:
-                        rec_id, db_last_modified = db_files_map[file_path]
+            # امضای پوشه‌ها از اسکن قبلی؛ در اسکن کامل نادیده گرفته می‌شوند ولی در پایان بازنویسی می‌شوند
+            signature_rows = session.query(
+                IsoDirectorySignature.dir_path, IsoDirectorySignature.parent_path,
+                IsoDirectorySignature.mtime, IsoDirectorySignature.entry_count
+            ).all()
+            stored_dirs = {row.dir_path for row in signature_rows}
+            signatures = {}
+            children = defaultdict(list)
+            if not force_full:
+                for dir_path, parent_path, mtime, entry_count in signature_rows:
+                    signatures[dir_path] = (mtime, entry_count)
+                    if parent_path is not None:
+                        children[parent_path].append(dir_path)
+
+            # --- قدم 2: پیمایش دیسک و اعمال جریانی تغییرات ---
+            scan_kind = "full" if force_full or not signatures else "incremental"
+            emit_status(f"Scanning files on disk ({scan_kind})...", "info")
+            crawler = IsoDirectoryCrawler(base_dir, max_workers=ISO_CRAWL_WORKERS, batch_size=ISO_CRAWL_BATCH_SIZE,
+                                          signatures=signatures, children=children)
+            reported = {'progress': -1}
+
+            def on_crawl_progress(c):
+                # تعداد پوشه‌های کشف‌شده در حین پیمایش زیاد می‌شود؛ نوار پیشرفت عقب نمی‌رود
+                progress = min(int(c.progress * 95), 95)
+                if progress > reported['progress']:
+                    reported['progress'] = progress
+                    emit_progress(progress, f"Scanning... ({c.dirs_completed}/{c.dirs_discovered} folders)")
+
+            added_count = 0
+            updated_count = 0
+            for files in crawler.crawl(on_crawl_progress):
+                paths_to_add = []
+                paths_to_update = []
+                for file_path, filename, mtime in files:
+                    disk_last_modified = datetime.fromtimestamp(mtime)
+                    existing = db_files_map.pop(file_path, None)
+                    if existing is not None:
+                        rec_id, db_last_modified = existing
                         if disk_last_modified != db_last_modified:
-                            paths_to_update.append({
-                                "id": rec_id,  # 👈 کلید اصلی برای update
-                                "last_modified": disk_last_modified
-                            })
-                        del db_files_map[file_path]
+                            paths_to_update.append({"id": rec_id, "last_modified": disk_last_modified})
                     else:
                         paths_to_add.append({
                             "file_path": file_path,
@@ -2285,46 +4763,69 @@ class DataManager:
                             "last_modified": disk_last_modified
                         })
 
-                    processed_files += 1
-                    if processed_files % 100 == 0:
-                        progress = int((processed_files / total_files) * 100)
-                        emit_progress(progress, "Scanning...")
+                if paths_to_add:
+                    session.bulk_insert_mappings(IsoFileIndex, paths_to_add)
+                if paths_to_update:
+                    session.bulk_update_mappings(IsoFileIndex, paths_to_update)
+                if paths_to_add or paths_to_update:
+                    session.commit()
+                added_count += len(paths_to_add)
+                updated_count += len(paths_to_update)
 
-            # --- قدم 4: حذف فایل‌های پاک‌شده ---
-            paths_to_delete = list(db_files_map.keys())
+            if base_dir in crawler.failed_dirs:
+                # خود پوشه‌ی اصلی خوانده نشد (مثلاً share در دسترس نیست)؛ ایندکس نباید پاک شود
+                emit_status(f"ISO folder could not be read: {base_dir}. Index left unchanged.", "error")
+                return
+            if crawler.failed_dirs:
+                emit_status(f"{len(crawler.failed_dirs)} folders could not be read; their entries are kept.", "warning")
 
-            # --- قدم 5: اعمال تغییرات ---
-            emit_status("Applying changes to the database...", "info")
-            emit_progress(95, "Saving...")
+            # --- قدم 3: حذف فایل‌های پاک‌شده ---
+            # رکورد فایل‌های پوشه‌های بدون تغییر و پوشه‌های خوانده‌نشده (وضعیت نامعلوم) حذف نمی‌شود
+            paths_to_delete = [path for path in db_files_map if not crawler.is_retained(path)]
+            if crawler.files_found == 0 and not crawler.failed_dirs and not crawler.skipped_dirs:
+                emit_status("No files found. Index will be cleared.", "warning")
 
+            emit_progress(96, "Saving...")
             batch_size = 500
-            # حذف گروهی
-            if paths_to_delete:
-                for i in range(0, len(paths_to_delete), batch_size):
-                    session.query(IsoFileIndex).filter(
-                        IsoFileIndex.file_path.in_(paths_to_delete[i:i + batch_size])
-                    ).delete(synchronize_session=False)
-                    session.commit()
-
-            # افزودن گروهی
-            if paths_to_add:
-                for i in range(0, len(paths_to_add), batch_size):
-                    session.bulk_insert_mappings(IsoFileIndex, paths_to_add[i:i + batch_size])
-                    session.commit()
+            for i in range(0, len(paths_to_delete), batch_size):
+                session.query(IsoFileIndex).filter(
+                    IsoFileIndex.file_path.in_(paths_to_delete[i:i + batch_size])
+                ).delete(synchronize_session=False)
+                session.commit()
 
-            # آپدیت گروهی
-            if paths_to_update:
-                for i in range(0, len(paths_to_update), batch_size):
-                    session.bulk_update_mappings(IsoFileIndex, paths_to_update[i:i + batch_size])
-                    session.commit()
+            # --- قدم 4: ذخیره‌ی امضای پوشه‌ها (بعد از commit فایل‌ها تا اسکن نیمه‌کاره امضای جدید ثبت نکند) ---
+            visited_dirs = crawler.visited_dirs
+            stale_dirs = [
+                dir_path for dir_path in stored_dirs
+                if dir_path not in visited_dirs and dir_path not in crawler.failed_dirs
+                and not crawler.is_under_failed_dir(dir_path)
+            ]
+            for i in range(0, len(stale_dirs), batch_size):
+                session.query(IsoDirectorySignature).filter(
+                    IsoDirectorySignature.dir_path.in_(stale_dirs[i:i + batch_size])
+                ).delete(synchronize_session=False)
+            scanned_at = datetime.now()
+            self._upsert_rows(session, IsoDirectorySignature, [
+                {"dir_path": dir_path, "parent_path": parent_path, "mtime": mtime,
+                 "entry_count": entry_count, "scanned_at": scanned_at}
+                for dir_path, (parent_path, mtime, entry_count) in crawler.scanned_dirs.items()
+            ], ['dir_path'])
+            session.commit()
 
-            emit_status("Index synchronized successfully.", "success")
+            emit_status(
+                f"Index synchronized successfully ({crawler.files_found} files in {len(crawler.scanned_dirs)} folders "
+                f"scanned, {len(crawler.skipped_dirs)} unchanged folders ({crawler.skipped_entries} entries) skipped; "
+                f"{added_count} added, {updated_count} updated, {len(paths_to_delete)} removed).",
+                "success"
+            )
             emit_progress(100, "Completed!")
 
         except Exception as e:
             emit_status(f"A critical error occurred during indexing: {e}", "error")
             session.rollback()
         finally:
+            # بخشی از دسته‌ها ممکن است commit شده باشند؛ ایندکس نام‌ها در جستجوی بعدی کامل بارگذاری می‌شود
+            self.iso_name_index.invalidate()
             session.close()
 
     def upsert_iso_index_entry(self, file_path: str):
@@ -2358,6 +4859,7 @@ class DataManager:
                 )
                 session.add(record)
             session.commit()
+            self.iso_name_index.add(file_path, normalized_name, prefix_key)
         except Exception as e:
             session.rollback()
             logging.error(f"خطا در upsert_iso_index_entry برای فایل {file_path}: {e}")
@@ -2372,12 +4874,53 @@ class DataManager:
         try:
             session.query(IsoFileIndex).filter_by(file_path=file_path).delete()
             session.commit()
+            self.iso_name_index.discard(file_path)
         except Exception as e:
             session.rollback()
             logging.error(f"خطا در remove_iso_index_entry برای فایل {file_path}: {e}")
         finally:
             session.close()
 
+    def apply_iso_index_changes(self, file_mtimes: Dict[str, float], removed_paths: List[str]) -> Tuple[bool, str]:
+        """
+        اعمال گروهی تغییرات watcher روی iso_file_index در یک تراکنش:
+        فایل‌های موجود (مسیر -> st_mtime) با INSERT ... ON CONFLICT (file_path) DO UPDATE
+        و فایل‌های حذف‌شده با DELETE ... WHERE file_path IN (...).
+        """
+        if not file_mtimes and not removed_paths:
+            return True, "No changes."
+
+        rows = []
+        for file_path, mtime in file_mtimes.items():
+            filename = os.path.basename(file_path)
+            rows.append({
+                "file_path": file_path,
+                "normalized_name": self._normalize_line_key(filename),
+                "prefix_key": self._extract_prefix_key(filename),
+                "last_modified": datetime.fromtimestamp(mtime)
+            })
+
+        session = self.get_session()
+        try:
+            self._upsert_rows(session, IsoFileIndex, rows, ['file_path'])
+            for chunk in _chunks(removed_paths, 500):
+                session.query(IsoFileIndex).filter(
+                    IsoFileIndex.file_path.in_(chunk)
+                ).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logging.error(f"خطا در apply_iso_index_changes ({len(rows)} upserts, {len(removed_paths)} deletes): {e}")
+            return False, str(e)
+        finally:
+            session.close()
+
+        for row in rows:
+            self.iso_name_index.add(row["file_path"], row["normalized_name"], row["prefix_key"])
+        for file_path in removed_paths:
+            self.iso_name_index.discard(file_path)
+        return True, f"{len(rows)} files indexed, {len(removed_paths)} removed."
+
  # --------------------------------------------------------------------
     # --- : متدهای اصلی برای خروجی گرفتن (اکسل و PDF) ---
     # --------------------------------------------------------------------
@@ -2549,217 +5092,244 @@ class DataManager:
     # متدهای جدید برای جستجوی سراسری MIV (بدون نیاز به پروژه فعال)
     # --------------------------------------------------------------------
 
-    def search_miv_by_tag(self, tag_query: str) -> List[Dict[str, Any]]:
-        """جستجوی MIV بر اساس تگ (PARTIAL MATCH)"""
+    def search_miv(self, tag=None, registered_for=None, registered_by=None, start_date=None, end_date=None,
+                   is_complete=None, project_id=None, line_no=None, limit: int = MIV_SEARCH_PAGE_SIZE,
+                   cursor: str = None, with_total: bool = None) -> Dict[str, Any]:
+        """
+        جستجوی ترکیبی MIV با صفحه‌بندی keyset روی (last_updated, id) به ترتیب نزولی.
+        همه فیلترها اختیاری‌اند و با AND ترکیب می‌شوند؛ فیلترهای متنی زیررشته (بدون حساسیت به حروف) هستند.
+        end_date اگر فقط تاریخ باشد، کل همان روز را شامل می‌شود.
+        خروجی: {"items": [...], "next_cursor": str | None, "total_estimate": int | None, "total_is_exact": bool}
+        برای صفحه بعد next_cursor به همین متد با همان فیلترها داده می‌شود؛
+        total به‌طور پیش‌فرض فقط برای صفحه اول محاسبه می‌شود.
+        """
+        limit = max(1, min(int(limit or MIV_SEARCH_PAGE_SIZE), MIV_SEARCH_MAX_PAGE_SIZE))
+        if with_total is None:
+            with_total = cursor is None
+        start_date = self._as_datetime(start_date)
+        end_date = self._as_datetime(end_date, end_of_day=True)
+        after = None
+        if cursor:
+            stamp, record_id = self._decode_cursor(cursor, 2)
+            try:
+                after = [datetime.fromisoformat(stamp) if stamp else None, int(record_id)]
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid cursor: {cursor!r}")
+
         session = self.get_session()
         try:
-            results = session.query(
-                MIVRecord.id,
-                MIVRecord.miv_tag,
-                MIVRecord.line_no,
-                MIVRecord.location,
-                MIVRecord.status,
-                MIVRecord.registered_for,
-                MIVRecord.registered_by,
-                MIVRecord.last_updated,
-                MIVRecord.is_complete,
-                MIVRecord.project_id,
-                Project.name.label('project_name')
-            ).join(Project, MIVRecord.project_id == Project.id).filter(
-                MIVRecord.miv_tag.ilike(f"%{tag_query}%")
-            ).order_by(desc(MIVRecord.last_updated)).all()
+            query, conditions = self._miv_search_query(
+                session, tag, registered_for, registered_by, start_date, end_date, is_complete, project_id, line_no
+            )
+            page_query = query
+            if after is not None:
+                page_query = page_query.where(
+                    self._keyset_condition(MIV_SEARCH_ORDER, after, self._nulls_sort_largest(session))
+                )
+            page_query = page_query.limit(limit + 1)
 
-            return [
-                {
-                    "id": r.id,
-                    "miv_tag": r.miv_tag,
-                    "line_no": r.line_no,
-                    "location": r.location,
-                    "status": r.status,
-                    "registered_for": r.registered_for,
-                    "registered_by": r.registered_by,
-                    "last_updated": r.last_updated,
-                    "is_complete": r.is_complete,
-                    "project_id": r.project_id,
-                    "project_name": r.project_name
-                } for r in results
-            ]
-        except Exception as e:
-            logging.error(f"Error in search_miv_by_tag: {e}")
-            return []
-        finally:
-            session.close()
+            rows = session.execute(page_query).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
 
-    def search_miv_by_registered_for(self, name_query: str) -> List[Dict[str, Any]]:
-        """جستجوی MIV بر اساس Registered For"""
-        session = self.get_session()
-        try:
-            results = session.query(
-                MIVRecord.id,
-                MIVRecord.miv_tag,
-                MIVRecord.line_no,
-                MIVRecord.location,
-                MIVRecord.status,
-                MIVRecord.registered_for,
-                MIVRecord.registered_by,
-                MIVRecord.last_updated,
-                MIVRecord.is_complete,
-                MIVRecord.project_id,
-                Project.name.label('project_name')
-            ).join(Project, MIVRecord.project_id == Project.id).filter(
-                MIVRecord.registered_for.ilike(f"%{name_query}%")
-            ).order_by(desc(MIVRecord.last_updated)).all()
+            total, exact = (None, False)
+            if with_total:
+                total, exact = self._estimate_count(session, select(MIVRecord.id).where(*conditions))
 
-            return [
-                {
-                    "id": r.id,
-                    "miv_tag": r.miv_tag,
-                    "line_no": r.line_no,
-                    "location": r.location,
-                    "status": r.status,
-                    "registered_for": r.registered_for,
-                    "registered_by": r.registered_by,
-                    "last_updated": r.last_updated,
-                    "is_complete": r.is_complete,
-                    "project_id": r.project_id,
-                    "project_name": r.project_name
-                } for r in results
-            ]
+            return {
+                "items": [self._miv_search_row(r) for r in rows],
+                "next_cursor": self._encode_cursor([rows[-1].last_updated, rows[-1].id]) if has_more else None,
+                "total_estimate": total,
+                "total_is_exact": exact,
+            }
         except Exception as e:
-            logging.error(f"Error in search_miv_by_registered_for: {e}")
-            return []
+            logging.error(f"Error in search_miv: {e}")
+            return {"items": [], "next_cursor": None, "total_estimate": 0, "total_is_exact": True}
         finally:
             session.close()
 
-    def search_miv_by_registered_by(self, username_query: str) -> List[Dict[str, Any]]:
-        """جستجوی MIV بر اساس Registered By"""
+    def search_miv_all(self, tag=None, registered_for=None, registered_by=None, start_date=None, end_date=None,
+                       is_complete=None, project_id=None, line_no=None) -> List[Dict[str, Any]]:
+        """همه نتایج search_miv بدون صفحه‌بندی (برای متدهای قدیمی search_miv_by_*)."""
         session = self.get_session()
         try:
-            results = session.query(
-                MIVRecord.id,
-                MIVRecord.miv_tag,
-                MIVRecord.line_no,
-                MIVRecord.location,
-                MIVRecord.status,
-                MIVRecord.registered_for,
-                MIVRecord.registered_by,
-                MIVRecord.last_updated,
-                MIVRecord.is_complete,
-                MIVRecord.project_id,
-                Project.name.label('project_name')
-            ).join(Project, MIVRecord.project_id == Project.id).filter(
-                MIVRecord.registered_by.ilike(f"%{username_query}%")
-            ).order_by(desc(MIVRecord.last_updated)).all()
-
-            return [
-                {
-                    "id": r.id,
-                    "miv_tag": r.miv_tag,
-                    "line_no": r.line_no,
-                    "location": r.location,
-                    "status": r.status,
-                    "registered_for": r.registered_for,
-                    "registered_by": r.registered_by,
-                    "last_updated": r.last_updated,
-                    "is_complete": r.is_complete,
-                    "project_id": r.project_id,
-                    "project_name": r.project_name
-                } for r in results
-            ]
+            start_date = self._as_datetime(start_date)
+            end_date = self._as_datetime(end_date, end_of_day=True)
+            query, _ = self._miv_search_query(
+                session, tag, registered_for, registered_by, start_date, end_date, is_complete, project_id, line_no
+            )
+            return [self._miv_search_row(r) for r in session.execute(query).all()]
         except Exception as e:
-            logging.error(f"Error in search_miv_by_registered_by: {e}")
+            logging.error(f"Error in search_miv_all: {e}")
             return []
         finally:
             session.close()
 
-    def search_miv_by_date_range(self, start_date: datetime, end_date: datetime,
-                                 is_complete: bool = None) -> List[Dict[str, Any]]:
-        """جستجوی MIV بر اساس بازه تاریخی"""
-        session = self.get_session()
+    def _miv_search_query(self, session, tag, registered_for, registered_by, start_date, end_date,
+                          is_complete, project_id, line_no):
+        """کوئری مرتب‌شده جستجوی MIV و لیست شرط‌های آن (برای شمارش)."""
+        conditions = []
+        if tag:
+            conditions.append(self._substring_condition(session, 'miv_tag', tag))
+        if registered_for:
+            conditions.append(self._substring_condition(session, 'miv_registered_for', registered_for))
+        if registered_by:
+            conditions.append(self._substring_condition(session, 'miv_registered_by', registered_by))
+        if start_date:
+            conditions.append(MIVRecord.last_updated >= start_date)
+        if end_date:
+            conditions.append(MIVRecord.last_updated < end_date)
+        if is_complete is not None:
+            conditions.append(MIVRecord.is_complete == is_complete)
+        if project_id is not None:
+            conditions.append(MIVRecord.project_id == project_id)
+        if line_no:
+            conditions.append(MIVRecord.line_no == line_no)
+
+        query = select(
+            MIVRecord.id,
+            MIVRecord.miv_tag,
+            MIVRecord.line_no,
+            MIVRecord.location,
+            MIVRecord.status,
+            MIVRecord.registered_for,
+            MIVRecord.registered_by,
+            MIVRecord.last_updated,
+            MIVRecord.is_complete,
+            MIVRecord.project_id,
+            Project.name.label('project_name')
+        ).join(Project, MIVRecord.project_id == Project.id).where(*conditions).order_by(
+            *self._keyset_order_by(MIV_SEARCH_ORDER)
+        )
+        return query, conditions
+
+    @staticmethod
+    def _miv_search_row(r) -> Dict[str, Any]:
+        return {
+            "id": r.id,
+            "miv_tag": r.miv_tag,
+            "line_no": r.line_no,
+            "location": r.location,
+            "status": r.status,
+            "registered_for": r.registered_for,
+            "registered_by": r.registered_by,
+            "last_updated": r.last_updated,
+            "is_complete": r.is_complete,
+            "project_id": r.project_id,
+            "project_name": r.project_name
+        }
+
+    @staticmethod
+    def _keyset_order_by(order):
+        """
+        order: لیست (ستون, نزولی؟) — ستون آخر باید یکتا و غیر NULL باشد (مثلاً id).
+        جای NULLها پیش‌فرض خود دیتابیس است تا ایندکس‌های معمولی برای ORDER BY قابل استفاده بمانند.
+        """
+        return [column.desc() if descending else column.asc() for column, descending in order]
+
+    @staticmethod
+    def _nulls_sort_largest(session) -> bool:
+        """PostgreSQL مقدار NULL را بزرگ‌ترین و SQLite/MySQL کوچک‌ترین مقدار در نظر می‌گیرند."""
+        return session.get_bind().dialect.name not in ("sqlite", "mysql", "mariadb")
+
+    @classmethod
+    def _keyset_condition(cls, order, values, nulls_largest: bool):
+        """شرط ردیف‌هایی که در ترتیب order بعد از ردیفی با مقادیر values می‌آیند (با در نظر گرفتن NULL)."""
+        (column, descending), value = order[0], values[0]
+        rest = cls._keyset_condition(order[1:], values[1:], nulls_largest) if len(order) > 1 else None
+        nulls_last = descending != nulls_largest
+
+        if value is None:
+            equal = column.is_(None)
+            beyond = None if nulls_last else column.isnot(None)
+        else:
+            equal = column == value
+            beyond = (column < value) if descending else (column > value)
+            if nulls_last:
+                beyond = beyond | column.is_(None)
+
+        parts = [p for p in (beyond, and_(equal, rest) if rest is not None else None) if p is not None]
+        return or_(*parts) if parts else false()
+
+    @staticmethod
+    def _encode_cursor(values) -> str:
+        """cursor مات (base64 از JSON مقادیر کلید مرتب‌سازی آخرین ردیف صفحه)."""
+        raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    @staticmethod
+    def _decode_cursor(cursor: str, size: int) -> list:
+        """عکس _encode_cursor؛ cursor نامعتبر ValueError می‌دهد."""
         try:
-            query = session.query(
-                MIVRecord.id,
-                MIVRecord.miv_tag,
-                MIVRecord.line_no,
-                MIVRecord.location,
-                MIVRecord.status,
-                MIVRecord.registered_for,
-                MIVRecord.registered_by,
-                MIVRecord.last_updated,
-                MIVRecord.is_complete,
-                MIVRecord.project_id,
-                Project.name.label('project_name')
-            ).join(Project, MIVRecord.project_id == Project.id).filter(
-                MIVRecord.last_updated >= start_date,
-                MIVRecord.last_updated <= end_date
-            )
+            values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+        except Exception:
+            values = None
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError(f"Invalid cursor: {cursor!r}")
+        return values
+
+    @staticmethod
+    def _as_datetime(value, end_of_day=False):
+        """
+        تبدیل ورودی تاریخ (datetime / date / رشته) به datetime.
+        با end_of_day=True تاریخ بدون ساعت به ابتدای روز بعد تبدیل می‌شود (مرز انحصاری).
+        """
+        if not value:
+            return None
+        if isinstance(value, str):
+            value = value.strip()
+            parsed = datetime.fromisoformat(value)
+            if end_of_day and len(value) <= 10:
+                return parsed + timedelta(days=1)
+            return parsed
+        if isinstance(value, datetime):
+            return value
+        parsed = datetime(value.year, value.month, value.day)
+        return parsed + timedelta(days=1) if end_of_day else parsed
+
+    def _estimate_count(self, session, id_query, cap: int = SEARCH_COUNT_CAP):
+        """
+        شمارش ارزان نتایج: تا cap ردیف دقیق شمرده می‌شود (خروجی: (تعداد, True)).
+        بیشتر از آن روی PostgreSQL تخمین planner (EXPLAIN) و در غیر این صورت خود cap برگردانده می‌شود.
+        """
+        capped = session.execute(
+            select(func.count()).select_from(id_query.limit(cap + 1).subquery())
+        ).scalar() or 0
+        if capped <= cap:
+            return capped, True
+
+        if session.get_bind().dialect.name == "postgresql":
+            try:
+                compiled = id_query.compile(dialect=session.get_bind().dialect,
+                                            compile_kwargs={"literal_binds": True})
+                plan = session.execute(text(f"EXPLAIN (FORMAT JSON) {compiled}")).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                return max(cap, int(plan[0]["Plan"]["Plan Rows"])), False
+            except Exception as e:
+                logging.warning(f"تخمین تعداد از planner ناموفق بود: {e}")
+        return cap, False
 
-            if is_complete is not None:
-                query = query.filter(MIVRecord.is_complete == is_complete)
+    def search_miv_by_tag(self, tag_query: str) -> List[Dict[str, Any]]:
+        """جستجوی MIV بر اساس تگ (PARTIAL MATCH)"""
+        return self.search_miv_all(tag=tag_query)
 
-            results = query.order_by(desc(MIVRecord.last_updated)).all()
+    def search_miv_by_registered_for(self, name_query: str) -> List[Dict[str, Any]]:
+        """جستجوی MIV بر اساس Registered For"""
+        return self.search_miv_all(registered_for=name_query)
 
-            return [
-                {
-                    "id": r.id,
-                    "miv_tag": r.miv_tag,
-                    "line_no": r.line_no,
-                    "location": r.location,
-                    "status": r.status,
-                    "registered_for": r.registered_for,
-                    "registered_by": r.registered_by,
-                    "last_updated": r.last_updated,
-                    "is_complete": r.is_complete,
-                    "project_id": r.project_id,
-                    "project_name": r.project_name
-                } for r in results
-            ]
-        except Exception as e:
-            logging.error(f"Error in search_miv_by_date_range: {e}")
-            return []
-        finally:
-            session.close()
+    def search_miv_by_registered_by(self, username_query: str) -> List[Dict[str, Any]]:
+        """جستجوی MIV بر اساس Registered By"""
+        return self.search_miv_all(registered_by=username_query)
+
+    def search_miv_by_date_range(self, start_date: datetime, end_date: datetime,
+                                 is_complete: bool = None) -> List[Dict[str, Any]]:
+        """جستجوی MIV بر اساس بازه تاریخی"""
+        return self.search_miv_all(start_date=start_date, end_date=end_date, is_complete=is_complete)
 
     def search_miv_by_completion_status(self, is_complete: bool) -> List[Dict[str, Any]]:
         """جستجوی MIV بر اساس وضعیت تکمیل"""
-        session = self.get_session()
-        try:
-            results = session.query(
-                MIVRecord.id,
-                MIVRecord.miv_tag,
-                MIVRecord.line_no,
-                MIVRecord.location,
-                MIVRecord.status,
-                MIVRecord.registered_for,
-                MIVRecord.registered_by,
-                MIVRecord.last_updated,
-                MIVRecord.is_complete,
-                MIVRecord.project_id,
-                Project.name.label('project_name')
-            ).join(Project, MIVRecord.project_id == Project.id).filter(
-                MIVRecord.is_complete == is_complete
-            ).order_by(desc(MIVRecord.last_updated)).all()
-
-            return [
-                {
-                    "id": r.id,
-                    "miv_tag": r.miv_tag,
-                    "line_no": r.line_no,
-                    "location": r.location,
-                    "status": r.status,
-                    "registered_for": r.registered_for,
-                    "registered_by": r.registered_by,
-                    "last_updated": r.last_updated,
-                    "is_complete": r.is_complete,
-                    "project_id": r.project_id,
-                    "project_name": r.project_name
-                } for r in results
-            ]
-        except Exception as e:
-            logging.error(f"Error in search_miv_by_completion_status: {e}")
-            return []
-        finally:
-            session.close()
+        return self.search_miv_all(is_complete=is_complete)
 
     def get_miv_consumption_details(self, miv_id: int) -> Dict[str, List[Dict]]:
         """دریافت جزئیات مصرف یک MIV (برای نمایش در دیالوگ جزئیات)"""
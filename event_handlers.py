@@ -31,12 +31,7 @@ class EventHandlers:
             self.main_window.show_message("خطا", "فیلدهای Line No و MIV Tag اجباری هستند.", "warning")
             return
 
-        if self.main_window.dm.is_duplicate_miv_tag(form_data["MIV Tag"], self.main_window.current_project.id):
-            self.main_window.show_message("خطا", f"تگ '{form_data['MIV Tag']}' در این پروژه تکراری است.", "error")
-            return
-
-        self.main_window.dm.initialize_mto_progress_for_line(self.main_window.current_project.id, form_data["Line No"])
-
+        # دیالوگ مصرف فقط می‌خواند؛ بررسی تکرار تگ و ساخت ردیف‌های پیشرفت خط داخل تراکنش register_miv_record است
         dialog = MTOConsumptionDialog(self.main_window.dm, self.main_window.current_project.id, form_data["Line No"], parent=self.main_window)
         if not dialog.exec():
             self.main_window.log_to_console("ثبت رکورد لغو شد.", "warning")
@@ -58,6 +53,7 @@ class EventHandlers:
 
         form_data["Comment"] = " | ".join(comment_parts)
 
+        # بررسی تکرار تگ، درج مصرف‌ها، کسر اسپول، آمار پیشرفت و لاگ در یک تراکنش
         success, msg = self.main_window.dm.register_miv_record(self.main_window.current_project.id, form_data, consumed_items, spool_items)
 
         if success:
@@ -68,6 +64,7 @@ class EventHandlers:
                     self.main_window.entries[field].clear()
         else:
             self.main_window.log_to_console(msg, "error")
+            self.main_window.show_message("خطا", msg, "error")
 
     def handle_search(self):
         search_type = self.main_window.search_type_combo.currentText()
@@ -99,12 +96,8 @@ class EventHandlers:
                 self.main_window.show_message("خطا", "لطفاً MIV Tag را وارد کنید.", "warning")
                 return
 
-            results = self.main_window.dm.search_miv_by_tag(tag_query)
-            if not results:
-                self.main_window.show_message("نتیجه", f"هیچ رکوردی با تگ '{tag_query}' یافت نشد.", "info")
-                return
-
-            self._show_search_results_dialog(results, f"نتایج جستجو - MIV Tag: {tag_query}")
+            self._run_miv_search({"tag": tag_query}, f"نتایج جستجو - MIV Tag: {tag_query}",
+                                 f"هیچ رکوردی با تگ '{tag_query}' یافت نشد.")
 
         elif search_type == "Registered For":
             name_query = self.main_window.search_entry_reg_for.text().strip()
@@ -112,12 +105,8 @@ class EventHandlers:
                 self.main_window.show_message("خطا", "لطفاً نام را وارد کنید.", "warning")
                 return
 
-            results = self.main_window.dm.search_miv_by_registered_for(name_query)
-            if not results:
-                self.main_window.show_message("نتیجه", f"هیچ رکوردی برای '{name_query}' یافت نشد.", "info")
-                return
-
-            self._show_search_results_dialog(results, f"نتایج جستجو - Registered For: {name_query}")
+            self._run_miv_search({"registered_for": name_query}, f"نتایج جستجو - Registered For: {name_query}",
+                                 f"هیچ رکوردی برای '{name_query}' یافت نشد.")
 
         elif search_type == "Registered By":
             username_query = self.main_window.search_entry_reg_by.text().strip()
@@ -125,12 +114,8 @@ class EventHandlers:
                 self.main_window.show_message("خطا", "لطفاً نام کاربری را وارد کنید.", "warning")
                 return
 
-            results = self.main_window.dm.search_miv_by_registered_by(username_query)
-            if not results:
-                self.main_window.show_message("نتیجه", f"هیچ رکوردی توسط '{username_query}' یافت نشد.", "info")
-                return
-
-            self._show_search_results_dialog(results, f"نتایج جستجو - Registered By: {username_query}")
+            self._run_miv_search({"registered_by": username_query}, f"نتایج جستجو - Registered By: {username_query}",
+                                 f"هیچ رکوردی توسط '{username_query}' یافت نشد.")
 
         elif search_type == "Date Range":
             start_date = self.main_window.search_date_start.date().toString("yyyy-MM-dd")
@@ -143,23 +128,25 @@ class EventHandlers:
             elif status_text == "تکمیل نشده":
                 is_complete = False
 
-            results = self.main_window.dm.search_miv_by_date_range(start_date, end_date, is_complete)
-            if not results:
-                self.main_window.show_message("نتیجه", "هیچ رکوردی در بازه زمانی انتخابی یافت نشد.", "info")
-                return
-
-            self._show_search_results_dialog(results, f"نتایج جستجو - Date Range: {start_date} to {end_date}")
+            self._run_miv_search({"start_date": start_date, "end_date": end_date, "is_complete": is_complete},
+                                 f"نتایج جستجو - Date Range: {start_date} to {end_date}",
+                                 "هیچ رکوردی در بازه زمانی انتخابی یافت نشد.")
 
         elif search_type == "Completion Status":
             status_text = self.main_window.search_completion_combo.currentText()
             is_complete = (status_text == "تکمیل شده")
 
-            results = self.main_window.dm.search_miv_by_completion_status(is_complete)
-            if not results:
-                self.main_window.show_message("نتیجه", f"هیچ رکورد {status_text} یافت نشد.", "info")
-                return
+            self._run_miv_search({"is_complete": is_complete}, f"نتایج جستجو - وضعیت: {status_text}",
+                                 f"هیچ رکورد {status_text} یافت نشد.")
 
-            self._show_search_results_dialog(results, f"نتایج جستجو - وضعیت: {status_text}")
+    def _run_miv_search(self, criteria, title, empty_message):
+        """صفحه اول search_miv را نمایش می‌دهد؛ صفحه‌های بعدی با دکمه «نتایج بیشتر» در همان دیالوگ خوانده می‌شوند."""
+        page = self.main_window.dm.search_miv(**criteria)
+        if not page["items"]:
+            self.main_window.show_message("نتیجه", empty_message, "info")
+            return
+
+        self._show_search_results_dialog(page["items"], title, criteria=criteria, page=page)
 
     def handle_update_dashboard_button_click(self):
         if not self.main_window.current_project:
@@ -197,9 +184,9 @@ class EventHandlers:
 
         file_paths, _ = QFileDialog.getOpenFileNames(
             self.main_window,
-            "فایل‌های CSV مورد نظر را انتخاب کنید (MTO-*.csv, Spools.csv, SpoolItems.csv)",
+            "فایل‌های CSV مورد نظر را انتخاب کنید (MTO-*.csv, Spools.csv, SpoolItems.csv, MIV-*.csv)",
             "",
-            "CSV Files (*.csv)"
+            "Data Files (*.csv *.xlsx)"
         )
 
         if not file_paths:
@@ -211,7 +198,12 @@ class EventHandlers:
         try:
             QApplication.processEvents()
 
-            success, message = self.main_window.dm.process_selected_csv_files(file_paths)
+            def on_file_done(file_name, ok, file_message):
+                # پیشرفت هر فایل به محض اتمام در کنسول نمایش داده می‌شود
+                self.main_window.log_to_console(f"{file_name}: {file_message}", "success" if ok else "error")
+                QApplication.processEvents()
+
+            success, message = self.main_window.dm.process_selected_csv_files(file_paths, progress_callback=on_file_done)
 
             if success:
                 self.main_window.log_to_console(message, "success")
@@ -368,11 +360,17 @@ class EventHandlers:
         if self.main_window.current_project:
             self.main_window.update_line_dashboard(line_no)
 
-    def _show_search_results_dialog(self, records, title):
-        if records and isinstance(records[0], dict):
-            records = [self._dict_to_record_format(r) for r in records]
-
-        self.main_window.log_to_console(f"{len(records)} رکورد یافت شد.", "info")
+    def _show_search_results_dialog(self, records, title, criteria=None, page=None):
+        """
+        نمایش نتایج جستجوی MIV.
+        اگر page (خروجی search_miv) داده شود، نتایج صفحه‌بندی شده و دکمه «نتایج بیشتر» صفحه بعد را اضافه می‌کند.
+        """
+        if page is not None:
+            total = page.get("total_estimate")
+            total_text = f"{total}" if page.get("total_is_exact") else f"حدود {total}+"
+            self.main_window.log_to_console(f"{total_text} رکورد یافت شد.", "info")
+        else:
+            self.main_window.log_to_console(f"{len(records)} رکورد یافت شد.", "info")
 
         dlg = QDialog(self.main_window)
         dlg.setWindowTitle(title)
@@ -388,9 +386,36 @@ class EventHandlers:
         table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
         table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
         table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
-        table.setRowCount(len(records))
+        self._append_search_rows(table, records, dlg)
+        layout.addWidget(table)
+
+        if page is not None and page.get("next_cursor"):
+            state = {"cursor": page["next_cursor"]}
+            more_btn = QPushButton("نتایج بیشتر")
+
+            def load_more():
+                next_page = self.main_window.dm.search_miv(cursor=state["cursor"], **criteria)
+                self._append_search_rows(table, next_page["items"], dlg)
+                state["cursor"] = next_page["next_cursor"]
+                if not state["cursor"]:
+                    more_btn.setEnabled(False)
+
+            more_btn.clicked.connect(load_more)
+            layout.addWidget(more_btn)
+
+        close_btn = QPushButton("بستن")
+        close_btn.clicked.connect(dlg.close)
+        layout.addWidget(close_btn)
+
+        dlg.exec()
 
-        for row, rec in enumerate(records):
+    def _append_search_rows(self, table, records, dlg):
+        """افزودن ردیف‌های MIV (شیء یا دیکشنری) به انتهای جدول نتایج جستجو."""
+        records = [self._dict_to_record_format(r) if isinstance(r, dict) else r for r in records]
+        start = table.rowCount()
+        table.setRowCount(start + len(records))
+
+        for row, rec in enumerate(records, start):
             table.setItem(row, 0, QTableWidgetItem(str(rec.id)))
             table.setItem(row, 1, QTableWidgetItem(rec.project_name if hasattr(rec, 'project_name') else "N/A"))
             table.setItem(row, 2, QTableWidgetItem(rec.line_no or ""))
@@ -419,14 +444,6 @@ class EventHandlers:
             actions_layout.addWidget(edit_btn)
             table.setCellWidget(row, 9, actions_widget)
 
-        layout.addWidget(table)
-
-        close_btn = QPushButton("بستن")
-        close_btn.clicked.connect(dlg.close)
-        layout.addWidget(close_btn)
-
-        dlg.exec()
-
     def _show_miv_details(self, miv_record_id):
         try:
             details = self.main_window.dm.get_miv_consumption_details(miv_record_id)
@@ -0,0 +1,199 @@
+# file: iso_crawler.py
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+# پسوند فایل‌هایی که در ایندکس ISO نگه داشته می‌شوند
+ISO_FILE_EXTENSIONS = ('.pdf', '.dwg')
+
+# (file_path, filename, st_mtime)
+CrawledFile = Tuple[str, str, float]
+# dir_path -> (mtime, entry_count)
+DirectorySignatures = Dict[str, Tuple[float, int]]
+
+# mtime ثبت‌شده برای پوشه‌ای که خواندن یکی از زیرپوشه‌هایش ناموفق بود؛ با هیچ mtime واقعی برابر نیست،
+# پس پوشه در اسکن بعدی دوباره لیست می‌شود و زیرپوشه‌ی ناموفق (که امضایی ندارد) از قلم نمی‌افتد
+UNSETTLED_DIR_MTIME = -1.0
+
+
+def _dir_key(path: str) -> str:
+    """کلید مقایسه‌ی مسیر پوشه (بدون جداکننده‌ی انتهایی تا با os.path.dirname یکی شود)."""
+    return path.rstrip('/\\') or path
+
+
+class IsoDirectoryCrawler:
+    """
+    پیمایش یک‌باره‌ی پوشه‌ی ISO با os.scandir و یک thread pool.
+    هر پوشه در یک worker لیست می‌شود و زیرپوشه‌های آن بلافاصله به pool سپرده می‌شوند؛
+    زمان تغییر فایل از داده‌ی stat همان DirEntry خوانده می‌شود (روی ویندوز/SMB بدون رفت‌وبرگشت اضافه).
+    فایل‌ها در دسته‌های batch_size به صورت جریانی (generator) تحویل داده می‌شوند تا نوشتن در دیتابیس
+    همزمان با ادامه‌ی پیمایش انجام شود.
+
+    اگر signatures (امضای پوشه‌ها از اسکن قبلی) داده شود، پوشه‌ای که mtime آن تغییر نکرده لیست نمی‌شود
+    و فقط زیرپوشه‌های ثبت‌شده‌اش (children) بررسی می‌شوند. mtime پوشه فقط با افزودن/حذف/تغییر نام ورودی‌ها
+    عوض می‌شود؛ فایلی که درجا بازنویسی شود در اسکن افزایشی دیده نمی‌شود (watcher یا اسکن کامل لازم است).
+    """
+
+    def __init__(self, base_dir: str, max_workers: int = 16, batch_size: int = 500,
+                 extensions: Tuple[str, ...] = ISO_FILE_EXTENSIONS,
+                 signatures: Optional[DirectorySignatures] = None,
+                 children: Optional[Dict[str, List[str]]] = None):
+        self.base_dir = base_dir
+        self.max_workers = max(1, max_workers)
+        self.batch_size = max(1, batch_size)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.signatures = signatures or {}
+        self.children = children or {}
+
+        # آمار پیمایش (فقط از thread مصرف‌کننده خوانده/نوشته می‌شود)
+        self.dirs_discovered = 0
+        self.dirs_completed = 0
+        self.files_found = 0
+        self.failed_dirs: Set[str] = set()  # پوشه‌هایی که لیست کردنشان خطا داد
+        self.skipped_dirs: Set[str] = set()  # پوشه‌های بدون تغییر (لیست نشده‌اند)
+        self.skipped_entries = 0
+        # dir_path -> (parent_path, mtime, entry_count) برای پوشه‌هایی که در این پیمایش لیست شدند
+        # (mtime پوشه‌ای که زیرپوشه‌ی ناموفق دارد UNSETTLED_DIR_MTIME است)
+        self.scanned_dirs: Dict[str, Tuple[Optional[str], float, int]] = {}
+
+        self._results: "queue.Queue" = queue.Queue()
+        self._stop = threading.Event()
+        self._skipped_keys: Set[str] = set()
+
+    @property
+    def progress(self) -> float:
+        """نسبت پوشه‌های تمام‌شده به پوشه‌های کشف‌شده تا این لحظه (بین ۰ و ۱)."""
+        if not self.dirs_discovered:
+            return 0.0
+        return self.dirs_completed / self.dirs_discovered
+
+    @property
+    def visited_dirs(self) -> Set[str]:
+        """پوشه‌هایی که در این پیمایش وجودشان تأیید شد (لیست‌شده یا بدون تغییر)."""
+        return set(self.scanned_dirs) | self.skipped_dirs
+
+    def crawl(self, on_progress: Optional[Callable[["IsoDirectoryCrawler"], None]] = None) -> Iterator[List[CrawledFile]]:
+        """
+        پیمایش کامل base_dir؛ دسته‌های فایل را yield می‌کند.
+        on_progress پس از تمام شدن هر پوشه با خود crawler صدا زده می‌شود.
+        """
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="iso-crawl")
+        batch: List[CrawledFile] = []
+        try:
+            self.dirs_discovered = 1
+            executor.submit(self._scan_worker, executor, self.base_dir, None, None)
+
+            while self.dirs_completed < self.dirs_discovered:
+                dir_path, parent, files, subdir_count, status, signature = self._results.get()
+                self.dirs_completed += 1
+                self.dirs_discovered += subdir_count
+                if status == 'failed':
+                    self.failed_dirs.add(dir_path)
+                    if parent in self.scanned_dirs:
+                        grandparent, _, entry_count = self.scanned_dirs[parent]
+                        self.scanned_dirs[parent] = (grandparent, UNSETTLED_DIR_MTIME, entry_count)
+                elif status == 'skipped':
+                    self.skipped_dirs.add(dir_path)
+                    self._skipped_keys.add(_dir_key(dir_path))
+                    self.skipped_entries += self.signatures[dir_path][1] or 0
+                elif status == 'scanned':
+                    self.scanned_dirs[dir_path] = (parent, signature[0], signature[1])
+
+                if files:
+                    self.files_found += len(files)
+                    batch.extend(files)
+                    if len(batch) >= self.batch_size:
+                        yield batch
+                        batch = []
+
+                if on_progress:
+                    on_progress(self)
+
+            if batch:
+                yield batch
+        finally:
+            # در صورت توقف زودهنگام مصرف‌کننده، workerهای باقی‌مانده کاری انجام نمی‌دهند
+            self._stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def is_under_failed_dir(self, path: str) -> bool:
+        """آیا path داخل پوشه‌ای است که خواندنش ناموفق بوده (و وضعیتش نامعلوم است)؟"""
+        return any(path.startswith(os.path.join(failed, '')) for failed in self.failed_dirs)
+
+    def is_retained(self, file_path: str) -> bool:
+        """
+        آیا رکورد ایندکسِ فایلی که در این پیمایش دیده نشده باید باقی بماند؟
+        (پوشه‌ی آن بدون تغییر بوده و لیست نشده، یا خواندنش ناموفق بوده است)
+        """
+        if _dir_key(os.path.dirname(file_path)) in self._skipped_keys:
+            return True
+        return self.is_under_failed_dir(file_path)
+
+    def _scan_worker(self, executor: ThreadPoolExecutor, dir_path: str, parent: Optional[str],
+                     mtime: Optional[float]):
+        if self._stop.is_set():
+            return
+        try:
+            if mtime is None:
+                # پوشه‌ی ریشه یا زیرپوشه‌ی یک پوشه‌ی لیست‌نشده: mtime پیش از لیست کردن خوانده می‌شود
+                mtime = os.stat(dir_path).st_mtime
+            previous = self.signatures.get(dir_path)
+            if previous is not None and previous[0] == mtime:
+                subdirs = [(child, None) for child in self.children.get(dir_path, ())]
+                files, status, signature = [], 'skipped', None
+            else:
+                files, subdirs, entry_count = self._scan_directory(dir_path)
+                status, signature = 'scanned', (mtime, entry_count)
+        except FileNotFoundError:
+            # زیرپوشه در این فاصله حذف شده است و رکوردهایش به عنوان حذف‌شده پاک می‌شوند؛
+            # نبودن پوشه‌ی ریشه اما خطا حساب می‌شود (مثلاً share در دسترس نیست)
+            status = 'failed' if parent is None else 'missing'
+            self._results.put((dir_path, parent, [], 0, status, None))
+            return
+        except Exception:
+            self._results.put((dir_path, parent, [], 0, 'failed', None))
+            return
+
+        # نتیجه قبل از سپردن زیرپوشه‌ها در صف قرار می‌گیرد تا شمارش «کشف‌شده» همیشه جلوتر از «تمام‌شده» باشد
+        self._results.put((dir_path, parent, files, len(subdirs), status, signature))
+        for subdir, subdir_mtime in subdirs:
+            try:
+                executor.submit(self._scan_worker, executor, subdir, dir_path, subdir_mtime)
+            except RuntimeError:
+                # executor بسته شده است (مصرف‌کننده پیمایش را متوقف کرده)
+                break
+
+    def _scan_directory(self, dir_path: str) -> Tuple[List[CrawledFile], List[Tuple[str, Optional[float]]], int]:
+        """
+        لیست یک پوشه: فایل‌های ISO با زمان تغییرشان، زیرپوشه‌ها با mtime خودشان
+        (بدون دنبال کردن symlink) و تعداد کل ورودی‌ها.
+        """
+        files: List[CrawledFile] = []
+        subdirs: List[Tuple[str, Optional[float]]] = []
+        entry_count = 0
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                entry_count += 1
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            subdirs.append((entry.path, self._entry_mtime(entry)))
+                        continue
+                    if not entry.name.lower().endswith(self.extensions):
+                        continue
+                    files.append((entry.path, entry.name, entry.stat().st_mtime))
+                except OSError:
+                    # فایل در حین پیمایش حذف شده یا قابل دسترسی نیست
+                    continue
+        return files, subdirs, entry_count
+
+    @staticmethod
+    def _entry_mtime(entry: os.DirEntry) -> Optional[float]:
+        try:
+            return entry.stat().st_mtime
+        except OSError:
+            # در worker همان پوشه دوباره با os.stat خوانده می‌شود
+            return None
@@ -3,8 +3,9 @@
 import os
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from threading import Timer, Lock
-from typing import Set, Dict, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
 from PyQt6.QtCore import QObject, pyqtSignal
@@ -14,8 +15,9 @@ from watchdog.events import FileSystemEventHandler
 class IsoIndexEventHandler(QObject, FileSystemEventHandler):
     """
     کلاس پیشرفته برای مدیریت تغییرات فایل‌های ISO/DWG با قابلیت‌های زیر:
-    - Event Debouncing برای جلوگیری از پردازش مکرر
-    - Batch Processing برای بهینه‌سازی عملکرد
+    - Batch Processing: همه‌ی رویدادها در یک صف (مسیر -> نوع رویداد) جمع می‌شوند؛ رویدادهای تکراری
+      یک فایل در همان صف ادغام می‌شوند (debouncing)
+    - stat موازی فایل‌های هر batch در یک thread pool و نوشتن با یک upsert و یک حذف گروهی
     - مدیریت خطای پیشرفته با Retry Logic
     - آمارگیری و گزارش‌دهی کامل
     """
@@ -29,11 +31,11 @@ class IsoIndexEventHandler(QObject, FileSystemEventHandler):
 
     # تنظیمات پیش‌فرض
     SUPPORTED_EXTENSIONS = {".pdf", ".dwg"}
-    DEBOUNCE_DELAY = 1.0  # ثانیه تاخیر برای debouncing
-    BATCH_SIZE = 50  # تعداد فایل در هر batch
+    BATCH_SIZE = 500  # حداکثر تعداد فایل در هر batch
     BATCH_DELAY = 2.0  # ثانیه تاخیر برای جمع‌آوری batch
     MAX_RETRY_ATTEMPTS = 3  # تعداد تلاش مجدد در صورت خطا
     RETRY_DELAY = 0.5  # ثانیه تاخیر بین تلاش‌های مجدد
+    STAT_WORKERS = 8  # تعداد threadهای stat فایل‌ها (I/O-bound روی SMB)
 
     def __init__(self, dm, config: Optional[Dict] = None):
         """
@@ -44,20 +46,21 @@ class IsoIndexEventHandler(QObject, FileSystemEventHandler):
         super().__init__()
 
         self.dm = dm
-        self._lock = Lock()  # برای thread-safety
+        self._lock = Lock()  # برای thread-safety صف
+        self._flush_lock = Lock()  # batchها به ترتیب و یکی‌یکی نوشته می‌شوند
 
         # اعمال تنظیمات سفارشی (در صورت وجود)
         if config:
             self.SUPPORTED_EXTENSIONS = config.get('extensions', self.SUPPORTED_EXTENSIONS)
-            self.DEBOUNCE_DELAY = config.get('debounce_delay', self.DEBOUNCE_DELAY)
             self.BATCH_SIZE = config.get('batch_size', self.BATCH_SIZE)
             self.BATCH_DELAY = config.get('batch_delay', self.BATCH_DELAY)
             self.MAX_RETRY_ATTEMPTS = config.get('max_retries', self.MAX_RETRY_ATTEMPTS)
+            self.STAT_WORKERS = config.get('stat_workers', self.STAT_WORKERS)
 
         # ساختارهای داده برای مدیریت رویدادها
-        self._pending_events: Dict[str, Dict] = {}  # {file_path: {'action': str, 'timer': Timer}}
-        self._batch_queue: Set[str] = set()  # صف پردازش دسته‌ای
+        self._batch_queue: Dict[str, str] = {}  # صف پردازش دسته‌ای {file_path: action}
         self._batch_timer: Optional[Timer] = None
+        self._stat_pool: Optional[ThreadPoolExecutor] = None
 
         # آمار عملکرد
         self.stats = {
@@ -67,6 +70,7 @@ class IsoIndexEventHandler(QObject, FileSystemEventHandler):
             'moved': 0,
             'errors': 0,
             'total_processed': 0,
+            'batches': 0,
             'last_batch_time': None,
             'start_time': datetime.now()
         }
@@ -80,125 +84,148 @@ class IsoIndexEventHandler(QObject, FileSystemEventHandler):
         extension = os.path.splitext(path)[1].lower()
         return extension in self.SUPPORTED_EXTENSIONS
 
-    def _debounce_event(self, file_path: str, action: str, callback):
-        """
-        پیاده‌سازی Debouncing برای جلوگیری از پردازش مکرر رویدادها
-
-        Args:
-            file_path: مسیر فایل
-            action: نوع عملیات (created, modified, deleted, moved)
-            callback: تابع callback برای اجرای عملیات واقعی
-        """
-        with self._lock:
-            # لغو تایمر قبلی برای این فایل (در صورت وجود)
-            if file_path in self._pending_events:
-                old_timer = self._pending_events[file_path].get('timer')
-                if old_timer and old_timer.is_alive():
-                    old_timer.cancel()
-
-            # ساخت تایمر جدید
-            timer = Timer(self.DEBOUNCE_DELAY, callback)
-            self._pending_events[file_path] = {
-                'action': action,
-                'timer': timer,
-                'timestamp': time.time()
-            }
-            timer.start()
+    def _get_stat_pool(self) -> ThreadPoolExecutor:
+        if self._stat_pool is None:
+            self._stat_pool = ThreadPoolExecutor(max_workers=self.STAT_WORKERS, thread_name_prefix="iso-stat")
+        return self._stat_pool
 
-    def _process_with_retry(self, operation, file_path: str, max_attempts: int = None):
+    def _stat_with_retry(self, file_path: str) -> Tuple[str, Optional[float], Optional[str]]:
         """
-        اجرای عملیات با قابلیت retry در صورت بروز خطا
-
-        Args:
-            operation: تابع عملیاتی که باید اجرا شود
-            file_path: مسیر فایل
-            max_attempts: حداکثر تعداد تلاش (پیش‌فرض از تنظیمات کلاس)
+        خواندن mtime فایل با قابلیت retry در صورت بروز خطا
 
         Returns:
-            bool: True در صورت موفقیت، False در صورت شکست
+            (file_path, mtime, error): mtime=None و error=None یعنی فایل وجود ندارد
         """
-        if max_attempts is None:
-            max_attempts = self.MAX_RETRY_ATTEMPTS
-
         last_error = None
 
-        for attempt in range(1, max_attempts + 1):
+        for attempt in range(1, self.MAX_RETRY_ATTEMPTS + 1):
             try:
-                operation(file_path)
-                return True
+                return file_path, os.stat(file_path).st_mtime, None
 
             except FileNotFoundError:
                 # فایل حذف شده، نیازی به retry نیست
-                return False
+                return file_path, None, None
 
             except PermissionError as e:
                 last_error = f"Permission denied: {e}"
-                if attempt < max_attempts:
-                    time.sleep(self.RETRY_DELAY * attempt)  # تاخیر افزایشی
 
             except Exception as e:
                 last_error = f"Unexpected error: {e}"
-                if attempt < max_attempts:
-                    time.sleep(self.RETRY_DELAY * attempt)
 
-        # در صورت شکست تمام تلاش‌ها
-        self.stats['errors'] += 1
-        self.error_occurred.emit(file_path, last_error or "Unknown error")
-        self.status_updated.emit(
-            f"Failed to process '{os.path.basename(file_path)}' after {max_attempts} attempts",
-            "error"
-        )
-        return False
-
-    def _add_to_batch(self, file_path: str):
-        """افزودن فایل به صف پردازش دسته‌ای"""
+            if attempt < self.MAX_RETRY_ATTEMPTS:
+                time.sleep(self.RETRY_DELAY * attempt)  # تاخیر افزایشی
+
+        return file_path, None, last_error or "Unknown error"
+
+    def _add_to_batch(self, file_path: str, action: str):
+        """افزودن فایل به صف پردازش دسته‌ای (رویداد جدیدتر همان فایل جایگزین قبلی می‌شود)"""
         with self._lock:
-            self._batch_queue.add(file_path)
+            self._batch_queue[file_path] = action
 
-            # اگر صف پر شد، بلافاصله پردازش کن
+            # اگر صف پر شد، بلافاصله (در thread جدا) پردازش کن
             if len(self._batch_queue) >= self.BATCH_SIZE:
                 if self._batch_timer and self._batch_timer.is_alive():
                     self._batch_timer.cancel()
-                self._process_batch()
-
-            # در غیر این صورت، تایمر را ریست کن
-            elif not self._batch_timer or not self._batch_timer.is_alive():
-                self._batch_timer = Timer(self.BATCH_DELAY, self._process_batch)
+                self._batch_timer = Timer(0, self._process_batch)
                 self._batch_timer.start()
 
-    def _process_batch(self):
-        """پردازش دسته‌ای فایل‌های موجود در صف"""
-        with self._lock:
-            if not self._batch_queue:
-                return
-
-            files_to_process = list(self._batch_queue)
-            self._batch_queue.clear()
-            self._batch_timer = None
-
-        # پردازش فایل‌ها به صورت دسته‌ای
-        total_files = len(files_to_process)
-        self.status_updated.emit(f"Processing batch of {total_files} files...", "info")
-
-        success_count = 0
-        for idx, file_path in enumerate(files_to_process, 1):
-            if self._process_with_retry(self.dm.upsert_iso_index_entry, file_path):
-                success_count += 1
-                self.stats['total_processed'] += 1
+            # در غیر این صورت، اگر تایمری فعال نیست آن را راه‌اندازی کن
+            else:
+                self._schedule_batch_locked()
 
-            # ارسال پیشرفت
-            progress = int((idx / total_files) * 100)
-            self.progress_updated.emit(progress, "Batch Processing")
+    def _schedule_batch_locked(self):
+        """راه‌اندازی تایمر batch اگر تایمری در انتظار نیست (باید با self._lock گرفته‌شده صدا زده شود)"""
+        if not self._batch_timer or not self._batch_timer.is_alive():
+            self._batch_timer = Timer(self.BATCH_DELAY, self._process_batch)
+            self._batch_timer.start()
 
-        # ثبت زمان اتمام batch
-        self.stats['last_batch_time'] = datetime.now()
+    def _process_batch(self):
+        """
+        پردازش دسته‌ای فایل‌های موجود در صف:
+        stat موازی همه‌ی فایل‌ها، سپس یک upsert برای فایل‌های موجود و یک حذف گروهی برای فایل‌های حذف‌شده
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._batch_queue:
+                    return
+
+                batch = self._batch_queue
+                self._batch_queue = {}
+                # تایمری که این flush را شروع کرده دیگر در انتظار نیست؛ رویدادهایی که حین نوشتن
+                # می‌رسند باید تایمر تازه‌ی خودشان را بگیرند
+                self._batch_timer = None
+
+            total_files = len(batch)
+            self.status_updated.emit(f"Processing batch of {total_files} files...", "info")
+
+            # stat موازی فایل‌ها
+            file_mtimes: Dict[str, float] = {}
+            removed_paths: List[str] = []
+            failed: Dict[str, str] = {}
+            for file_path, mtime, error in self._get_stat_pool().map(self._stat_with_retry, list(batch)):
+                if error is not None:
+                    failed[file_path] = error
+                elif mtime is None:
+                    removed_paths.append(file_path)
+                else:
+                    file_mtimes[file_path] = mtime
+            self.progress_updated.emit(50, "Batch Processing")
+
+            # نوشتن در دیتابیس با retry
+            success, message = False, ""
+            for attempt in range(1, self.MAX_RETRY_ATTEMPTS + 1):
+                success, message = self.dm.apply_iso_index_changes(file_mtimes, removed_paths)
+                if success:
+                    break
+                if attempt < self.MAX_RETRY_ATTEMPTS:
+                    time.sleep(self.RETRY_DELAY * attempt)
 
-        # ارسال سیگنال اتمام batch
-        self.batch_completed.emit(success_count)
-        self.status_updated.emit(
-            f"Batch completed: {success_count}/{total_files} files processed successfully",
-            "success" if success_count == total_files else "warning"
-        )
+            if not success:
+                for file_path in file_mtimes:
+                    failed[file_path] = message
+                for file_path in removed_paths:
+                    failed[file_path] = message
+                file_mtimes, removed_paths = {}, []
+
+            # آمار و گزارش هر فایل بر اساس وضعیت نهایی (مثلاً فایلی که حذف و دوباره ساخته شده «modified» است)
+            action_counts = defaultdict(int)
+            for file_path in file_mtimes:
+                action = batch[file_path] if batch[file_path] != 'deleted' else 'modified'
+                action_counts[action] += 1
+                self.file_processed.emit(file_path, action)
+            for file_path in removed_paths:
+                action_counts['deleted'] += 1
+                self.file_processed.emit(file_path, 'deleted')
+
+            for file_path, error in failed.items():
+                self.error_occurred.emit(file_path, error)
+            if failed:
+                self.status_updated.emit(
+                    f"Failed to process {len(failed)} files (e.g. '{os.path.basename(next(iter(failed)))}')",
+                    "error"
+                )
+
+            success_count = total_files - len(failed)
+            with self._lock:
+                for action, count in action_counts.items():
+                    self.stats[action] += count
+                self.stats['total_processed'] += success_count
+                self.stats['errors'] += len(failed)
+                self.stats['batches'] += 1
+                # ثبت زمان اتمام batch
+                self.stats['last_batch_time'] = datetime.now()
+                # رویدادهایی که حین این batch رسیده‌اند نباید تا رویداد بعدی در صف بمانند
+                if self._batch_queue:
+                    self._schedule_batch_locked()
+
+            self.progress_updated.emit(100, "Batch Processing")
+
+            # ارسال سیگنال اتمام batch
+            self.batch_completed.emit(success_count)
+            self.status_updated.emit(
+                f"Batch completed: {success_count}/{total_files} files processed successfully",
+                "success" if success_count == total_files else "warning"
+            )
 
     # ===== رویدادهای FileSystemEventHandler =====
 
@@ -206,69 +233,31 @@ class IsoIndexEventHandler(QObject, FileSystemEventHandler):
         """رویداد ایجاد فایل جدید"""
         if event.is_directory or not self._is_supported(event.src_path):
             return
-
-        def process():
-            if self._process_with_retry(self.dm.upsert_iso_index_entry, event.src_path):
-                self.stats['created'] += 1
-                self.stats['total_processed'] += 1
-                self.file_processed.emit(event.src_path, "created")
-                print(f"✅ File created and indexed: {event.src_path}")
-
-        self._debounce_event(event.src_path, 'created', process)
+        self._add_to_batch(event.src_path, 'created')
 
     def on_deleted(self, event):
         """رویداد حذف فایل"""
         if event.is_directory or not self._is_supported(event.src_path):
             return
-
-        def process():
-            if self._process_with_retry(self.dm.remove_iso_index_entry, event.src_path):
-                self.stats['deleted'] += 1
-                self.stats['total_processed'] += 1
-                self.file_processed.emit(event.src_path, "deleted")
-                print(f"🗑️ File deleted and removed from index: {event.src_path}")
-
-        self._debounce_event(event.src_path, 'deleted', process)
+        self._add_to_batch(event.src_path, 'deleted')
 
     def on_modified(self, event):
         """رویداد تغییر فایل"""
         if event.is_directory or not self._is_supported(event.src_path):
             return
-
-        def process():
-            if self._process_with_retry(self.dm.upsert_iso_index_entry, event.src_path):
-                self.stats['modified'] += 1
-                self.stats['total_processed'] += 1
-                self.file_processed.emit(event.src_path, "modified")
-                print(f"📝 File modified and re-indexed: {event.src_path}")
-
-        self._debounce_event(event.src_path, 'modified', process)
+        self._add_to_batch(event.src_path, 'modified')
 
     def on_moved(self, event):
         """رویداد انتقال/تغییر نام فایل"""
         if event.is_directory:
             return
 
-        src_supported = self._is_supported(event.src_path)
-        dest_supported = self._is_supported(event.dest_path)
-
-        if not src_supported and not dest_supported:
-            return
-
-        def process():
-            # حذف مسیر قدیمی (اگر پشتیبانی می‌شد)
-            if src_supported:
-                self._process_with_retry(self.dm.remove_iso_index_entry, event.src_path)
-
-            # افزودن مسیر جدید (اگر پشتیبانی می‌شود)
-            if dest_supported:
-                if self._process_with_retry(self.dm.upsert_iso_index_entry, event.dest_path):
-                    self.stats['moved'] += 1
-                    self.stats['total_processed'] += 1
-                    self.file_processed.emit(event.dest_path, "moved")
-                    print(f"📦 File moved: {event.src_path} → {event.dest_path}")
-
-        self._debounce_event(event.dest_path, 'moved', process)
+        # مسیر قدیمی (اگر پشتیبانی می‌شد) حذف و مسیر جدید (اگر پشتیبانی می‌شود) افزوده می‌شود؛
+        # وضعیت نهایی هر دو مسیر در زمان پردازش batch با stat مشخص می‌شود
+        if self._is_supported(event.src_path):
+            self._add_to_batch(event.src_path, 'deleted')
+        if self._is_supported(event.dest_path):
+            self._add_to_batch(event.dest_path, 'moved')
 
     # ===== متدهای کمکی و گزارش‌دهی =====
 
@@ -285,7 +274,6 @@ class IsoIndexEventHandler(QObject, FileSystemEventHandler):
             **self.stats,
             'uptime_seconds': uptime,
             'files_per_minute': (self.stats['total_processed'] / uptime * 60) if uptime > 0 else 0,
-            'pending_events': len(self._pending_events),
             'batch_queue_size': len(self._batch_queue),
             'error_rate': (self.stats['errors'] / self.stats['total_processed'] * 100)
             if self.stats['total_processed'] > 0 else 0
@@ -301,6 +289,7 @@ class IsoIndexEventHandler(QObject, FileSystemEventHandler):
                 'moved': 0,
                 'errors': 0,
                 'total_processed': 0,
+                'batches': 0,
                 'last_batch_time': None,
                 'start_time': datetime.now()
             }
@@ -312,21 +301,13 @@ class IsoIndexEventHandler(QObject, FileSystemEventHandler):
         (مفید برای زمان خاموش شدن برنامه)
         """
         with self._lock:
-            # لغو تمام تایمرها و اجرای فوری callback ها
-            for file_path, event_data in list(self._pending_events.items()):
-                timer = event_data.get('timer')
-                if timer and timer.is_alive():
-                    timer.cancel()
-                    # اینجا می‌توانید callback را مستقیماً فراخوانی کنید
-
-            self._pending_events.clear()
-
-            # پردازش batch معلق
+            # لغو تایمر batch معلق
             if self._batch_timer and self._batch_timer.is_alive():
                 self._batch_timer.cancel()
+            self._batch_timer = None
 
-            if self._batch_queue:
-                self._process_batch()
+        # پردازش batch معلق (خارج از قفل صف؛ _process_batch خودش قفل را می‌گیرد)
+        self._process_batch()
 
     def cleanup(self):
         """
@@ -334,6 +315,9 @@ class IsoIndexEventHandler(QObject, FileSystemEventHandler):
         باید قبل از بستن برنامه فراخوانی شود
         """
         self.flush_pending_events()
+        if self._stat_pool is not None:
+            self._stat_pool.shutdown(wait=False)
+            self._stat_pool = None
         self.status_updated.emit("ISO Event Handler cleaned up", "info")
 
     def __del__(self):
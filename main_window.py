@@ -5,6 +5,7 @@ import webbrowser
 import subprocess
 import os
 import logging
+import multiprocessing
 
 from functools import partial
 from PyQt6.QtWidgets import (
@@ -57,6 +58,9 @@ class MainWindow(QMainWindow):
 
         # --- مقداردهی اولیه متغیرها ---
         self.dm = DataManager()
+        # ایندکس‌های پیشنهاد شماره خط و نام فایل‌های ISO در پس‌زمینه بارگذاری می‌شوند تا جستجو از حافظه جواب دهد
+        self.dm.warm_line_suggestions()
+        self.dm.warm_iso_name_index()
         self.current_project: Project | None = None
         self.current_user = os.getlogin()
         self.suggestion_data = []
@@ -71,13 +75,13 @@ class MainWindow(QMainWindow):
 
         # تنظیمات برای iso_event_handler
         config = {
-            'debounce_delay': 1.0,
-            'batch_size': 50,
+            'batch_size': 500,
             'batch_delay': 2.0,
-            'max_retries': 3
+            'max_retries': 3,
+            'stat_workers': 8
         }
 
-        self.iso_event_handler = IsoIndexEventHandler(self.dm)
+        self.iso_event_handler = IsoIndexEventHandler(self.dm, config)
 
         # --- ایجاد نمونه از کامپوننت‌ها و هندلرها ---
         self.ui_components = UIComponents(self)
@@ -92,6 +96,12 @@ class MainWindow(QMainWindow):
         QApplication.instance().aboutToQuit.connect(self.cleanup_processes)
         self.start_iso_watcher()
 
+        # گزارش دوره‌ای وضعیت connection pool در کنسول
+        self.pool_stats_timer = QTimer(self)
+        self.pool_stats_timer.setInterval(5 * 60 * 1000)
+        self.pool_stats_timer.timeout.connect(self.log_pool_stats)
+        self.pool_stats_timer.start()
+
     def setup_menu(self):
         """راه‌اندازی منوی بالای پنجره"""
         menu_bar = self.menuBar()
@@ -133,6 +143,11 @@ class MainWindow(QMainWindow):
             lambda: self.event_handlers.handle_report_export('spool_consumption')
         )
 
+        # منوی Tools
+        tools_menu = menu_bar.addMenu("&Tools")
+        full_iso_rescan_action = tools_menu.addAction("🔄 Full ISO Index Rescan")
+        full_iso_rescan_action.triggered.connect(self.start_full_iso_rescan)
+
         # منوی Help
         help_menu = menu_bar.addMenu("&Help")
 
@@ -359,6 +374,14 @@ class MainWindow(QMainWindow):
             import traceback
             traceback.print_exc()
 
+    def log_pool_stats(self):
+        """نمایش خلاصه‌ی آمار connection pool در کنسول"""
+        stats = self.dm.get_pool_stats()
+        if not stats:
+            return
+        level = "warning" if stats['long_held_now'] or stats['wait_max_ms'] > 1000 else "info"
+        self.log_to_console(self.dm.format_pool_stats(), level)
+
     def log_to_console(self, message, level="info"):
         """نمایش پیام در کنسول با رنگ‌بندی"""
         color_map = {
@@ -454,6 +477,14 @@ class MainWindow(QMainWindow):
                 self.iso_observer.join()
                 print("ISO watcher stopped.")
 
+            # رویدادهای ISO باقی‌مانده در صف batch قبل از بستن دیتابیس نوشته می‌شوند
+            if getattr(self, 'iso_event_handler', None):
+                self.iso_event_handler.cleanup()
+
+            # نوشتن لاگ‌های باقی‌مانده در صف قبل از خروج
+            if getattr(self, 'dm', None):
+                self.dm.shutdown()
+
         except Exception as e:
             print(f"⚠️ خطا در بستن پروسه‌ها: {e}")
 
@@ -494,6 +525,22 @@ class MainWindow(QMainWindow):
         self.iso_observer.schedule(self.iso_event_handler, path, recursive=True)
         self.iso_observer.start()
 
+    def start_full_iso_rescan(self):
+        """اسکن کامل پوشه‌ی ISO به درخواست کاربر (بدون استفاده از امضای ذخیره‌شده‌ی پوشه‌ها)"""
+        path = ISO_PATH
+        if not os.path.isdir(path):
+            self.update_iso_status_label(f"مسیر یافت نشد!", "error")
+            return
+
+        self.update_iso_status_label("در حال اسکن کامل پوشه‌ی ISO...", "warning")
+
+        threading.Thread(
+            target=self.dm.rebuild_iso_index_from_scratch,
+            args=(path, self.iso_event_handler),
+            kwargs={'force_full': True},
+            daemon=True
+        ).start()
+
     def update_iso_progress(self, value, text):
         """به‌روزرسانی نوار پیشرفت ISO"""
         if not self.iso_progress_bar.isVisible():
@@ -508,6 +555,8 @@ class MainWindow(QMainWindow):
 
 
 if __name__ == "__main__":
+    # لازم برای process pool در نسخه‌ی فریزشده (PyInstaller) روی ویندوز
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
 
     # لاگین قبل از اسپلش
@@ -1,6 +1,7 @@
 # file: models.py
 
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float, Boolean, ForeignKey, UniqueConstraint, Index
+from sqlalchemy import create_engine, Column, Integer, String, Date, DateTime, Float, Boolean, ForeignKey, UniqueConstraint, Index, \
+    true
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime
 Base = declarative_base()
@@ -39,6 +40,8 @@ class MIVRecord(Base):
     # <<< ADDED: ایندکس ترکیبی برای جستجوهای متداول
     __table_args__ = (
         Index('ix_miv_records_project_line', 'project_id', 'line_no'),
+        # ترتیب و صفحه‌بندی keyset جستجوی MIV (search_miv)
+        Index('ix_miv_records_last_updated_id', 'last_updated', 'id'),
     )
 
 # -------------------------
@@ -62,6 +65,8 @@ class MTOItem(Base):
     quantity = Column(Float)
     joint = Column(Float)
     inch_dia = Column(Float)
+    # آیتمی که در ریویژن جدید MTO حذف شده ولی مصرف دارد غیرفعال (بازنشسته) می‌شود تا تاریخچه مصرف بماند
+    is_active = Column(Boolean, default=True, server_default=true(), nullable=False)
 
     project = relationship("Project", back_populates="mto_items")
 
@@ -92,6 +97,61 @@ class MTOProgress(Base):
 
 
 
+# -------------------------
+# جداول خلاصه پیشرفت (پیش‌تجمیع شده از mto_progress؛ با هر ثبت/ویرایش/حذف MIV و بعد از ایمپورت به‌روز می‌شوند)
+# -------------------------
+class LineProgressSummary(Base):
+    __tablename__ = 'line_progress_summary'
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, ForeignKey('projects.id'), nullable=False)
+    line_no = Column(String, nullable=False)
+    item_count = Column(Integer, default=0)         # تعداد آیتم‌های MTO خط
+    tracked_items = Column(Integer, default=0)      # تعداد ردیف‌های mto_progress خط
+    total_inch_dia = Column(Float, default=0)
+    used_inch_dia = Column(Float, default=0)
+    last_activity = Column(DateTime)                # آخرین last_updated رکوردهای MIV خط
+    is_complete = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint('project_id', 'line_no', name='uq_line_progress_summary'),
+    )
+
+
+class ProjectProgressSummary(Base):
+    __tablename__ = 'project_progress_summary'
+    project_id = Column(Integer, ForeignKey('projects.id'), primary_key=True)
+    total_lines = Column(Integer, default=0)        # خطوطی که ردیف mto_progress دارند
+    completed_lines = Column(Integer, default=0)
+    item_count = Column(Integer, default=0)
+    total_inch_dia = Column(Float, default=0)
+    used_inch_dia = Column(Float, default=0)
+    last_activity = Column(DateTime)
+    is_complete = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=datetime.now)
+
+
+# -------------------------
+# جدول تجمیع روزانه مصرف (برای نمودارهای زمانی؛ همراه جداول خلاصه پیشرفت به‌روز می‌شود)
+# -------------------------
+class DailyConsumptionRollup(Base):
+    __tablename__ = 'daily_consumption_rollup'
+    id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, ForeignKey('projects.id'), nullable=False)
+    line_no = Column(String, nullable=False)
+    day = Column(Date, nullable=False)
+    mto_qty = Column(Float, default=0)              # جمع مصرف مستقیم MTO (واحد آیتم)
+    spool_qty = Column(Float, default=0)            # جمع مصرف از اسپول (متر یا عدد)
+    inch_dia = Column(Float, default=0)             # inch-dia مصرف مستقیم MTO
+    miv_count = Column(Integer, default=0)          # تعداد MIVهایی که در آن روز مصرف داشته‌اند
+    updated_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint('project_id', 'line_no', 'day', name='uq_daily_consumption_rollup'),
+        Index('ix_daily_consumption_rollup_project_day', 'project_id', 'day'),
+    )
+
+
 # -------------------------
 # جدول MTO Consumption
 # -------------------------
@@ -139,6 +199,13 @@ class Spool(Base):
     sheet_no = Column(Integer)
     location = Column(String)
     command = Column(String)
+    # امضای آیتم‌های این اسپول در آخرین فایل merge‌شده (برای رد شدن از اسپول‌های بدون تغییر)
+    items_signature = Column(String)
+
+    # مرتب‌سازی/صفحه‌بندی گزارش موجودی بر اساس محل
+    __table_args__ = (
+        Index('ix_spools_location', 'location'),
+    )
 
     # تعریف رابطه: هر اسپول می‌تواند چندین آیتم داشته باشد
     items = relationship("SpoolItem", back_populates="spool", cascade="all, delete-orphan")
@@ -166,6 +233,12 @@ class SpoolItem(Base):
     qty_available = Column(Float)
     item_code = Column(String)
 
+    # مرتب‌سازی/صفحه‌بندی گزارش موجودی بر اساس نوع و سایز
+    __table_args__ = (
+        Index('ix_spool_items_component_bore', 'component_type', 'p1_bore'),
+        Index('ix_spool_items_spool_fk', 'spool_id_fk'),
+    )
+
     # تعریف رابطه: هر آیتم متعلق به یک اسپول است
     spool = relationship("Spool", back_populates="items")
     # تعریف رابطه: هر آیتم اسپول می‌تواند در چندین رکورد مصرف ثبت شود
@@ -214,4 +287,18 @@ class IsoFileIndex(Base):
     file_path = Column(String, unique=True, nullable=False)
     normalized_name = Column(String, index=True) # ایندکس برای جستجوی سریع
     prefix_key = Column(String, index=True) # ایندکس برای جستجوی سریع
-    last_modified = Column(DateTime)
\ No newline at end of file
+    last_modified = Column(DateTime)
+
+
+# -------------------------
+# امضای پوشه‌های ISO (mtime و تعداد ورودی‌ها) برای اسکن افزایشی؛
+# پوشه‌ای که mtime آن عوض نشده دوباره لیست نمی‌شود و فقط زیرپوشه‌های ثبت‌شده‌اش بررسی می‌شوند
+# -------------------------
+class IsoDirectorySignature(Base):
+    __tablename__ = 'iso_directory_signatures'
+    id = Column(Integer, primary_key=True)
+    dir_path = Column(String, unique=True, nullable=False)
+    parent_path = Column(String, index=True)       # برای پوشه‌ی ریشه‌ی اسکن NULL است
+    mtime = Column(Float, nullable=False)          # st_mtime پوشه در زمان آخرین لیست کردن
+    entry_count = Column(Integer, default=0)       # تعداد کل ورودی‌های پوشه در آخرین لیست کردن
+    scanned_at = Column(DateTime, default=datetime.now)
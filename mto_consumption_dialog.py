@@ -62,7 +62,7 @@ class MTOConsumptionDialog(QDialog):
         layout.addWidget(self.buttons)
 
     def populate_table(self):
-        self.progress_data = self.dm.get_enriched_line_progress(self.project_id, self.line_no, readonly=False)
+        self.progress_data = self.dm.get_enriched_line_progress(self.project_id, self.line_no)
         self.table.setRowCount(len(self.progress_data))
 
         for row_idx, item in enumerate(self.progress_data):
@@ -0,0 +1,578 @@
+# file: ngram_index.py
+
+import bisect
+import difflib
+import heapq
+import re
+import threading
+import time
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+
+
+class NGramIndex:
+    """
+    ایندکس n-gram درون‌حافظه‌ای برای جستجوی زیررشته (معادل pg_trgm در حالت SQLite).
+    هر مقدار متمایز یک شناسه عددی می‌گیرد و برای هر سه‌حرفی (trigram) لیست مرتب شناسه‌ها نگه داشته می‌شود؛
+    جستجو اشتراک کوتاه‌ترین لیست‌ها را گرفته و در پایان زیررشته بودن را روی خود مقدار بررسی می‌کند.
+    """
+
+    N = 3
+
+    def __init__(self):
+        self._values: List[str] = []  # value_id -> مقدار اصلی
+        self._folded: List[str] = []  # value_id -> مقدار با حروف کوچک
+        self._ids: Dict[str, int] = {}  # مقدار -> value_id
+        self._postings: Dict[str, array] = {}  # trigram -> value_idهای مرتب
+
+    def __len__(self):
+        return len(self._values)
+
+    @classmethod
+    def _grams(cls, text: str) -> Set[str]:
+        return {text[i:i + cls.N] for i in range(len(text) - cls.N + 1)}
+
+    def add(self, value: Optional[str]):
+        """افزودن یک مقدار (تکراری‌ها نادیده گرفته می‌شوند)."""
+        if not value or value in self._ids:
+            return
+        value_id = len(self._values)
+        folded = value.lower()
+        self._ids[value] = value_id
+        self._values.append(value)
+        self._folded.append(folded)
+        for gram in self._grams(folded):
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array('I')
+            postings.append(value_id)
+
+    def search(self, term: str, limit: Optional[int] = None) -> Optional[List[str]]:
+        """
+        مقادیری که term (بدون حساسیت به حروف) زیررشته‌ی آن‌هاست.
+        برای term کوتاه‌تر از N حرف None برمی‌گردد (ایندکس کمکی نمی‌کند و باید از LIKE استفاده شود).
+        اگر تعداد نتایج از limit بیشتر شود هم None برمی‌گردد.
+        """
+        folded = (term or "").lower()
+        if len(folded) < self.N:
+            return None
+
+        grams = sorted(self._grams(folded), key=lambda g: len(self._postings.get(g, ())))
+        first = self._postings.get(grams[0])
+        if not first:
+            return []
+        candidates = set(first)
+        for gram in grams[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(self._postings.get(gram, ()))
+
+        matches = []
+        for value_id in sorted(candidates):
+            if folded in self._folded[value_id]:
+                matches.append(self._values[value_id])
+                if limit is not None and len(matches) > limit:
+                    return None
+        return matches
+
+
+class ColumnNGramIndex:
+    """
+    NGramIndex یک ستون از یک جدول که از دیتابیس پر و به‌روز نگه داشته می‌شود.
+    - بعد از INSERT روی جدول فقط ردیف‌های جدید (id بزرگ‌تر از آخرین id خوانده‌شده) اضافه می‌شوند.
+    - بعد از UPDATE/DELETE ایندکس در جستجوی بعدی از نو ساخته می‌شود.
+    """
+
+    def __init__(self, id_column, value_column):
+        self.id_column = id_column
+        self.value_column = value_column
+        self.table_name = value_column.table.name
+        self._lock = threading.Lock()
+        self._index = None
+        self._last_id = 0
+        self._needs_tail = False
+
+    def mark_inserted(self):
+        self._needs_tail = True
+
+    def mark_changed(self):
+        self._index = None
+
+    def _load(self, session, after_id=0):
+        rows = session.execute(
+            select(self.id_column, self.value_column)
+            .where(self.id_column > after_id)
+            .order_by(self.id_column)
+        )
+        for row_id, value in rows:
+            self._index.add(value)
+            self._last_id = row_id
+
+    def search(self, session, term: str, limit: Optional[int] = None) -> Optional[List[str]]:
+        with self._lock:
+            if self._index is None:
+                self._index = NGramIndex()
+                self._last_id = 0
+                self._needs_tail = False
+                self._load(session)
+            elif self._needs_tail:
+                self._needs_tail = False
+                self._load(session, self._last_id)
+            return self._index.search(term, limit)
+
+
+_NON_ALNUM_RE = re.compile(r"[^0-9A-Z]")
+
+
+def normalize_line_key(text: Optional[str]) -> str:
+    """کلید نرمال‌شده شماره خط: حروف بزرگ بدون فاصله و علائم (مثلاً '10"-P-001' -> '10P001')."""
+    return _NON_ALNUM_RE.sub("", (text or "").upper())
+
+
+class LineSuggestionIndex:
+    """
+    ایندکس درون‌حافظه‌ای پیشنهاد شماره خط (autocomplete) در همه پروژه‌ها.
+    - پیشوند: لیست مرتب کلیدهای نرمال‌شده و bisect (بازه‌ی کلیدهای هم‌پیشوند، معادل پیمایش trie).
+    - زیررشته: آرایه‌ی مرتب پسوندهای کلیدها (suffix array)؛ هر عضو (شناسه کلید << 6 | محل شروع) است.
+    هر دو جستجو یک bisect و خواندن حداکثر limit عضو است. نتایج پیشوندی اول می‌آیند.
+    """
+
+    MAX_SUFFIX_START = 63  # پسوندهایی که بعد از این محل شروع می‌شوند ایندکس نمی‌شوند
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ready = False
+        self._reset()
+
+    def _reset(self):
+        self._keys: List[str] = []  # کلیدهای زنده‌ی مرتب
+        self._entries: Dict[str, Dict[Tuple[int, str], str]] = {}  # کلید -> {(project_id, line_no): project_name}
+        self._project_keys: Dict[int, Set[str]] = defaultdict(set)
+        self._key_ids: Dict[str, int] = {}  # هر کلیدی که تا به حال دیده شده -> شناسه (فقط اضافه می‌شود)
+        self._key_by_id: List[str] = []
+        self._suffixes = array('Q')
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _suffix_text(self, code: int) -> str:
+        return self._key_by_id[code >> 6][code & 63:]
+
+    def _add(self, line_no, project_id, project_name, new_suffixes):
+        key = normalize_line_key(line_no)
+        if not key:
+            return
+        entries = self._entries.get(key)
+        if entries is None:
+            entries = self._entries[key] = {}
+            bisect.insort(self._keys, key)
+            if key not in self._key_ids:
+                key_id = self._key_ids[key] = len(self._key_by_id)
+                self._key_by_id.append(key)
+                new_suffixes.extend((key_id << 6) | start for start in range(min(len(key), self.MAX_SUFFIX_START + 1)))
+        entries[(project_id, line_no)] = project_name
+        self._project_keys[project_id].add(key)
+
+    def _merge_suffixes(self, new_suffixes):
+        if not new_suffixes:
+            return
+        new_suffixes.sort(key=self._suffix_text)
+        if self._suffixes:
+            new_suffixes = heapq.merge(self._suffixes, new_suffixes, key=self._suffix_text)
+        self._suffixes = array('Q', new_suffixes)
+
+    def _remove_project(self, project_id):
+        for key in self._project_keys.pop(project_id, ()):
+            entries = self._entries[key]
+            for entry in [e for e in entries if e[0] == project_id]:
+                del entries[entry]
+            if not entries:
+                # پسوندهای کلید حذف نمی‌شوند؛ در جستجو با نبودن در _entries کنار گذاشته می‌شوند
+                del self._entries[key]
+                del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def load(self, rows: Iterable[Tuple[str, int, str]]):
+        """بارگذاری کامل از (line_no, project_id, project_name)."""
+        with self._lock:
+            self._reset()
+            new_suffixes = []
+            for line_no, project_id, project_name in rows:
+                self._add(line_no, project_id, project_name, new_suffixes)
+            self._merge_suffixes(new_suffixes)
+            self.ready = True
+
+    def replace_project(self, project_id: int, rows: Iterable[Tuple[str, int, str]]):
+        """جایگزینی خطوط یک پروژه (بعد از ایمپورت MTO یا تغییر نام پروژه)."""
+        with self._lock:
+            self._remove_project(project_id)
+            new_suffixes = []
+            for line_no, row_project_id, project_name in rows:
+                self._add(line_no, row_project_id, project_name, new_suffixes)
+            self._merge_suffixes(new_suffixes)
+
+    def search(self, term: str, limit: int = 15) -> List[Tuple[str, int, str]]:
+        """تا limit پیشنهاد به صورت (line_no, project_id, project_name)."""
+        folded = normalize_line_key(term)
+        if not folded or limit <= 0:
+            return []
+        size = len(folded)
+
+        with self._lock:
+            ranked = []
+            keys = self._keys
+            position = bisect.bisect_left(keys, folded)
+            while position < len(keys) and len(ranked) < limit and keys[position].startswith(folded):
+                ranked.append(keys[position])
+                position += 1
+
+            if len(ranked) < limit:
+                seen = set(ranked)
+                suffixes = self._suffixes
+                position = bisect.bisect_left(suffixes, folded, key=lambda c: self._suffix_text(c)[:size])
+                while position < len(suffixes) and len(ranked) < limit:
+                    code = suffixes[position]
+                    if not self._suffix_text(code).startswith(folded):
+                        break
+                    key = self._key_by_id[code >> 6]
+                    if key not in seen and key in self._entries:
+                        seen.add(key)
+                        ranked.append(key)
+                    position += 1
+
+            results = []
+            for key in ranked:
+                for (project_id, line_no), project_name in sorted(self._entries[key].items(),
+                                                                  key=lambda e: (e[0][1], e[1])):
+                    results.append((line_no, project_id, project_name))
+            return results[:limit]
+
+
+def _popcount64(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8)).reshape(len(values), 64).sum(axis=1)
+
+
+def lcs_lengths(query_codes: np.ndarray, codes: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    طول LCS ورودی (حداکثر ۶۴ کاراکتر) با هر سطر codes، هم‌زمان برای همه سطرها.
+    الگوریتم بیت‌موازی Hyyrö: برای هر ستون codes چند عمل برداری روی یک کلمه ۶۴ بیتی به ازای هر سطر.
+    codes: ماتریس کد کاراکترها (سطرهای کوتاه‌تر با هر مقداری پر شده‌اند)، lengths: طول واقعی هر سطر.
+    """
+    size = len(query_codes)
+    # Peq: برای هر کاراکتر سطرها، بیت‌های جاهایی از ورودی که همان کاراکتر هستند
+    alphabet, inverse = np.unique(query_codes, return_inverse=True)
+    masks = np.zeros(len(alphabet), dtype=np.uint64)
+    np.bitwise_or.at(masks, inverse, np.left_shift(np.uint64(1), np.arange(size, dtype=np.uint64)))
+    positions = np.minimum(np.searchsorted(alphabet, codes), len(alphabet) - 1)
+    peq = np.where(alphabet[positions] == codes, masks[positions], np.uint64(0))
+
+    full = np.uint64((1 << size) - 1)
+    v = np.full(len(codes), full, dtype=np.uint64)
+    for column in range(codes.shape[1]):
+        u = v & peq[:, column]
+        # سرریز جمع بیت‌های بالاتر از size را تغییر می‌دهد که با full حذف می‌شوند
+        updated = ((v + u) | (v - u)) & full
+        v = np.where(column < lengths, updated, v)
+    return size - _popcount64(v)
+
+
+class FuzzyLineMatcher:
+    """
+    تطبیق فازی شماره خط‌های یک پروژه (جایگزین حلقه difflib در suggest_line_no).
+    امتیاز هر خط همان SequenceMatcher.ratio است؛ 2 * LCS / (طول ورودی + طول خط) سقف آن است و فقط برای هرس استفاده می‌شود.
+    - فیلتر طول: خط‌هایی که حتی با LCS کامل به min_score نمی‌رسند کنار گذاشته می‌شوند.
+    - LCS با lcs_lengths (بیت‌موازی، numpy) هم‌زمان برای همه خط‌ها محاسبه می‌شود.
+    - ratio به ترتیب نزولی سقف محاسبه می‌شود تا وقتی سقف خط بعدی از top_k امین امتیاز کمتر شود.
+    """
+
+    MAX_QUERY_LENGTH = 64  # طول ورودی باید در یک کلمه ۶۴ بیتی جا شود
+
+    def __init__(self, lines: Iterable[str]):
+        self.lines = [line for line in dict.fromkeys(lines) if line]
+        keys = [self.normalize(line) for line in self.lines]
+        self._keys = keys
+        self._lengths = np.array([len(key) for key in keys], dtype=np.int64)
+        width = int(self._lengths.max()) if keys else 0
+        self._codes = np.zeros((len(keys), width), dtype=np.uint32)
+        for row, key in enumerate(keys):
+            self._codes[row, :len(key)] = np.frombuffer(key.encode("utf-32-le"), dtype=np.uint32)
+
+    @staticmethod
+    def normalize(text) -> str:
+        return str(text).replace(" ", "").lower()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def search(self, text, top_k: int = 5, min_score: float = 0.6) -> List[Tuple[str, float]]:
+        """تا top_k خط با امتیاز حداقل min_score به صورت (line_no, score) از بیشترین امتیاز."""
+        query = self.normalize(text)
+        size = len(query)
+        if not size or not self.lines or top_k <= 0:
+            return []
+        if size > self.MAX_QUERY_LENGTH:
+            return self._top(query, np.arange(len(self._keys)), np.ones(len(self._keys)), top_k, min_score)
+
+        lengths = self._lengths
+        # سقف امتیاز با LCS = min(طول‌ها)
+        rows = np.nonzero(2 * np.minimum(size, lengths) >= min_score * (size + lengths))[0]
+        if not len(rows):
+            return []
+        lengths = lengths[rows]
+        codes = self._codes[rows, :int(lengths.max())]
+
+        query_codes = np.frombuffer(query.encode("utf-32-le"), dtype=np.uint32)
+        lcs = lcs_lengths(query_codes, codes, lengths)
+        return self._top(query, rows, 2.0 * lcs / (size + lengths), top_k, min_score)
+
+    def _top(self, query, rows, bounds, top_k, min_score):
+        """top_k خط با بیشترین ratio؛ bounds سقف ratio هر سطر است."""
+        keep = np.nonzero(bounds >= min_score)[0]
+        keep = keep[np.argsort(-bounds[keep], kind="stable")]
+        found = []
+        kth = []  # heap کمینه‌ی top_k بهترین ratio تا اینجا
+        for i in keep.tolist():
+            if len(kth) == top_k and bounds[i] < kth[0]:
+                break
+            ratio = difflib.SequenceMatcher(None, query, self._keys[rows[i]]).ratio()
+            if ratio < min_score:
+                continue
+            found.append((ratio, i))
+            if len(kth) < top_k:
+                heapq.heappush(kth, ratio)
+            elif ratio > kth[0]:
+                heapq.heapreplace(kth, ratio)
+        ranked = sorted(found, key=lambda item: (-item[0], self.lines[rows[item[1]]]))[:top_k]
+        return [(self.lines[rows[i]], round(ratio, 4)) for ratio, i in ranked]
+
+
+# نگاشت بایت به نماد سه‌حرفی‌های نام ISO: ارقام 0-9، حروف 10-35، بقیه 36
+_ISO_SYMBOLS = np.full(256, 36, dtype=np.int64)
+_ISO_SYMBOLS[48:58] = np.arange(10)
+_ISO_SYMBOLS[65:91] = np.arange(10, 36)
+_ISO_GRAM_SPACE = 37 ** 3
+
+
+class IsoNameIndex:
+    """
+    ایندکس درون‌حافظه‌ای نام فایل‌های ISO (جدول iso_file_index) برای find_iso_files.
+    - کاندیداها: posting list سه‌حرفی‌های normalized_name (شمارش سه‌حرفی‌های مشترک با np.bincount)
+      به‌علاوه‌ی فایل‌هایی که prefix_key آن‌ها با ورودی یکی است؛ چند غلط تایپی هم کاندیدا را حذف نمی‌کند.
+      posting listهای بارگذاری کامل به صورت CSR (numpy) و یکجا ساخته می‌شوند؛ ردیف‌های بعدی در _delta می‌روند.
+    - امتیاز: LCS برداری (lcs_lengths) بین ورودی و نام هر کاندیدا.
+    - همگام‌سازی: بارگذاری کامل در اولین جستجو؛ تغییرات همین برنامه با add/discard/invalidate اعمال می‌شوند و
+      هر sync_interval ثانیه (count, max(id)) جدول بررسی می‌شود تا تغییرات کلاینت‌های دیگر هم دیده شوند.
+    """
+
+    N = 3
+    MIN_SHARED_GRAMS = 0.4  # حداقل نسبت سه‌حرفی‌های مشترک برای کاندیدا شدن
+    MAX_CANDIDATES = 5000
+    MIN_COVERAGE = 0.75  # حداقل نسبت کاراکترهای ورودی که (به ترتیب) در نام فایل پیدا می‌شوند
+
+    def __init__(self, model, sync_interval: float = 30.0):
+        self.model = model
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self._paths: List[Optional[str]] = []  # slot -> file_path (None برای حذف‌شده‌ها)
+        self._names: List[str] = []
+        self._prefixes: List[str] = []
+        self._slots: Dict[str, int] = {}  # file_path -> slot
+        self._offsets = np.zeros(_ISO_GRAM_SPACE + 1, dtype=np.int64)  # CSR: کد سه‌حرفی -> بازه در _base
+        self._base = np.zeros(0, dtype=np.uint32)
+        self._delta: Dict[int, array] = {}  # کد سه‌حرفی -> slotهای اضافه‌شده بعد از بارگذاری کامل
+        self._by_prefix: Dict[str, List[int]] = defaultdict(list)
+        self._live = 0
+        self._last_id = 0
+        self._checked_at = 0.0
+
+    def __len__(self):
+        return self._live
+
+    @classmethod
+    def _gram_codes(cls, name: str) -> Set[int]:
+        symbols = _ISO_SYMBOLS[np.frombuffer(name.encode("latin-1", "replace"), dtype=np.uint8)]
+        if len(symbols) < cls.N:
+            return set()
+        return set((symbols[:-2] * 1369 + symbols[1:-1] * 37 + symbols[2:]).tolist())
+
+    def invalidate(self):
+        """بارگذاری کامل در جستجوی بعدی (مثلاً بعد از بازسازی ایندکس ISO)."""
+        with self._lock:
+            self._loaded = False
+
+    def add(self, file_path: str, normalized_name: str, prefix_key: str):
+        with self._lock:
+            if self._loaded:
+                self._add(file_path, normalized_name, prefix_key)
+
+    def discard(self, file_path: str):
+        with self._lock:
+            slot = self._slots.pop(file_path, None)
+            if slot is not None:
+                # slot در posting listها می‌ماند و هنگام جستجو کنار گذاشته می‌شود
+                self._paths[slot] = None
+                self._live -= 1
+
+    def _append(self, file_path, normalized_name, prefix_key) -> Optional[int]:
+        if file_path in self._slots:
+            return None
+        slot = len(self._paths)
+        self._slots[file_path] = slot
+        self._paths.append(file_path)
+        self._names.append(normalized_name or "")
+        self._prefixes.append(prefix_key or "")
+        self._live += 1
+        if prefix_key:
+            self._by_prefix[prefix_key].append(slot)
+        return slot
+
+    def _add(self, file_path, normalized_name, prefix_key):
+        slot = self._append(file_path, normalized_name, prefix_key)
+        if slot is None:
+            return
+        for code in self._gram_codes(normalized_name or ""):
+            postings = self._delta.get(code)
+            if postings is None:
+                postings = self._delta[code] = array('I')
+            postings.append(slot)
+
+    def _build_base(self):
+        """ساخت یکجای posting listهای CSR برای همه slotهای فعلی."""
+        names = self._names
+        if not names:
+            return
+        lengths = np.array([len(name) for name in names], dtype=np.int64)
+        width = int(lengths.max())
+        if width < self.N:
+            return
+        packed = np.array(names, dtype=f"S{width}").view(np.uint8).reshape(len(names), width)
+        symbols = _ISO_SYMBOLS[packed]
+        slot_ids = np.arange(len(names), dtype=np.int64)
+        pairs = []
+        for start in range(width - self.N + 1):
+            valid = lengths >= start + self.N
+            codes = symbols[valid, start] * 1369 + symbols[valid, start + 1] * 37 + symbols[valid, start + 2]
+            pairs.append(codes * len(names) + slot_ids[valid])
+        # مرتب بر اساس (کد سه‌حرفی، slot) و بدون تکرار یک سه‌حرفی در یک نام
+        pairs = np.concatenate(pairs)
+        pairs.sort()
+        pairs = pairs[np.concatenate(([True], pairs[1:] != pairs[:-1]))]
+        codes, slots = np.divmod(pairs, len(names))
+        self._base = slots.astype(np.uint32)
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=_ISO_GRAM_SPACE))))
+
+    def _load(self, session, after_id=0):
+        model = self.model
+        rows = session.execute(
+            select(model.id, model.file_path, model.normalized_name, model.prefix_key)
+            .where(model.id > after_id)
+            .order_by(model.id)
+        ).all()
+        if not rows:
+            return
+        self._last_id = rows[-1][0]
+        if after_id:
+            for _, file_path, normalized_name, prefix_key in rows:
+                self._add(file_path, normalized_name, prefix_key)
+            return
+
+        # بارگذاری کامل روی ایندکس خالی (file_path در جدول یکتاست)
+        self._paths = [row[1] for row in rows]
+        self._names = [row[2] or "" for row in rows]
+        self._prefixes = [row[3] or "" for row in rows]
+        self._slots = {file_path: slot for slot, file_path in enumerate(self._paths)}
+        for slot, prefix_key in enumerate(self._prefixes):
+            if prefix_key:
+                self._by_prefix[prefix_key].append(slot)
+        self._live = len(rows)
+        self._build_base()
+
+    def warm(self, session):
+        """بارگذاری ایندکس (در صورت نیاز) بدون جستجو؛ برای اجرا در پس‌زمینه هنگام شروع برنامه."""
+        with self._lock:
+            self._sync(session)
+
+    def _sync(self, session):
+        now = time.monotonic()
+        if not self._loaded:
+            self._reset()
+            self._load(session)
+            self._loaded = True
+            self._checked_at = now
+            return
+        if now - self._checked_at < self.sync_interval:
+            return
+        self._checked_at = now
+        count, max_id = session.execute(select(func.count(), func.max(self.model.id))).one()
+        if max_id and max_id > self._last_id:
+            self._load(session, self._last_id)
+        if count != self._live:
+            # حذف یا تغییر توسط کلاینت دیگر؛ بارگذاری کامل
+            self._reset()
+            self._load(session)
+
+    def search(self, session, normalized_query: str, prefix_key: str = "", limit: int = 200) -> List[Tuple[str, float]]:
+        """تا limit فایل به صورت (file_path, score) از بیشترین امتیاز."""
+        query = normalized_query or ""
+        size = len(query)
+        if not size:
+            return []
+
+        with self._lock:
+            self._sync(session)
+            slots = self._candidates(query, prefix_key)
+            if not len(slots):
+                return []
+            # مسیرها همین‌جا برداشته می‌شوند؛ بعد از آزاد شدن قفل، بارگذاری مجدد می‌تواند slotها را عوض کند
+            paths = [self._paths[slot] for slot in slots]
+            names = [self._names[slot] for slot in slots]
+            same_prefix = np.array([self._prefixes[slot] == prefix_key for slot in slots]) if prefix_key else False
+
+        lengths = np.array([len(name) for name in names], dtype=np.int64)
+        packed = np.array(names, dtype=f"S{max(int(lengths.max()), 1)}")
+        contains = np.char.find(packed, query.encode()) >= 0
+        if size <= 64:
+            codes = packed.view(np.uint8).reshape(len(names), -1)
+            lcs = lcs_lengths(np.frombuffer(query.encode(), dtype=np.uint8), codes, lengths)
+        else:
+            lcs = np.array([sum(block.size for block in
+                                difflib.SequenceMatcher(None, query, name).get_matching_blocks()) for name in names])
+        coverage = lcs / size
+        ratio = 2.0 * lcs / (size + lengths)
+        scores = 0.6 * coverage + 0.4 * ratio + 0.1 * contains + 0.05 * same_prefix
+
+        keep = np.nonzero((coverage >= self.MIN_COVERAGE) | contains)[0]
+        if len(keep) > limit:
+            keep = keep[np.argpartition(-scores[keep], limit - 1)[:limit]]
+        results = [(paths[i], round(float(scores[i]), 4)) for i in keep]
+        return sorted(results, key=lambda r: (-r[1], r[0]))
+
+    def _candidates(self, query, prefix_key) -> np.ndarray:
+        """slotهای زنده‌ای که ارزش امتیازدهی دارند."""
+        grams = self._gram_codes(query)
+        if grams:
+            lists = []
+            for code in grams:
+                lists.append(self._base[self._offsets[code]:self._offsets[code + 1]])
+                if code in self._delta:
+                    lists.append(np.array(self._delta[code], dtype=np.uint32))
+            counts = np.bincount(np.concatenate(lists), minlength=len(self._paths))
+            needed = max(1, int(np.ceil(len(grams) * self.MIN_SHARED_GRAMS)))
+            slots = np.nonzero(counts >= needed)[0]
+            if len(slots) > self.MAX_CANDIDATES:
+                slots = slots[np.argpartition(-counts[slots], self.MAX_CANDIDATES - 1)[:self.MAX_CANDIDATES]]
+        else:
+            # ورودی کوتاه‌تر از یک سه‌حرفی: جستجوی زیررشته ساده
+            slots = np.array([slot for slot, name in enumerate(self._names) if query in name], dtype=np.int64)
+        if prefix_key and prefix_key in self._by_prefix:
+            slots = np.union1d(slots, np.array(self._by_prefix[prefix_key], dtype=np.int64))
+        return np.array([slot for slot in slots.tolist() if self._paths[slot] is not None], dtype=np.int64)
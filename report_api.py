@@ -1,5 +1,6 @@
 # file: report_api.py
 import os
+import atexit
 import logging
 from flask import Flask, jsonify, request, make_response
 from flask_cors import CORS
@@ -47,6 +48,13 @@ def get_data_manager(force_reinit: bool = False):
         return None
 
 
+@atexit.register
+def shutdown_data_manager():
+    """هنگام خاموش شدن سرویس، لاگ‌های در صف DataManager نوشته می‌شوند."""
+    if _dm_instance is not None:
+        _dm_instance.shutdown()
+
+
 # ---------- Utility helpers ----------
 def bad_request(message: str, status_code: int = 400):
     return make_response(jsonify({"error": message}), status_code)
@@ -223,10 +231,14 @@ def get_spool_inventory_report():
             'sort_order': request.args.get('sort_order', default='asc', type=str),
             'page': request.args.get('page', default=1, type=int),
             'per_page': request.args.get('per_page', default=20, type=int),
+            'cursor': request.args.get('cursor', type=str),
+            'count': request.args.get('count', default='estimate', type=str),
         }
         active_filters = {k: v for k, v in filters.items() if v is not None}
         data = dm.get_spool_inventory_report(**active_filters)
         return jsonify(data)
+    except ValueError as e:
+        return bad_request(str(e), 400)
     except Exception as e:
         logger.exception("get_spool_inventory_report failed: %s", e)
         return internal_error(str(e))
@@ -239,8 +251,13 @@ def get_analytics_report(report_name):
         return internal_error("Database not available")
 
     project_id = request.args.get("project_id", type=int)
-    # می‌توانید پارامترهای زمان/فیلتر را از querystring بگیرید و به dm پاس دهید:
-    params = {}
+    # پارامترهای زمان/فیلتر از querystring (مثلاً برای consumption_over_time)
+    params = {
+        'line_no': request.args.get('line_no', type=str),
+        'start_date': request.args.get('start_date', type=str),
+        'end_date': request.args.get('end_date', type=str),
+    }
+    params = {k: v for k, v in params.items() if v}
     try:
         data = dm.get_report_analytics(project_id, report_name, **params)
         if isinstance(data, tuple) and data and data[0].get("error"):
@@ -253,6 +270,66 @@ def get_analytics_report(report_name):
         return internal_error(str(e))
 
 
+@app.route("/api/reports/daily-consumption")
+def get_daily_consumption_report():
+    """سری زمانی روزانه مصرف (MTO، اسپول، inch-dia و تعداد MIV) از جدول تجمیع روزانه."""
+    dm = get_data_manager()
+    if not dm:
+        return internal_error("Database not available")
+
+    project_id = request.args.get("project_id", type=int)
+    line_no = request.args.get("line_no", default=None, type=str)
+    start_date = request.args.get("start_date", default=None, type=str)
+    end_date = request.args.get("end_date", default=None, type=str)
+
+    try:
+        data = dm.get_daily_consumption(project_id, line_no=line_no, start_date=start_date, end_date=end_date)
+        return jsonify(data)
+    except ValueError as e:
+        return bad_request(f"Invalid date: {e}", 400)
+    except Exception as e:
+        logger.exception("get_daily_consumption_report failed for project_id=%s: %s", project_id, e)
+        return internal_error(str(e))
+
+
+@app.route("/api/miv/search")
+def search_miv_records():
+    """جستجوی ترکیبی MIV با صفحه‌بندی keyset؛ صفحه بعد با پارامتر cursor (مقدار next_cursor پاسخ قبلی)."""
+    dm = get_data_manager()
+    if not dm:
+        return internal_error("Database not available")
+
+    is_complete = request.args.get("is_complete", default=None, type=str)
+    if is_complete is not None:
+        if is_complete.lower() not in ("true", "false", "1", "0"):
+            return bad_request("is_complete must be true or false", 400)
+        is_complete = is_complete.lower() in ("true", "1")
+
+    criteria = {
+        'tag': request.args.get('tag', type=str),
+        'registered_for': request.args.get('registered_for', type=str),
+        'registered_by': request.args.get('registered_by', type=str),
+        'start_date': request.args.get('start_date', type=str),
+        'end_date': request.args.get('end_date', type=str),
+        'is_complete': is_complete,
+        'project_id': request.args.get('project_id', type=int),
+        'line_no': request.args.get('line_no', type=str),
+    }
+
+    try:
+        data = dm.search_miv(
+            limit=request.args.get('limit', default=200, type=int),
+            cursor=request.args.get('cursor', default=None, type=str),
+            **criteria
+        )
+        return jsonify(data)
+    except ValueError as e:
+        return bad_request(str(e), 400)
+    except Exception as e:
+        logger.exception("search_miv_records failed: %s", e)
+        return internal_error(str(e))
+
+
 @app.route("/api/reports/spool-consumption")
 def get_spool_consumption_history():
     dm = get_data_manager()
@@ -290,11 +367,40 @@ def get_activity_logs():
         return internal_error(str(e))
 
 
+@app.route("/api/admin/pool-stats")
+def get_pool_stats():
+    """آمار سلامت connection pool (checkout، زمان انتظار، overflow، invalidation، اتصال‌های طولانی)."""
+    dm = get_data_manager()
+    if not dm:
+        return internal_error("Database not available")
+
+    try:
+        return jsonify(dm.get_pool_stats())
+    except Exception as e:
+        logger.exception("get_pool_stats failed: %s", e)
+        return internal_error(str(e))
+
+
+@app.route("/api/admin/cache-stats")
+def get_cache_stats():
+    """آمار hit/miss cache پیشرفت پروژه و خطوط."""
+    dm = get_data_manager()
+    if not dm:
+        return internal_error("Database not available")
+
+    try:
+        return jsonify(dm.get_progress_cache_stats())
+    except Exception as e:
+        logger.exception("get_cache_stats failed: %s", e)
+        return internal_error(str(e))
+
+
 # Optional admin endpoint to force reinitialization (useful when you change ENV creds)
 @app.route("/api/admin/reload-db", methods=["POST"])
 def admin_reload_db():
     # NOTE: Add authentication in production or protect this endpoint
     global _dm_instance
+    shutdown_data_manager()
     _dm_instance = None
     dm = get_data_manager(force_reinit=True)
     if not dm:
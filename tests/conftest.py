@@ -0,0 +1,81 @@
+# tests/conftest.py
+
+import os
+import sys
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_manager import DataManager  # noqa: E402
+from models import Base, Project, MTOItem, Spool, SpoolItem  # noqa: E402
+
+# برای اجرای تست‌ها روی PostgreSQL (مثلاً رفتار قفل ردیف‌ها) آدرس دیتابیس تست را در این متغیر بگذارید
+TEST_DATABASE_URL_ENV = "MIT_TEST_DATABASE_URL"
+
+
+def make_data_manager(engine) -> DataManager:
+    """DataManager روی engine داده‌شده، بدون اتصال به PostgreSQL تعریف‌شده در config.ini."""
+    dm = DataManager.__new__(DataManager)
+    dm.engine = engine
+    Base.metadata.create_all(engine)
+    dm._install_search_indexes()
+    dm.Session = sessionmaker(bind=engine)
+    dm._install_progress_cache(dm.Session)
+    dm._install_line_suggestions(dm.Session)
+    dm._iso_rebuild_lock = threading.Lock()
+    return dm
+
+
+def seed_project(dm: DataManager, project_name: str = "P1", line_nos=("L1",), n_items: int = 20) -> int:
+    """
+    یک پروژه که هر خط آن n_items آیتم MTO (پایپ، زانو و فلنج به تناوب) دارد؛ id پروژه را برمی‌گرداند.
+    مثل ایمپورت MTO، خلاصه‌های پیشرفت پروژه همراه commit ساخته می‌شوند.
+    """
+    session = dm.get_session()
+    try:
+        project = Project(name=project_name)
+        session.add(project)
+        session.flush()
+        for line_no in line_nos:
+            for i in range(n_items):
+                item_type = ("PIPE", "ELBOW", "FLANGE")[i % 3]
+                session.add(MTOItem(
+                    project_id=project.id, line_no=line_no, item_type=item_type, item_code=f"C{i}",
+                    description=f"D{i}", p1_bore_in=float(2 + i % 4), unit="m", inch_dia=float(10 + i),
+                    length_m=10.0 if item_type == "PIPE" else None,
+                    quantity=None if item_type == "PIPE" else 5.0,
+                ))
+        dm._mark_progress_dirty(session, project.id)
+        session.commit()
+        return project.id
+    finally:
+        session.close()
+
+
+def seed_spool_item(dm: DataManager, spool_id: str, qty_available: float) -> int:
+    """یک اسپول با یک آیتم (زانو) با موجودی داده‌شده؛ id آیتم اسپول را برمی‌گرداند."""
+    session = dm.get_session()
+    try:
+        spool = Spool(spool_id=spool_id)
+        session.add(spool)
+        session.flush()
+        item = SpoolItem(spool_id_fk=spool.id, component_type="ELL", p1_bore=2.0, qty_available=qty_available)
+        session.add(item)
+        session.commit()
+        return item.id
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def dm():
+    """DataManager روی SQLite درون‌حافظه‌ای."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    manager = make_data_manager(engine)
+    yield manager
+    manager.shutdown()
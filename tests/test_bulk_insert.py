@@ -0,0 +1,136 @@
+# tests/test_bulk_insert.py
+"""
+درج گروهی DataFrame (DataManager._bulk_insert_dataframe): مسیر executemany روی SQLite و مسیر COPY روی
+PostgreSQL باید مقادیر یکسان ذخیره کنند، از جمله متن‌های دارای کاما، کوتیشن، خط جدید و بک‌اسلش.
+دستور COPY و داده‌ی CSV آن بدون دیتابیس بررسی می‌شوند؛ اجرای واقعی آن روی PostgreSQL فقط با تنظیم MIT_TEST_DATABASE_URL است.
+"""
+
+import csv
+import io
+import logging
+import os
+import uuid
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, select
+
+from conftest import TEST_DATABASE_URL_ENV, make_data_manager
+from data_manager import _DataFrameCsvStream
+from models import MTOItem, Project, Spool
+
+DESCRIPTIONS = ['ELBOW 90, LR', 'PIPE 2" SCH40', '"quoted"', 'two\nlines', 'back\\slash', r'\N', '', None]
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def bulk_dm(request, tmp_path):
+    if request.param == "postgresql":
+        url = os.getenv(TEST_DATABASE_URL_ENV)
+        if not url:
+            pytest.skip(f"{TEST_DATABASE_URL_ENV} تنظیم نشده است")
+        engine = create_engine(url)
+    else:
+        engine = create_engine(f"sqlite:///{tmp_path / 'bulk.db'}")
+    manager = make_data_manager(engine)
+    yield manager
+    manager.shutdown()
+
+
+def test_csv_stream_round_trips_special_characters():
+    df = pd.DataFrame({'description': DESCRIPTIONS, 'quantity': [1.5, None, 2, 0, -1, 3.25, 4, 5]})
+
+    # read با اندازه‌ی کوچک از وسط ردیف‌ها و تکه‌های DataFrame عبور می‌کند
+    stream, text = _DataFrameCsvStream(df, chunk_size=3), ""
+    while data := stream.read(7):
+        text += data
+
+    assert text == df.to_csv(index=False, header=False, na_rep='', lineterminator='\n')
+    rows = list(csv.reader(io.StringIO(text)))
+    assert [row[0] for row in rows] == [value or '' for value in DESCRIPTIONS]
+
+
+class RecordingCursor:
+    """cursor جایگزین که دستور COPY و داده‌ی ارسالی را نگه می‌دارد."""
+
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, sql, stream):
+        self.copies.append((sql, stream.read()))
+
+    def close(self):
+        pass
+
+
+def postgres_session(cursor):
+    """سشنی که برای _bulk_insert_dataframe مثل یک اتصال PostgreSQL با psycopg2 رفتار می‌کند."""
+    return SimpleNamespace(
+        get_bind=lambda: SimpleNamespace(dialect=SimpleNamespace(name="postgresql")),
+        connection=lambda: SimpleNamespace(connection=SimpleNamespace(cursor=lambda: cursor)),
+    )
+
+
+def test_postgresql_uses_copy_with_csv_quoting(dm, caplog):
+    cursor = RecordingCursor()
+    df = pd.DataFrame({
+        'project_id': [1, 1], 'line_no': ['L1', 'L2'], 'description': ['ELBOW 90, "LR"', None],
+        'p1_bore_in': ['2', 'x'],
+    })
+
+    with caplog.at_level(logging.INFO):
+        assert dm._bulk_insert_dataframe(postgres_session(cursor), MTOItem, df) == 2
+
+    assert "Bulk load (COPY): 2 rows into 'mto_items'" in caplog.text
+    [(sql, data)] = cursor.copies
+    assert sql == ('COPY "mto_items" ("project_id", "line_no", "description", "p1_bore_in") FROM STDIN '
+                   'WITH (FORMAT csv, FORCE_NOT_NULL ("line_no", "description"))')
+    # کوتیشن داخل متن دوتایی می‌شود؛ عدد نامعتبر خالیِ بدون کوتیشن (NULL) است
+    assert data == '1,L1,"ELBOW 90, ""LR""",2.0\n1,L2,,\n'
+
+
+def test_bulk_insert_dataframe_stores_same_values_on_both_paths(bulk_dm, caplog):
+    dm = bulk_dm
+    run_id = uuid.uuid4().hex[:8]
+    mto_df = pd.DataFrame({
+        'line_no': [f'L{i}' for i in range(len(DESCRIPTIONS))],
+        'description': DESCRIPTIONS,
+        'item_code': [f'C{i}' for i in range(len(DESCRIPTIONS))],
+        'p1_bore_in': ['2', '', 'x', '1.5', None, '3', '4', '0.75'],
+        'not_a_column': 'ignored',
+    })
+    spool_df = pd.DataFrame({
+        'spool_id': [f'{run_id}-S1', f'{run_id}-S2', f'{run_id}-S3'],
+        'row_no': ['3', 'A', '2.0'],
+        'location': ['YARD, 1', '', None],
+    })
+
+    session = dm.get_session()
+    try:
+        project = Project(name=f'BULK-{run_id}')
+        session.add(project)
+        session.flush()
+        mto_df['project_id'] = project.id
+
+        with caplog.at_level(logging.INFO):
+            assert dm._bulk_insert_dataframe(session, MTOItem, mto_df, chunk_size=3) == len(DESCRIPTIONS)
+            assert dm._bulk_insert_dataframe(session, Spool, spool_df, chunk_size=2) == 3
+
+        method = "COPY" if dm.engine.dialect.name == "postgresql" else "executemany"
+        assert f"Bulk load ({method}): {len(DESCRIPTIONS)} rows into 'mto_items'" in caplog.text
+        assert f"Bulk load ({method}): 3 rows into 'spools'" in caplog.text
+
+        items = session.execute(select(MTOItem.description, MTOItem.p1_bore_in)
+                                .where(MTOItem.project_id == project.id).order_by(MTOItem.line_no)).all()
+        spools = session.execute(select(Spool.row_no, Spool.location)
+                                 .where(Spool.spool_id.like(f'{run_id}-%')).order_by(Spool.spool_id)).all()
+    finally:
+        # چیزی در دیتابیس تست باقی نمی‌ماند
+        session.rollback()
+        session.close()
+
+    # متن خالی و None هر دو رشته‌ی خالی ذخیره می‌شوند؛ عدد نامعتبر یا خالی NULL است
+    assert [tuple(item) for item in items] == [
+        ('ELBOW 90, LR', 2.0), ('PIPE 2" SCH40', None), ('"quoted"', None), ('two\nlines', 1.5),
+        ('back\\slash', None), (r'\N', 3.0), ('', 4.0), ('', 0.75)]
+    assert [tuple(spool) for spool in spools] == [(3, 'YARD, 1'), (None, ''), (2, '')]
@@ -0,0 +1,102 @@
+# tests/test_event_handlers.py
+"""
+ثبت MIV از فرم اصلی: دیالوگ مصرف فقط می‌خواند و بررسی تکرار تگ، ساخت ردیف‌های پیشرفت خط و لاگ فعالیت
+همگی داخل همان یک تراکنش register_miv_record انجام می‌شوند.
+"""
+
+import os
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt6.QtWidgets")
+
+from conftest import seed_project  # noqa: E402
+from event_handlers import EventHandlers  # noqa: E402
+from models import ActivityLog, MTOProgress  # noqa: E402
+from mto_consumption_dialog import MTOConsumptionDialog  # noqa: E402
+
+
+class FakeEntry:
+    def __init__(self, text):
+        self._text = text
+
+    def text(self):
+        return self._text
+
+    def clear(self):
+        self._text = ""
+
+
+class FakeProject:
+    def __init__(self, project_id):
+        self.id = project_id
+
+
+class FakeMainWindow:
+    def __init__(self, dm, project_id, miv_tag):
+        self.dm = dm
+        self.current_project = FakeProject(project_id)
+        self.current_user = "test"
+        self.entries = {field: FakeEntry(value) for field, value in (
+            ("Line No", "L1"), ("MIV Tag", miv_tag), ("Location", ""), ("Status", ""), ("Registered For", ""))}
+        self.messages = []
+
+    def show_message(self, title, message, level):
+        self.messages.append((level, message))
+
+    def log_to_console(self, message, level):
+        self.messages.append((level, message))
+
+    def update_line_dashboard(self):
+        pass
+
+
+@pytest.fixture(scope="module")
+def qapp():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def consume_first_row(monkeypatch):
+    """به جای نمایش دیالوگ، مصرف مستقیم 1 برای ردیف اول وارد و تأیید می‌شود."""
+    def fake_exec(dialog):
+        dialog.table.cellWidget(0, 8).setValue(1)
+        dialog.accept_data()
+        return True
+
+    monkeypatch.setattr(MTOConsumptionDialog, "exec", fake_exec)
+
+
+def count_rows(dm, model):
+    session = dm.get_session()
+    try:
+        return session.query(model).count()
+    finally:
+        session.close()
+
+
+def test_handle_registration_commits_once(dm, qapp, consume_first_row):
+    project_id = seed_project(dm, n_items=6)
+    main_window = FakeMainWindow(dm, project_id, "T1")
+
+    with dm.statement_counter() as counter:
+        EventHandlers(main_window).handle_registration()
+
+    assert ("success", "رکورد با موفقیت ثبت شد.") in main_window.messages
+    assert counter['commits'] == 1
+    assert count_rows(dm, MTOProgress) == 6
+    assert count_rows(dm, ActivityLog) == 1
+
+
+def test_handle_registration_duplicate_tag_commits_nothing(dm, qapp, consume_first_row):
+    project_id = seed_project(dm, n_items=6)
+    EventHandlers(FakeMainWindow(dm, project_id, "T1")).handle_registration()
+    main_window = FakeMainWindow(dm, project_id, "T1")
+
+    with dm.statement_counter() as counter:
+        EventHandlers(main_window).handle_registration()
+
+    assert counter['commits'] == 0
+    assert ("error", "تگ 'T1' در این پروژه تکراری است.") in main_window.messages
+    assert count_rows(dm, ActivityLog) == 1
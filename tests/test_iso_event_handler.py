@@ -0,0 +1,63 @@
+# tests/test_iso_event_handler.py
+"""
+زمان‌بندی batchهای IsoIndexEventHandler: رویدادی که حین نوشتن یک batch می‌رسد باید با تایمر خودش
+نوشته شود و تا رویداد بعدی یا خروج برنامه در صف نماند.
+"""
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("PyQt6.QtCore")
+pytest.importorskip("watchdog.events")
+
+from watchdog.events import FileCreatedEvent  # noqa: E402
+
+from iso_event_handler import IsoIndexEventHandler  # noqa: E402
+
+BATCH_DELAY = 0.05
+WRITE_SECONDS = 0.5
+
+
+class SlowIndexWriter:
+    """جایگزین DataManager که هر نوشتن ایندکس ISO را WRITE_SECONDS طول می‌دهد."""
+
+    def __init__(self):
+        self.written = []
+        self.write_started = threading.Event()
+
+    def apply_iso_index_changes(self, file_mtimes, removed_paths):
+        self.write_started.set()
+        time.sleep(WRITE_SECONDS)
+        self.written.extend(file_mtimes)
+        return True, ""
+
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_event_during_flush_gets_its_own_batch(tmp_path):
+    first, second = tmp_path / "100-P-0001.pdf", tmp_path / "100-P-0002.pdf"
+    first.touch()
+    second.touch()
+    writer = SlowIndexWriter()
+    handler = IsoIndexEventHandler(writer, {'batch_delay': BATCH_DELAY})
+    try:
+        handler.on_created(FileCreatedEvent(str(first)))
+        assert writer.write_started.wait(2)
+
+        # batch اول هنوز در حال نوشتن است
+        handler.on_created(FileCreatedEvent(str(second)))
+
+        assert wait_until(lambda: str(second) in writer.written, WRITE_SECONDS * 2 + 1)
+        assert writer.written == [str(first), str(second)]
+        assert handler.get_statistics()['batch_queue_size'] == 0
+    finally:
+        handler.cleanup()
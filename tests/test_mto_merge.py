@@ -0,0 +1,78 @@
+# tests/test_mto_merge.py
+"""
+ادغام ریویژن جدید MTO (update_project_mto_from_csv با mode="merge"): نتیجه نباید به اندازه‌ی تکه‌های خواندن
+فایل بستگی داشته باشد، حتی وقتی یک خط یا آیتم‌های تکراری آن در چند تکه پخش شده‌اند.
+"""
+
+import pandas as pd
+import pytest
+from sqlalchemy import select
+
+import data_manager
+from models import MIVRecord, MTOConsumption, MTOItem, Project
+
+REVISION_1 = [
+    ("L1", "C1", "2", "1"), ("L1", "C1", "2", "1"), ("L1", "C2", "4", "2"),
+    ("L2", "C3", "2", "1"), ("L2", "C4", "2", "1"), ("L3", "C5", "6", "3"),
+]
+# L1: یکی از دو آیتم تکراری حذف و C2 ویرایش شده؛ C4 (مصرف‌شده) و L3 حذف شده‌اند؛ C6 جدید است
+REVISION_2 = [
+    ("L2", "C3", "2", "1"), ("L1", "C2", "4", "5"), ("L1", "C6", "2", "1"), ("L1", "C1", "2", "1"),
+]
+# C4 برمی‌گردد و دوباره فعال می‌شود؛ آیتم تکراری C1 دوباره اضافه می‌شود
+REVISION_3 = REVISION_2 + [("L2", "C4", "2", "1"), ("L1", "C1", "2", "1")]
+
+
+def write_mto(path, rows):
+    pd.DataFrame([{'LINE NO': line_no, 'ITEM CODE': code, 'DESCRIPTION': f"D-{code}", 'P1 BORE IN': bore,
+                   'TYPE': 'ELBOW', 'QUANTITY': quantity, 'INCH DIA': bore} for line_no, code, bore, quantity in rows]
+                 ).to_csv(path, index=False)
+    return str(path)
+
+
+def consume(dm, project_name, item_code):
+    session = dm.get_session()
+    try:
+        project_id = session.scalar(select(Project.id).where(Project.name == project_name))
+        record = MIVRecord(project_id=project_id, line_no="L2", miv_tag=f"T-{item_code}")
+        session.add(record)
+        session.flush()
+        item_id = session.scalar(select(MTOItem.id).where(MTOItem.project_id == project_id,
+                                                          MTOItem.item_code == item_code))
+        session.add(MTOConsumption(mto_item_id=item_id, miv_record_id=record.id, used_qty=1))
+        session.commit()
+    finally:
+        session.close()
+
+
+def project_items(dm, project_name):
+    session = dm.get_session()
+    try:
+        return sorted(session.execute(
+            select(MTOItem.line_no, MTOItem.item_code, MTOItem.quantity, MTOItem.is_active)
+            .join(Project, Project.id == MTOItem.project_id).where(Project.name == project_name)
+        ).all())
+    finally:
+        session.close()
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 2, 4])
+def test_merge_result_does_not_depend_on_chunk_size(dm, tmp_path, monkeypatch, chunk_size):
+    # پیمایش آیتم‌های حذف‌شده هم در چند صفحه انجام شود
+    monkeypatch.setattr(data_manager, "MTO_MERGE_SCAN_PAGE_SIZE", 2)
+    revisions = [write_mto(tmp_path / f"MTO-R{i}.csv", rows)
+                 for i, rows in enumerate((REVISION_1, REVISION_2, REVISION_3), 1)]
+
+    assert dm.update_project_mto_from_csv("P1", revisions[0], chunk_size=chunk_size)[0]
+    consume(dm, "P1", "C4")
+    ok, msg = dm.update_project_mto_from_csv("P1", revisions[1], chunk_size=chunk_size)
+    assert ok, msg
+    assert project_items(dm, "P1") == [
+        ("L1", "C1", 1.0, True), ("L1", "C2", 5.0, True), ("L1", "C6", 1.0, True),
+        ("L2", "C3", 1.0, True), ("L2", "C4", 1.0, False)]
+
+    ok, msg = dm.update_project_mto_from_csv("P1", revisions[2], chunk_size=chunk_size)
+    assert ok, msg
+    assert project_items(dm, "P1") == [
+        ("L1", "C1", 1.0, True), ("L1", "C1", 1.0, True), ("L1", "C2", 5.0, True), ("L1", "C6", 1.0, True),
+        ("L2", "C3", 1.0, True), ("L2", "C4", 1.0, True)]
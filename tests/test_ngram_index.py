@@ -0,0 +1,187 @@
+# tests/test_ngram_index.py
+"""
+ایندکس‌های درون‌حافظه‌ای ngram_index: درستی نتیجه‌ی جستجو، حتی وقتی نخ دیگری ایندکس را هم‌زمان بارگذاری می‌کند.
+"""
+
+import difflib
+import random
+
+import numpy as np
+import pytest
+
+import ngram_index
+from conftest import seed_project
+from models import IsoFileIndex
+from ngram_index import FuzzyLineMatcher, IsoNameIndex, NGramIndex, lcs_lengths, normalize_line_key
+
+ISO_NAMES = ["100-P-0001-SHT1", "100-P-0002-SHT1", "200-P-0001", "300-W-0456"]
+
+
+def build_ngram_index(values):
+    index = NGramIndex()
+    for value in values:
+        index.add(value)
+    return index
+
+
+def test_ngram_search_matches_substring_scan():
+    rng = random.Random(5)
+    values = ["".join(rng.choice("abAB-12") for _ in range(rng.randint(0, 12))) for _ in range(2000)] + [None]
+    index = build_ngram_index(values)
+    distinct = list(dict.fromkeys(value for value in values if value))
+    for _ in range(200):
+        term = "".join(rng.choice("abAB-12") for _ in range(rng.randint(3, 6)))
+        assert index.search(term) == [value for value in distinct if term.lower() in value.lower()]
+
+
+@pytest.mark.parametrize("term", [None, "", "a", "MI"])
+def test_ngram_search_short_term_returns_none(term):
+    # ایندکس برای کمتر از سه حرف کمکی نمی‌کند؛ فراخواننده LIKE اجرا می‌کند
+    assert build_ngram_index(["MIV-001", "MI"]).search(term) is None
+
+
+def test_ngram_search_folds_case_and_keeps_original_values():
+    index = build_ngram_index(["MIV-001-Abc", "miv-002-abc", "MIV-003-XYZ", "MIV-001-Abc"])
+
+    assert index.search("miv-00") == ["MIV-001-Abc", "miv-002-abc", "MIV-003-XYZ"]
+    assert index.search("ABC") == ["MIV-001-Abc", "miv-002-abc"]
+    assert index.search("xYz") == ["MIV-003-XYZ"]
+    assert index.search("abcd") == []
+
+
+def test_ngram_search_limit_overflow_returns_none():
+    index = build_ngram_index([f"MIV-{i:03d}" for i in range(10)])
+
+    assert len(index.search("MIV", limit=10)) == 10
+    assert index.search("MIV", limit=9) is None
+    assert index.search("MIV-005", limit=1) == ["MIV-005"]
+
+
+def test_substring_search_follows_inserts_and_deletes(dm):
+    project_id = seed_project(dm, n_items=1)
+    for tag in ("MIV-100_A", "MIV-1000A", "MIV-200"):
+        assert dm.register_miv_record(project_id, {
+            'Line No': 'L1', 'MIV Tag': tag, 'Location': '', 'Status': '', 'Registered For': '',
+            'Registered By': 'test', 'Comment': ''
+        }, [])[0]
+
+    def tags(term):
+        return sorted(row['miv_tag'] for row in dm.search_miv_by_tag(term))
+
+    # _ حرف عادی است، نه wildcard
+    assert tags("100_") == ["MIV-100_A"]
+    assert tags("miv-1") == ["MIV-1000A", "MIV-100_A"]
+
+    assert tags("200") == ["MIV-200"]
+    ok, msg = dm.delete_miv_record(next(r.id for r in dm.search_miv_by_line_no(project_id, "L1")
+                                        if r.miv_tag == "MIV-200"))
+    assert ok, msg
+    assert tags("200") == []
+    assert tags("MIV") == ["MIV-1000A", "MIV-100_A"]
+
+
+def reference_lcs(a, b):
+    """LCS با برنامه‌ریزی پویای معمولی."""
+    previous = [0] * (len(b) + 1)
+    for char_a in a:
+        current = [0]
+        for j, char_b in enumerate(b):
+            current.append(previous[j] + 1 if char_a == char_b else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def difflib_suggestions(lines, text, top_k, min_score):
+    """رفتار حلقه‌ی difflib قبلی suggest_line_no برای همه‌ی خط‌ها."""
+    query = FuzzyLineMatcher.normalize(text)
+    scored = [(difflib.SequenceMatcher(None, query, FuzzyLineMatcher.normalize(line)).ratio(), line)
+              for line in dict.fromkeys(lines)]
+    ranked = sorted([item for item in scored if item[0] >= min_score], key=lambda item: (-item[0], item[1]))
+    return [(line, round(score, 4)) for score, line in ranked[:top_k]]
+
+
+def random_line_nos(rng, count):
+    return [f'{rng.choice([2, 4, 6, 10])}"-{rng.choice(["P", "W", "FG"])}-{rng.randint(1, 999):03d}-'
+            f'{rng.choice(["A1A", "B2C"])}' for _ in range(count)]
+
+
+@pytest.mark.parametrize("query_length", [1, 7, 31, 63, 64])
+def test_lcs_lengths_matches_reference_dp(query_length):
+    rng = random.Random(query_length)
+    query = "".join(rng.choice("ab-1\"2") for _ in range(query_length))
+    rows = ["".join(rng.choice("ab-1\"2") for _ in range(rng.randint(0, 80))) for _ in range(300)]
+    lengths = np.array([len(row) for row in rows], dtype=np.int64)
+    # سطرهای کوتاه‌تر با کد یکی از کاراکترهای ورودی پر می‌شوند تا پرکردن روی نتیجه اثر نگذارد
+    codes = np.full((len(rows), int(lengths.max())), ord(query[0]), dtype=np.uint32)
+    for i, row in enumerate(rows):
+        codes[i, :len(row)] = [ord(char) for char in row]
+
+    lcs = lcs_lengths(np.array([ord(char) for char in query], dtype=np.uint32), codes, lengths)
+
+    assert lcs.tolist() == [reference_lcs(query, row) for row in rows]
+
+
+def test_fuzzy_line_matcher_matches_difflib():
+    rng = random.Random(7)
+    lines = random_line_nos(rng, 500)
+    matcher = FuzzyLineMatcher(lines)
+    for line in rng.sample(lines, 40):
+        query = list(line.lower())
+        for _ in range(rng.randint(0, 4)):
+            query[rng.randrange(len(query))] = rng.choice("0123456789-p")
+        query = "".join(query)
+        for top_k, min_score in ((1, 0.6), (5, 0.6), (20, 0.3)):
+            assert matcher.search(query, top_k, min_score) == difflib_suggestions(lines, query, top_k, min_score)
+
+
+def test_fuzzy_line_matcher_long_query_falls_back_to_difflib():
+    rng = random.Random(3)
+    lines = random_line_nos(rng, 200) + ["10\"-P-001-A1A-" + "X" * 60]
+    query = "10\"-P-001-A1A-" + "X" * 58
+    assert len(FuzzyLineMatcher.normalize(query)) > FuzzyLineMatcher.MAX_QUERY_LENGTH
+
+    results = FuzzyLineMatcher(lines).search(query, top_k=3, min_score=0.1)
+
+    assert results == difflib_suggestions(lines, query, 3, 0.1)
+    assert results[0][0] == lines[-1]
+
+
+def test_fuzzy_threshold_uses_difflib_ratio(dm):
+    # LCS («22a») امتیاز 0.75 می‌دهد ولی SequenceMatcher.ratio فقط 0.5 است؛ پیشنهاد نباید از مقدار قبلی سهل‌گیرتر شود
+    project_id = seed_project(dm, line_nos=("2-2A",))
+
+    assert FuzzyLineMatcher(["2-2A"]).search("2A2A") == []
+    assert dm.suggest_line_no(project_id, "2A2A") is None
+    assert dm.suggest_line_no(project_id, "2-2B") == "2-2A"
+
+
+def seed_iso_files(dm, names):
+    session = dm.get_session()
+    try:
+        session.add_all([IsoFileIndex(file_path=f"/iso/{name}.pdf", normalized_name=normalize_line_key(name),
+                                      prefix_key=name.split("-")[0]) for name in names])
+        session.commit()
+    finally:
+        session.close()
+
+
+def test_iso_search_survives_reload_during_scoring(dm, monkeypatch):
+    seed_iso_files(dm, ISO_NAMES)
+    index = IsoNameIndex(IsoFileIndex)
+    scoring = ngram_index.lcs_lengths
+
+    def lcs_lengths_during_reload(*args):
+        # بارگذاری کامل در نخ دیگر بین امتیازدهی و ساخت نتیجه؛ slotهای قبلی دیگر معتبر نیستند
+        with index._lock:
+            index._reset()
+        return scoring(*args)
+
+    monkeypatch.setattr(ngram_index, "lcs_lengths", lcs_lengths_during_reload)
+    session = dm.get_session()
+    try:
+        results = index.search(session, normalize_line_key("100-P-0001"), "100")
+    finally:
+        session.close()
+
+    assert results[0][0] == "/iso/100-P-0001-SHT1.pdf"
+    assert {path for path, score in results} <= {f"/iso/{name}.pdf" for name in ISO_NAMES}
@@ -0,0 +1,129 @@
+# tests/test_query_counts.py
+"""
+تعداد دستورات SQL هر فراخوانی (DataManager.statement_counter) باید ثابت و مستقل از تعداد آیتم‌های خط باشد.
+اگر تغییری عمداً تعداد دستورات را عوض کرد، عددهای زیر را همراه با دلیلش به‌روز کنید.
+"""
+
+import pytest
+
+from conftest import seed_project
+from models import ActivityLog, MTOItem, MTOProgress
+
+ITEM_COUNTS = [6, 60]
+
+
+@pytest.mark.parametrize("n_items", ITEM_COUNTS)
+def test_is_line_complete_is_one_query(dm, n_items):
+    project_id = seed_project(dm, n_items=n_items)
+
+    with dm.statement_counter() as counter:
+        assert dm.is_line_complete(project_id, "L1") is False
+
+    assert counter == {'statements': 1, 'commits': 0}
+
+
+@pytest.mark.parametrize("n_items", ITEM_COUNTS)
+def test_initialize_mto_progress_for_line_statement_count(dm, n_items):
+    project_id = seed_project(dm, n_items=n_items)
+
+    with dm.statement_counter() as counter:
+        dm.initialize_mto_progress_for_line(project_id, "L1")
+
+    # یک INSERT ... SELECT؛ پیش از commit: خواندن و upsert خلاصه‌ی خط (۳) و یک UPDATE نسبی روی
+    # خلاصه‌ی پروژه (تجمیع روزانه بدون مصرف جدید دست نمی‌خورد)
+    assert counter == {'statements': 5, 'commits': 1}
+
+
+@pytest.mark.parametrize("n_items", ITEM_COUNTS)
+def test_initialize_mto_progress_for_lines_statement_count(dm, n_items):
+    project_id = seed_project(dm, line_nos=("L1", "L2", "L3"), n_items=n_items)
+
+    with dm.statement_counter() as counter:
+        dm.initialize_mto_progress_for_lines(project_id, ["L1", "L2", "L3"])
+
+    assert counter == {'statements': 5, 'commits': 1}
+
+
+@pytest.mark.parametrize("n_items", ITEM_COUNTS)
+def test_update_mto_progress_statement_count(dm, n_items):
+    project_id = seed_project(dm, n_items=n_items)
+    dm.initialize_mto_progress_for_line(project_id, "L1")
+    updates = [(f"C{i}", 1, "m", f"D{i}") for i in range(n_items)]
+
+    with dm.statement_counter() as counter:
+        dm.update_mto_progress(project_id, "L1", updates)
+
+    # خواندن گروه‌بندی‌شده‌ی خط، خواندن ردیف‌های پیشرفت و یک UPDATE گروهی؛ ۴ دستور بعدی مربوط به
+    # خلاصه‌ی خط (۳) و UPDATE نسبی خلاصه‌ی پروژه است
+    assert counter == {'statements': 7, 'commits': 1}
+
+
+def line_item_ids(dm, project_id):
+    session = dm.get_session()
+    try:
+        return [item_id for item_id, in session.query(MTOItem.id).filter(MTOItem.project_id == project_id)]
+    finally:
+        session.close()
+
+
+def register(dm, project_id, tag, item_ids, used_qty):
+    form_data = {
+        'Line No': 'L1', 'MIV Tag': tag, 'Location': '', 'Status': '',
+        'Registered For': '', 'Registered By': 'test', 'Comment': ''
+    }
+    return dm.register_miv_record(project_id, form_data, [
+        {'mto_item_id': item_id, 'used_qty': used_qty} for item_id in item_ids
+    ])
+
+
+@pytest.mark.parametrize("n_items", ITEM_COUNTS)
+def test_register_miv_record_statement_count(dm, n_items, monkeypatch):
+    project_id = seed_project(dm, n_items=n_items)
+    item_ids = line_item_ids(dm, project_id)
+    sessions = []
+    session_factory = dm.Session
+    monkeypatch.setattr(dm, "Session", lambda: sessions.append(1) or session_factory())
+
+    # اولین MIV خط بدون مقداردهی قبلی پیشرفت: بررسی تکرار تگ، درج MIV، یک INSERT گروهی مصرف، ساخت ردیف‌های
+    # پیشرفت خط (۵)، لاگ فعالیت؛ پیش از commit: تجمیع روزانه، خلاصه‌ی خط (۳) و UPDATE نسبی خلاصه‌ی پروژه
+    with dm.statement_counter() as counter:
+        assert register(dm, project_id, "T1", item_ids, 0.5)[0]
+    assert counter == {'statements': 14, 'commits': 1}
+    assert len(sessions) == 1
+
+    # ردیف‌های پیشرفت از قبل وجود دارند: خواندن آیتم‌ها و یک UPDATE گروهی به جای ساخت ردیف‌ها
+    with dm.statement_counter() as counter:
+        assert register(dm, project_id, "T2", item_ids, 0.1)[0]
+    assert counter == {'statements': 11, 'commits': 1}
+
+    session = session_factory()
+    try:
+        assert session.query(MTOProgress).count() == n_items
+        assert session.query(ActivityLog).filter(ActivityLog.action == "REGISTER_MIV").count() == 2
+    finally:
+        session.close()
+
+
+def test_register_miv_record_duplicate_tag_commits_nothing(dm):
+    project_id = seed_project(dm, n_items=6)
+    item_ids = line_item_ids(dm, project_id)
+    assert register(dm, project_id, "T1", item_ids, 0.5)[0]
+
+    with dm.statement_counter() as counter:
+        ok, msg = register(dm, project_id, "T1", item_ids, 0.5)
+
+    assert not ok and "تکراری" in msg
+    assert counter == {'statements': 1, 'commits': 0}
+
+
+def test_enriched_line_progress_reads_without_writing(dm):
+    project_id = seed_project(dm, n_items=6)
+
+    # دیالوگ مصرف پیش از اولین MIV خط: آمار در حافظه محاسبه می‌شود و ردیفی ساخته نمی‌شود
+    with dm.statement_counter() as counter:
+        progress = dm.get_enriched_line_progress(project_id, "L1")
+    assert counter['commits'] == 0
+    assert len(progress) == 6
+
+    dm.initialize_mto_progress_for_line(project_id, "L1")
+    assert dm.get_enriched_line_progress(project_id, "L1") == progress
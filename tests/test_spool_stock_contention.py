@@ -0,0 +1,84 @@
+# tests/test_spool_stock_contention.py
+"""
+ثبت همزمان مصرف اسپول روی یک آیتم با موجودی محدود (مسیر UPDATE ... WHERE qty_available >= :q).
+به صورت پیش‌فرض روی فایل SQLite اجرا می‌شود؛ برای سنجش قفل ردیف‌ها روی PostgreSQL
+متغیر MIT_TEST_DATABASE_URL را تنظیم کنید. نرخ ثبت با pytest -s چاپ می‌شود.
+"""
+
+import os
+import threading
+import time
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, func
+
+from conftest import TEST_DATABASE_URL_ENV, make_data_manager, seed_project, seed_spool_item
+from models import SpoolConsumption, SpoolItem
+
+STOCK = 50
+THREADS = 8
+REGISTRATIONS_PER_THREAD = 20
+
+
+@pytest.fixture
+def contention_dm(tmp_path):
+    url = os.getenv(TEST_DATABASE_URL_ENV)
+    if url:
+        engine = create_engine(url, pool_size=THREADS, max_overflow=0)
+    else:
+        # SQLite نوشتن‌ها را سریالی می‌کند؛ timeout بالا تا threadها به جای خطای قفل منتظر بمانند
+        engine = create_engine(f"sqlite:///{tmp_path / 'contention.db'}",
+                               connect_args={"check_same_thread": False, "timeout": 60},
+                               pool_size=THREADS, max_overflow=0)
+    manager = make_data_manager(engine)
+    yield manager
+    manager.shutdown()
+
+
+def test_concurrent_spool_registrations_never_oversell(contention_dm):
+    dm = contention_dm
+    run_id = uuid.uuid4().hex[:8]
+    project_id = seed_project(dm, project_name=f"CONTENTION-{run_id}", n_items=1)
+    spool_item_id = seed_spool_item(dm, f"CONTENTION-{run_id}", STOCK)
+
+    succeeded = []
+    lock = threading.Lock()
+
+    def worker(thread_no):
+        for k in range(REGISTRATIONS_PER_THREAD):
+            form_data = {
+                'Line No': 'L1', 'MIV Tag': f'{run_id}-{thread_no}-{k}', 'Location': '', 'Status': '',
+                'Registered For': '', 'Registered By': 'test', 'Comment': ''
+            }
+            ok, _ = dm.register_miv_record(project_id, form_data, [], spool_consumption_items=[
+                {'spool_item_id': spool_item_id, 'used_qty': 1}
+            ])
+            if ok:
+                with lock:
+                    succeeded.append((thread_no, k))
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(THREADS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    attempts = THREADS * REGISTRATIONS_PER_THREAD
+    print(f"\n{dm.engine.dialect.name}: {attempts} registrations from {THREADS} threads in {elapsed:.2f}s "
+          f"({attempts / elapsed:.0f} reg/s), {len(succeeded)} succeeded")
+
+    session = dm.get_session()
+    try:
+        consumed = session.query(func.count(SpoolConsumption.id), func.sum(SpoolConsumption.used_qty)) \
+            .filter(SpoolConsumption.spool_item_id == spool_item_id).one()
+        remaining = session.get(SpoolItem, spool_item_id).qty_available
+    finally:
+        session.close()
+
+    # دقیقاً به اندازه‌ی موجودی ثبت شده و هیچ مصرفی بیش از موجودی نیست
+    assert len(succeeded) == STOCK
+    assert consumed[0] == STOCK and consumed[1] == STOCK
+    assert remaining == 0